@@ -737,10 +737,20 @@ def crawl_archive(context: Context, blob_name: str) -> None:
         local_path.unlink(missing_ok=True)
 
 
-def crawl(context: Context) -> None:
-    # TODO: thread pool execution
-    # Load abbreviations once using the context
+def partitions(context: Context) -> List[str]:
+    """The archives are independent, so `zavod crawl --workers N` can parse
+    them in parallel processes."""
+    return sorted(list_prefix_internal(context))
+
+
+def crawl_partition(context: Context, blob_name: str) -> None:
+    # Load abbreviations once per process using the context
     global abbreviations
-    abbreviations = compile_abbreviations(context)
-    for blob_name in sorted(list_prefix_internal(context)):
-        crawl_archive(context, blob_name)
+    if abbreviations is None:
+        abbreviations = compile_abbreviations(context)
+    crawl_archive(context, blob_name)
+
+
+def crawl(context: Context) -> None:
+    for blob_name in partitions(context):
+        crawl_partition(context, blob_name)
@@ -49,6 +49,8 @@ setup(
         "structlog",
         "xlrd == 2.0.1",
         "cryptography",
+        "zstandard",
+        "msgpack",
     ],
     tests_require=[],
     entry_points={
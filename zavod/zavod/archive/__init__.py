@@ -1,17 +1,16 @@
-import csv
 import shutil
 from pathlib import Path
 from functools import lru_cache
 from typing import TYPE_CHECKING
-from typing import Optional, Generator, TextIO, Set
+from typing import Optional, Generator, BinaryIO, Set
 from rigour.mime.types import JSON
 from nomenklatura.statement import Statement
-from nomenklatura.statement.serialize import unpack_row
 from nomenklatura.versions import Version, VersionHistory
 
 from zavod import settings
 from zavod.logs import get_logger
 from zavod.archive.backend import get_archive_backend, ArchiveObject
+from zavod.archive.pack import read_pack_statements
 
 if TYPE_CHECKING:
     from zavod.meta.dataset import Dataset
@@ -31,6 +30,11 @@ RESOURCES_FILE = "resources.json"
 INDEX_FILE = "index.json"
 CATALOG_FILE = "catalog.json"
 VERSIONS_FILE = "versions.json"
+TIMESTAMPS_FILE = "timestamps.idx"
+SOURCES_FILE = "sources.json"
+TIMINGS_FILE = "timings.json"
+STORE_SNAPSHOT_FILE = "store.tar.gz"
+STORE_SNAPSHOT_META = "store.json"
 ARTIFACT_FILES = [
     ISSUES_FILE,
     ISSUES_LOG,
@@ -42,6 +46,11 @@ ARTIFACT_FILES = [
     DELTA_EXPORT_FILE,
     DELTA_INDEX_FILE,
     HASH_FILE,
+    TIMESTAMPS_FILE,
+    SOURCES_FILE,
+    STORE_SNAPSHOT_FILE,
+    STORE_SNAPSHOT_META,
+    TIMINGS_FILE,
 ]
 # Set a shorter cache TTL for index/meta files:
 SHORT_LIVED = (INDEX_FILE, CATALOG_FILE)
@@ -155,6 +164,21 @@ def get_artifact_object(
     return None
 
 
+def get_previous_artifact_object(
+    dataset_name: str, resource: str
+) -> Optional[ArchiveObject]:
+    """Get an artifact published in the same version as the latest statements
+    of the dataset, so that it is consistent with them."""
+    statements = get_artifact_object(dataset_name, STATEMENTS_FILE)
+    if statements is None:
+        return None
+    prefix, _ = statements.name.rsplit("/", 1)
+    object = get_archive_backend().get_object(f"{prefix}/{resource}")
+    if object.exists():
+        return object
+    return None
+
+
 def publish_dataset_version(dataset_name: str) -> None:
     """Publish the history of versions for a given dataset to the artifact directory."""
     path = dataset_resource_path(dataset_name, VERSIONS_FILE)
@@ -205,9 +229,8 @@ def publish_resource(
         latest_object.republish(release_name)
 
 
-def _read_fh_statements(fh: TextIO, external: bool) -> StatementGen:
-    for cells in csv.reader(fh):
-        stmt = unpack_row(cells, Statement)
+def _read_fh_statements(fh: BinaryIO, external: bool) -> StatementGen:
+    for stmt in read_pack_statements(fh):
         if not external and stmt.external:
             continue
         yield stmt
@@ -225,7 +248,7 @@ def iter_local_statements(dataset: "Dataset", external: bool = True) -> Statemen
     path = dataset_resource_path(dataset.name, STATEMENTS_FILE)
     if not path.exists():
         raise FileNotFoundError(f"Statements not found: {dataset.name}")
-    with open(path, "r") as fh:
+    with open(path, "rb") as fh:
         yield from _read_fh_statements(fh, external)
 
 
@@ -243,7 +266,7 @@ def _iter_scope_statements(dataset: "Dataset", external: bool = True) -> Stateme
             dataset=dataset.name,
             object=object.name,
         )
-        with object.open() as fh:
+        with object.open_binary() as fh:
             yield from _read_fh_statements(fh, external)
         return
     log.error(f"Cannot load statements for: {dataset.name}")
@@ -262,5 +285,5 @@ def iter_previous_statements(
                 dataset=scope.name,
                 object=object.name,
             )
-            with object.open() as fh:
+            with object.open_binary() as fh:
                 yield from _read_fh_statements(fh, external)
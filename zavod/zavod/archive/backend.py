@@ -2,7 +2,7 @@ import shutil
 import warnings
 from pathlib import Path
 from functools import cache
-from typing import cast, Dict, Optional, Type, TextIO
+from typing import cast, BinaryIO, Dict, Optional, Type, TextIO
 from google.cloud.storage import Client, Blob  # type: ignore
 
 from zavod import settings
@@ -45,6 +45,9 @@ class ArchiveObject(object):
     def open(self) -> TextIO:
         raise NotImplementedError
 
+    def open_binary(self) -> BinaryIO:
+        raise NotImplementedError
+
 
 class ArchiveBackend(object):
     def get_object(self, name: str) -> ArchiveObject:
@@ -84,6 +87,12 @@ class GoogleCloudObject(ArchiveObject):
         self.blob.reload()
         return cast(TextIO, self.blob.open(mode="r", chunk_size=BLOB_CHUNK))
 
+    def open_binary(self) -> BinaryIO:
+        if self.blob is None:
+            raise RuntimeError("Object does not exist: %s" % self.name)
+        self.blob.reload()
+        return cast(BinaryIO, self.blob.open(mode="rb", chunk_size=BLOB_CHUNK))
+
     def backfill(self, dest: Path) -> None:
         if self.blob is None:
             raise RuntimeError("Object does not exist: %s" % self.name)
@@ -150,6 +159,9 @@ class FileSystemObject(ArchiveObject):
     def open(self) -> TextIO:
         return open(self.path, "r", buffering=BLOB_CHUNK)
 
+    def open_binary(self) -> BinaryIO:
+        return open(self.path, "rb", buffering=BLOB_CHUNK)
+
     def backfill(self, dest: Path) -> None:
         log.info(
             f"Copying file: {self.path.stem}",
@@ -0,0 +1,186 @@
+import io
+import csv
+import struct
+import msgpack  # type: ignore
+from typing import Any, BinaryIO, Dict, Generator, List, Optional, Tuple, Union
+from nomenklatura.statement import Statement
+from nomenklatura.statement.serialize import PackStatementWriter, unpack_row
+from nomenklatura.util import pack_prop, unpack_prop
+
+from zavod.logs import get_logger
+
+log = get_logger(__name__)
+StatementGen = Generator[Statement, None, None]
+
+CSV_PACK = "csv"
+BINARY_PACK = "msgpack"
+PACK_FORMATS = [CSV_PACK, BINARY_PACK]
+
+# Binary packs start with this marker, followed by length-prefixed batches:
+PACK_MAGIC = b"ZVPACK\x00\x01"
+BATCH_HEADER = struct.Struct(">I")
+BATCH_SIZE = 10000
+
+TARGET = 1
+EXTERNAL = 2
+
+
+def _encode(values: List[Optional[str]]) -> Tuple[List[Optional[str]], List[int]]:
+    """Dictionary-encode a column of values."""
+    index: Dict[Optional[str], int] = {}
+    codes = [index.setdefault(value, len(index)) for value in values]
+    return list(index.keys()), codes
+
+
+class BinaryPackWriter(object):
+    """Write statements to a binary pack file.
+
+    The file consists of a header, followed by batches of statements which are
+    stored as msgpack-encoded columns. Columns with few distinct values (like the
+    entity ID, property, dataset and timestamps) are dictionary-encoded per batch.
+    Each batch is self-contained and prefixed with its length, so a pack can be
+    appended to, or truncated at a batch boundary.
+    """
+
+    def __init__(self, fh: BinaryIO, header: bool = True) -> None:
+        self.fh = fh
+        self._batch: List[Statement] = []
+        if header:
+            self.fh.write(PACK_MAGIC)
+
+    def write(self, stmt: Statement) -> None:
+        self._batch.append(stmt)
+        if len(self._batch) >= BATCH_SIZE:
+            self.flush()
+
+    def flush(self) -> None:
+        """Write the pending statements as a batch."""
+        if not len(self._batch):
+            return
+        batch = self._batch
+        self._batch = []
+        for stmt in batch:
+            if stmt.prop is None or stmt.schema is None:
+                raise ValueError("Cannot pack statement without prop and schema")
+        flags = [
+            (TARGET if s.target else 0) | (EXTERNAL if s.external else 0)
+            for s in batch
+        ]
+        data = [
+            len(batch),
+            _encode([s.entity_id for s in batch]),
+            _encode([pack_prop(s.schema, s.prop) for s in batch]),
+            [s.value for s in batch],
+            _encode([s.dataset for s in batch]),
+            _encode([s.lang for s in batch]),
+            [s.original_value for s in batch],
+            flags,
+            _encode([s.first_seen for s in batch]),
+            _encode([s.last_seen for s in batch]),
+            [s.id for s in batch],
+        ]
+        payload: bytes = msgpack.packb(data, use_bin_type=True)
+        self.fh.write(BATCH_HEADER.pack(len(payload)))
+        self.fh.write(payload)
+
+    def close(self) -> None:
+        self.flush()
+        self.fh.close()
+
+
+def _read_batch(data: List[Any]) -> StatementGen:
+    (
+        count,
+        (entity_ids, entity_codes),
+        (props, prop_codes),
+        values,
+        (datasets, dataset_codes),
+        (langs, lang_codes),
+        original_values,
+        flags,
+        (first_seens, first_codes),
+        (last_seens, last_codes),
+        ids,
+    ) = data
+    unpacked = [unpack_prop(p) for p in props]
+    for i in range(count):
+        schema, _, prop = unpacked[prop_codes[i]]
+        yield Statement(
+            entity_id=entity_ids[entity_codes[i]],
+            prop=prop,
+            schema=schema,
+            value=values[i],
+            dataset=datasets[dataset_codes[i]],
+            lang=langs[lang_codes[i]],
+            original_value=original_values[i],
+            first_seen=first_seens[first_codes[i]],
+            last_seen=last_seens[last_codes[i]],
+            target=bool(flags[i] & TARGET),
+            external=bool(flags[i] & EXTERNAL),
+            id=ids[i],
+        )
+
+
+def read_binary_pack(fh: BinaryIO) -> StatementGen:
+    """Read the statements from a binary pack file."""
+    magic = fh.read(len(PACK_MAGIC))
+    if magic != PACK_MAGIC:
+        raise ValueError("Not a binary statement pack")
+    while True:
+        header = fh.read(BATCH_HEADER.size)
+        if not len(header):
+            return
+        payload = b""
+        if len(header) == BATCH_HEADER.size:
+            (length,) = BATCH_HEADER.unpack(header)
+            payload = fh.read(length)
+        if len(header) < BATCH_HEADER.size or len(payload) < length:
+            log.warning("Statement pack is truncated, skipping incomplete batch")
+            return
+        yield from _read_batch(msgpack.unpackb(payload, raw=False))
+
+
+def read_pack_statements(fh: BinaryIO) -> StatementGen:
+    """Read the statements from a pack file in either the CSV or the binary pack
+    format, detected from the start of the file. The file handle must be seekable."""
+    if detect_pack_format(fh) == BINARY_PACK:
+        yield from read_binary_pack(fh)
+        return
+    text = io.TextIOWrapper(fh, encoding="utf-8", newline="")
+    try:
+        for cells in csv.reader(text):
+            yield unpack_row(cells, Statement)
+    finally:
+        # Leave closing the file handle to the caller:
+        text.detach()
+
+
+class CSVPackWriter(PackStatementWriter):
+    """Write statements to a CSV pack file."""
+
+    def flush(self) -> None:
+        """Write the pending statements to the file."""
+        if len(self._batch) > 0:
+            self.writer.writerows(self._batch)
+            self._batch.clear()
+        self.fh.flush()
+
+
+def get_pack_writer(
+    fh: BinaryIO, format: str, header: bool = True
+) -> Union[CSVPackWriter, BinaryPackWriter]:
+    """Create a statement writer for a binary file handle in the given format.
+    Set `header` to false to append to an existing pack file."""
+    if format == BINARY_PACK:
+        return BinaryPackWriter(fh, header=header)
+    if format == CSV_PACK:
+        text = io.TextIOWrapper(fh, encoding="utf-8", newline="")
+        return CSVPackWriter(text)
+    raise ValueError("Unknown statement pack format: %s" % format)
+
+
+def detect_pack_format(fh: BinaryIO) -> str:
+    """Detect the format of a pack file from its first bytes."""
+    magic = fh.read(len(PACK_MAGIC))
+    fh.seek(0)
+    return BINARY_PACK if magic == PACK_MAGIC else CSV_PACK
@@ -15,14 +15,22 @@ from zavod.meta import load_dataset_from_path, get_multi_dataset, Dataset
 from zavod.crawl import crawl_dataset
 from zavod.store import get_store
 from zavod.archive import clear_data_path, dataset_state_path
+from zavod.archive.pack import PACK_FORMATS, BINARY_PACK
 from zavod.exporters import export_dataset
 from zavod.dedupe import get_resolver, get_dataset_linker
 from zavod.dedupe import blocking_xref, merge_entities
 from zavod.dedupe import explode_cluster
 from zavod.runtime.versions import make_version
-from zavod.publish import publish_dataset, publish_failure
+from zavod.runtime.cache import get_cache, prune_cache
+from zavod.runtime.profile import get_profiler
+from zavod.runtime.timings import DatasetTimings
+from zavod.publish import publish_dataset
+from zavod.runner.run import run_dataset
+from zavod.runner.schedule import run_many as _run_many, OK
 from zavod.tools.load_db import load_dataset_to_db
 from zavod.tools.dump_file import dump_dataset_to_file
+from zavod.tools.convert_pack import convert_pack as _convert_pack
+from zavod.tools.convert_pack import benchmark_pack as _benchmark_pack
 from zavod.tools.summarize import summarize as _summarize
 from zavod.exc import RunFailedException
 from zavod.tools.wikidata import run_app
@@ -31,6 +39,7 @@ from zavod.validators import validate_dataset
 
 log = get_logger(__name__)
 STMT_FORMATS = click.Choice(FORMATS, case_sensitive=False)
+PACK_FORMAT_CHOICE = click.Choice(PACK_FORMATS, case_sensitive=False)
 
 
 def _load_dataset(path: Path) -> Dataset:
@@ -59,12 +68,31 @@ def cli(debug: bool = False) -> None:
 @click.argument("dataset_path", type=InPath)
 @click.option("-d", "--dry-run", is_flag=True, default=False)
 @click.option("-c", "--clear", is_flag=True, default=False)
-def crawl(dataset_path: Path, dry_run: bool = False, clear: bool = False) -> None:
+@click.option("-i", "--incremental", is_flag=True, default=False)
+@click.option("-r", "--resume", is_flag=True, default=False)
+@click.option("-w", "--workers", type=int, default=1)
+@click.option("-p", "--profile", is_flag=True, default=False)
+def crawl(
+    dataset_path: Path,
+    dry_run: bool = False,
+    clear: bool = False,
+    incremental: bool = False,
+    resume: bool = False,
+    workers: int = 1,
+    profile: bool = False,
+) -> None:
     dataset = _load_dataset(dataset_path)
     if clear:
         clear_data_path(dataset.name)
     try:
-        crawl_dataset(dataset, dry_run=dry_run)
+        with get_profiler(dataset, "crawl", profile):
+            crawl_dataset(
+                dataset,
+                dry_run=dry_run,
+                incremental=incremental,
+                resume=resume,
+                workers=workers,
+            )
     except RunFailedException:
         sys.exit(1)
 
@@ -72,16 +100,21 @@ def crawl(dataset_path: Path, dry_run: bool = False, clear: bool = False) -> Non
 @cli.command("validate", help="Check the integrity of a dataset")
 @click.argument("dataset_path", type=InPath)
 @click.option("-c", "--clear", is_flag=True, default=False)
-def validate(dataset_path: Path, clear: bool = False) -> None:
+@click.option("-p", "--profile", is_flag=True, default=False)
+def validate(dataset_path: Path, clear: bool = False, profile: bool = False) -> None:
     dataset = _load_dataset(dataset_path)
     if dataset.disabled:
         log.info("Dataset is disabled, skipping: %s" % dataset.name)
         sys.exit(0)
     linker = get_dataset_linker(dataset)
     store = get_store(dataset, linker)
+    timings = DatasetTimings(dataset)
     try:
-        store.sync(clear=clear)
-        validate_dataset(dataset, store.view(dataset, external=False))
+        with timings.phase("sync"):
+            store.sync(clear=clear)
+        with timings.phase("validate"):
+            with get_profiler(dataset, "validate", profile):
+                validate_dataset(dataset, store.view(dataset, external=False))
     except Exception:
         log.exception("Validation failed for %r" % dataset_path)
         store.close()
@@ -91,16 +124,21 @@ def validate(dataset_path: Path, clear: bool = False) -> None:
 @cli.command("export", help="Export data from a specific dataset")
 @click.argument("dataset_path", type=InPath)
 @click.option("-c", "--clear", is_flag=True, default=False)
-def export(dataset_path: Path, clear: bool = False) -> None:
+@click.option("-p", "--profile", is_flag=True, default=False)
+def export(dataset_path: Path, clear: bool = False, profile: bool = False) -> None:
     dataset = _load_dataset(dataset_path)
     if dataset.disabled:
         log.info("Dataset is disabled, skipping: %s" % dataset.name)
         sys.exit(0)
     linker = get_dataset_linker(dataset)
     store = get_store(dataset, linker)
+    timings = DatasetTimings(dataset)
     try:
-        store.sync(clear=clear)
-        export_dataset(dataset, store.view(dataset, external=False))
+        with timings.phase("sync"):
+            store.sync(clear=clear)
+        with timings.phase("export"):
+            with get_profiler(dataset, "export", profile):
+                export_dataset(dataset, store.view(dataset, external=False))
     except Exception:
         log.exception("Failed to export: %s" % dataset_path)
         sys.exit(1)
@@ -124,53 +162,69 @@ def publish(dataset_path: Path, latest: bool = False) -> None:
 @click.option("-l", "--latest", is_flag=True, default=False)
 @click.option("-c", "--clear", is_flag=True, default=False)
 @click.option("-x", "--external", is_flag=True, default=True)
+@click.option("-i", "--incremental", is_flag=True, default=False)
+@click.option("-p", "--profile", is_flag=True, default=False)
 def run(
     dataset_path: Path,
     latest: bool = False,
     clear: bool = False,
     external: bool = False,
+    incremental: bool = False,
+    profile: bool = False,
 ) -> None:
     dataset = _load_dataset(dataset_path)
-    if clear:
-        clear_data_path(dataset.name)
-    if dataset.disabled:
-        log.info("Dataset is disabled, skipping: %s" % dataset.name)
-        publish_failure(dataset, latest=latest)
-        sys.exit(0)
-    # Crawl
-    if dataset.entry_point is not None and not dataset.is_collection:
-        try:
-            crawl_dataset(dataset, dry_run=False)
-        except RunFailedException:
-            publish_failure(dataset, latest=latest)
-            sys.exit(1)
-    else:
-        make_version(dataset, settings.RUN_VERSION, overwrite=True)
+    ok = run_dataset(
+        dataset,
+        latest=latest,
+        clear=clear,
+        external=external,
+        incremental=incremental,
+        profile=profile,
+    )
+    if not ok:
+        sys.exit(1)
 
-    linker = get_dataset_linker(dataset)
-    store = get_store(dataset, linker)
-    # Validate
+
+@cli.command("run-many", help="Run many datasets in the order of their dependencies")
+@click.argument("dataset_paths", type=InPath, nargs=-1)
+@click.option("-l", "--latest", is_flag=True, default=False)
+@click.option("-c", "--clear", is_flag=True, default=False)
+@click.option("-x", "--external", is_flag=True, default=True)
+@click.option("-i", "--incremental", is_flag=True, default=False)
+@click.option("-w", "--workers", type=int, default=1)
+@click.option(
+    "-t",
+    "--timeout",
+    type=float,
+    default=None,
+    help="Terminate dataset runs which take longer than this (seconds)",
+)
+def run_many(
+    dataset_paths: List[Path],
+    latest: bool = False,
+    clear: bool = False,
+    external: bool = False,
+    incremental: bool = False,
+    workers: int = 1,
+    timeout: Optional[float] = None,
+) -> None:
+    datasets = [_load_dataset(path) for path in dataset_paths]
     try:
-        store.sync(clear=True)
-        view = store.view(dataset, external=False)
-        if not dataset.is_collection:
-            validate_dataset(dataset, view)
-    except Exception:
-        log.exception("Validation failed for %r" % dataset.name)
-        publish_failure(dataset, latest=latest)
-        store.close()
+        results = _run_many(
+            datasets,
+            workers=workers,
+            timeout=timeout,
+            latest=latest,
+            clear=clear,
+            external=external,
+            incremental=incremental,
+        )
+    except ValueError as exc:
+        log.error("Cannot run datasets: %s" % exc)
         sys.exit(1)
-    # Export and Publish
-    try:
-        export_dataset(dataset, view)
-        publish_dataset(dataset, latest=latest)
-
-        if not dataset.is_collection and dataset.load_db_uri is not None:
-            log.info("Loading dataset into database...", dataset=dataset.name)
-            load_dataset_to_db(dataset, linker, dataset.load_db_uri, external=external)
-        log.info("Dataset run is complete :)", dataset=dataset.name)
-    except Exception:
-        log.exception("Failed to export and publish %r" % dataset.name)
+    for name, result in results.items():
+        click.echo("%s: %s" % (name, result))
+    if any(r != OK for r in results.values()):
         sys.exit(1)
 
 
@@ -223,6 +277,39 @@ def dump_file(
         sys.exit(1)
 
 
+@cli.command("convert-pack", help="Convert the statements pack of a dataset")
+@click.argument("dataset_path", type=InPath)
+@click.option("-f", "--format", type=PACK_FORMAT_CHOICE, default=BINARY_PACK)
+def convert_pack(dataset_path: Path, format: str) -> None:
+    dataset = _load_dataset(dataset_path)
+    try:
+        _convert_pack(dataset, format)
+    except Exception:
+        log.exception("Failed to convert statements: %s" % dataset_path)
+        sys.exit(1)
+
+
+@cli.command("benchmark-pack", help="Compare the read speed of statement formats")
+@click.argument("dataset_path", type=InPath)
+def benchmark_pack(dataset_path: Path) -> None:
+    dataset = _load_dataset(dataset_path)
+    try:
+        for format, result in _benchmark_pack(dataset).items():
+            click.echo(
+                "%s: %d bytes, %d statements in %.2fs (%.0f/s)"
+                % (
+                    format,
+                    result["size"],
+                    result["statements"],
+                    result["seconds"],
+                    result["per_second"] or 0,
+                )
+            )
+    except Exception:
+        log.exception("Failed to benchmark statements: %s" % dataset_path)
+        sys.exit(1)
+
+
 @cli.command("xref", help="Generate dedupe candidates from the given dataset")
 @click.argument("dataset_paths", type=InPath, nargs=-1)
 @click.option("-c", "--clear", is_flag=True, default=False)
@@ -317,6 +404,33 @@ def clear(dataset_path: Path) -> None:
         sys.exit(1)
 
 
+@cli.command("cache-prune", help="Evict old entries from the cache of a dataset")
+@click.argument("dataset_path", type=InPath)
+@click.option(
+    "-a",
+    "--max-age",
+    type=int,
+    default=settings.CACHE_MAX_AGE_DAYS,
+    help="Evict entries which have not been used for this many days",
+)
+@click.option(
+    "-s",
+    "--max-size",
+    type=int,
+    default=settings.CACHE_MAX_SIZE_MB,
+    help="Evict the least recently used entries until the cache is smaller than this (MB)",
+)
+def cache_prune(dataset_path: Path, max_age: int, max_size: int) -> None:
+    try:
+        dataset = _load_dataset(dataset_path)
+        cache = get_cache(dataset)
+        prune_cache(cache, max_age=max_age, max_size=max_size * 1024 * 1024 or None)
+        cache.close()
+    except Exception:
+        log.exception("Failed to prune cache: %s" % dataset_path)
+        sys.exit(1)
+
+
 @cli.command("summarize")
 @click.argument("dataset_path", type=InPath)
 @click.option("-c", "--clear", is_flag=True, default=False)
@@ -1,8 +1,14 @@
+import os
 import orjson
 from pathlib import Path
 from datetime import datetime
+from collections import deque
+from itertools import islice
+from contextvars import copy_context
 from functools import cached_property
+from concurrent.futures import Future, ThreadPoolExecutor
 from typing import Any, Optional, Union, Dict, List
+from typing import Deque, Generator, Iterable, Tuple
 from requests import Response
 from prefixdate import DatePrefix
 from lxml import html, etree
@@ -10,6 +16,7 @@ from datapatch import LookupException, Result, Lookup
 from followthemoney.schema import Schema
 from followthemoney.util import make_entity_id
 from nomenklatura.versions import Version
+from nomenklatura.statement import Statement
 from nomenklatura.cache import Cache
 from nomenklatura.util import PathLike
 from rigour.urls import build_url, ParamsType
@@ -20,18 +27,30 @@ from zavod.audit import inspect
 from zavod.meta import Dataset, DataResource
 from zavod.entity import Entity
 from zavod.archive import dataset_resource_path, dataset_data_path
+from zavod.archive import dataset_state_path
 from zavod.runtime.versions import get_latest
 from zavod.runtime.stats import ContextStats
+from zavod.runtime.cleaning import get_value_cache
+from zavod.runtime.timings import DatasetTimings
 from zavod.runtime.sink import DatasetSink
 from zavod.runtime.issues import DatasetIssues
 from zavod.runtime.resources import DatasetResources
 from zavod.runtime.timestamps import TimeStampIndex
-from zavod.runtime.cache import get_cache
+from zavod.runtime.sources import DatasetSources, TRACKED
+from zavod.runtime.cache import get_cache, prune_cache, CompressedCache
 from zavod.runtime.versions import make_version
 from zavod.runtime.http_ import fetch_file, make_session, request_hash
+from zavod.runtime.http_ import get_validators, conditional_headers, validators_key
 from zavod.runtime.http_ import _Auth, _Headers, _Body
 from zavod.logs import get_logger
 from zavod.util import join_slug, prefixed_hash_id
+from zavod.exc import SourceUnchanged
+
+
+CHECKPOINT_FILE = "checkpoint.json"
+PARTITIONS_DIR = "partitions"
+# Number of entities stamped and stored together by `Context.emit_many`:
+EMIT_BATCH = 5000
 
 
 class Context:
@@ -45,17 +64,38 @@ class Context:
 
     SOURCE_TITLE = "Source data"
 
-    def __init__(self, dataset: Dataset, dry_run: bool = False):
+    def __init__(
+        self,
+        dataset: Dataset,
+        dry_run: bool = False,
+        incremental: bool = False,
+        partition: Optional[str] = None,
+    ):
         self.dataset = dataset
         self.dry_run = dry_run
+        self.incremental = incremental and not dry_run
+        self.partition = partition
+        """The key of the partition of the crawl run by this context, if any."""
         self.stats = ContextStats()
-        self.sink = DatasetSink(dataset)
-        self.issues = DatasetIssues(dataset)
+        # Count the property values cleaned for entities made by this context:
+        get_value_cache(dataset).stats = self.stats
+        if partition is None:
+            self.sink = DatasetSink(dataset)
+            self.issues = DatasetIssues(dataset)
+        else:
+            # Partitions write partial outputs, which are merged after the run:
+            self.sink = DatasetSink(dataset, path=self.partition_path(".pack"))
+            self.issues = DatasetIssues(dataset, path=self.partition_path(".log"))
         self.resources = DatasetResources(dataset)
+        self.sources = DatasetSources(dataset)
+        self.timings = DatasetTimings(dataset, enabled=not dry_run)
         self.log = get_logger(dataset.name)
         self.http = make_session(dataset.http)
+        self.http.hooks["response"].append(self._track_response)
         self._cache: Optional[Cache] = None
         self._timestamps: Optional[TimeStampIndex] = None
+        self._checkpoints: Dict[str, Any] = {}
+        self._lookup_results: Dict[Tuple[str, Optional[str]], Optional[Result]] = {}
 
         self._data_time: datetime = settings.RUN_TIME
         # If the dataset has a fixed end time which is in the past,
@@ -73,6 +113,7 @@ class Context:
     @property
     def cache(self) -> Cache:
         """A cache object for storing HTTP responses and other data."""
+        self.sources.record_untracked("cache")
         if self._cache is None:
             self._cache = get_cache(self.dataset)
         return self._cache
@@ -87,9 +128,26 @@ class Context:
         """An index of the first_seen time of every statement previous emitted by
         the dataset. This is used to determine if a statement is new or not."""
         if self._timestamps is None:
-            self._timestamps = TimeStampIndex.build(self.dataset)
+            if self.partition is not None:
+                # The index is built before the partitions are run:
+                self._timestamps = TimeStampIndex(self.dataset)
+            else:
+                with self.timings.phase("index") as record:
+                    self._timestamps = TimeStampIndex.build(self.dataset)
+                    record["statements"] = self._timestamps.count
         return self._timestamps
 
+    def partition_path(self, suffix: str, partition: Optional[str] = None) -> Path:
+        """The path of a partial output file written by a partition of the crawl.
+
+        Args:
+            suffix: The file name suffix, e.g. `.pack`.
+            partition: The key of the partition, defaults to that of the context.
+        """
+        path = dataset_state_path(self.dataset.name) / PARTITIONS_DIR
+        path.mkdir(parents=True, exist_ok=True)
+        return path / f"{partition or self.partition}{suffix}"
+
     @property
     def data_url(self) -> str:
         """The URL of the source data for the dataset."""
@@ -112,7 +170,7 @@ class Context:
     def data_time(self, value: datetime) -> None:
         """Modify the data time."""
         self._data_time = value
-        del self.data_time_iso
+        self.__dict__.pop("data_time_iso", None)
 
     @cached_property
     def data_time_iso(self) -> str:
@@ -133,19 +191,117 @@ class Context:
         if clear and not self.dry_run:
             self.resources.clear()
             self.issues.clear()
+            self.sources.clear()
+            self.timings.clear()
+            self.clear_checkpoint()
         self.stats.reset()
 
+    @property
+    def checkpoint_path(self) -> Path:
+        """The file in which the progress of the crawler is recorded."""
+        return dataset_state_path(self.dataset.name) / CHECKPOINT_FILE
+
+    def checkpoint(self, key: str, state: Any) -> None:
+        """Record the progress of the crawler, so that an interrupted run can be
+        resumed from this point using `zavod crawl --resume`. All entities emitted
+        so far are flushed to the statements file, and their position is stored
+        along with the given state. Checkpoints are ignored when running a
+        partition of the crawl.
+
+        ```python
+        page = context.resume_state("page", 1)
+        while True:
+            data = context.fetch_json(url, params={"page": page})
+            ...
+            page += 1
+            context.checkpoint("page", page)
+        ```
+
+        Args:
+            key: A name for the state, e.g. `page`.
+            state: Any JSON-serialisable value describing the completed work.
+        """
+        if self.dry_run or self.partition is not None:
+            return
+        self._checkpoints[key] = state
+        data = {
+            "version": self.version.id,
+            "offset": self.sink.flush(),
+            "stats": self.stats.to_dict(),
+            "states": self._checkpoints,
+        }
+        tmp_path = self.checkpoint_path.with_suffix(".tmp")
+        with open(tmp_path, "wb") as fh:
+            fh.write(orjson.dumps(data))
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def resume_state(self, key: str, default: Any = None) -> Any:
+        """Get the state last recorded for the given key using `checkpoint`.
+
+        Args:
+            key: The name of the state.
+            default: The value to return if the crawler is not being resumed.
+
+        Returns:
+            The recorded state, or the default.
+        """
+        return self._checkpoints.get(key, default)
+
+    def resume(self) -> bool:
+        """Resume an interrupted run from its last checkpoint: the statements
+        emitted before the checkpoint are kept, and the recorded states are made
+        available via `resume_state`. The kept statements are stamped with the
+        `data_time` of the resumed run, so that all statements of the version
+        share the same `last_seen` time.
+
+        Returns:
+            True if a checkpoint was found.
+        """
+        if not self.checkpoint_path.is_file():
+            return False
+        with open(self.checkpoint_path, "rb") as fh:
+            data = orjson.loads(fh.read())
+        self.sink.resume(
+            data["offset"], seen=self.data_time_iso, timestamps=self.timestamps
+        )
+        self._checkpoints = data.get("states", {})
+        for key, value in data.get("stats", {}).items():
+            setattr(self.stats, key, value)
+        # A resumed run is not reproducible from the sources it fetched:
+        self.sources.record_untracked("resume")
+        self.incremental = False
+        self.log.info(
+            "Resuming from checkpoint",
+            version=data.get("version"),
+            states=list(self._checkpoints),
+        )
+        return True
+
+    def clear_checkpoint(self) -> None:
+        """Delete the recorded progress of the crawler."""
+        self._checkpoints = {}
+        self.checkpoint_path.unlink(missing_ok=True)
+
     def close(self) -> None:
         """Flush and tear down the context."""
         self.http.close()
         if self._cache is not None:
+            if settings.CACHE_PRUNE:
+                max_size = settings.CACHE_MAX_SIZE_MB * 1024 * 1024
+                prune_cache(
+                    self._cache,
+                    max_age=settings.CACHE_MAX_AGE_DAYS,
+                    max_size=max_size or None,
+                )
+            if isinstance(self._cache, CompressedCache):
+                self.log.info("Cache statistics", **self._cache.stats())
             self._cache.close()
         if self._timestamps is not None:
             self._timestamps.close()
         self.sink.close()
         clear_contextvars()
         self.issues.close()
-        if not self.dry_run:
+        if not self.dry_run and self.partition is None:
             self.issues.export()
 
     def get_resource_path(self, name: PathLike) -> Path:
@@ -186,19 +342,67 @@ class Context:
         headers: Optional[Any] = None,
         method: str = "GET",
         data: _Body = None,
+        cache_days: Optional[int] = None,
+        checksum: Optional[str] = None,
+        connections: int = 1,
     ) -> Path:
         """Fetch a URL into a file located in the current run folder,
-        if it does not exist."""
-        return fetch_file(
-            self.http,
-            url,
-            name,
-            data_path=dataset_data_path(self.dataset.name),
-            auth=auth,
-            headers=headers,
-            method=method,
-            data=data,
-        )
+        if it does not exist. If `cache_days` is given, an existing file
+        older than that is revalidated with the server and downloaded again
+        only if it has changed.
+
+        Interrupted downloads are resumed if the server supports range requests,
+        and the file is only placed at its destination once it is complete.
+
+        The URL and a hash of the file are recorded as a source of the dataset,
+        which is used by incremental crawls to detect unchanged source data.
+
+        Args:
+            name: The name of the file, relative to the dataset data folder.
+            url: The URL to be fetched.
+            auth: HTTP basic authorization username and password to be included.
+            headers: HTTP request headers to be included.
+            method: The HTTP method to use for the request.
+            data: The data to be sent in the request body.
+            cache_days: Number of days after which an existing file is revalidated.
+            checksum: Expected digest of the file, e.g. `sha256:e3b0c4...`.
+            connections: Number of parallel connections used to fetch large files.
+
+        Returns:
+            The path of the downloaded file.
+        """
+        existing = self.get_resource_path(name)
+        previous = existing.stat() if existing.exists() else None
+        token = TRACKED.set(True)
+        try:
+            path = fetch_file(
+                self.http,
+                url,
+                name,
+                data_path=dataset_data_path(self.dataset.name),
+                auth=auth,
+                headers=headers,
+                method=method,
+                data=data,
+                cache_days=cache_days,
+                checksum=checksum,
+                connections=connections,
+            )
+        finally:
+            TRACKED.reset(token)
+        # Downloaded files replace the existing file, if any:
+        current = path.stat()
+        if previous is None or previous.st_ino != current.st_ino:
+            self.stats.add_http(size=current.st_size)
+        if method == "GET" and data is None:
+            self.sources.record(name, url, path)
+        else:
+            self.sources.record_untracked(url)
+        return path
+
+    def _track_response(self, response: Response, *args: Any, **kwargs: Any) -> None:
+        self.stats.add_http(requests=1)
+        self.sources.record_untracked(response.url)
 
     def fetch_response(
         self,
@@ -246,6 +450,7 @@ class Context:
             **kwargs,
         )
         response.raise_for_status()
+        self.stats.add_http(size=len(response.content))
         return response
 
     def fetch_text(
@@ -260,7 +465,9 @@ class Context:
     ) -> Optional[str]:
         """Execute an HTTP request using the contexts' session and return
         the decoded response body. If a `cache_days` argument is provided, a
-        cache will be used for the given number of days.
+        cache will be used for the given number of days. Once a cached GET
+        response has expired, it is revalidated with the server using its
+        `ETag` or `Last-Modified` headers rather than downloaded again.
 
         Args:
             url: The URL to be fetched.
@@ -275,34 +482,159 @@ class Context:
             The decoded response body as a string.
         """
         url = build_url(url, params)
-
+        fingerprint = request_hash(url, auth=auth, method=method, data=data)
+        stale: Optional[str] = None
         if cache_days is not None:
-            fingerprint = request_hash(url, auth=auth, method=method, data=data)
-            text = None
-
-            if method == "GET":
-                # keeping the old caching keys that was GET requests only
-                text = self.cache.get(url, max_age=cache_days)
-
-            if text is None:
-                # if the old cache is empty, try to get the cache by fingerprint
-                text = self.cache.get(fingerprint, max_age=cache_days)
-
+            text = self._get_cached(url, fingerprint, method, cache_days)
             if text is not None:
-                self.log.debug("HTTP cache hit", url=url, fingerprint=fingerprint)
                 return text
+            if method == "GET":
+                headers, stale = self._prepare_revalidation(fingerprint, headers)
 
         response = self.fetch_response(
             url, headers=headers, auth=auth, method=method, data=data
         )
+        if cache_days is not None:
+            return self._cache_response(fingerprint, response, stale)
+        return response.text
+
+    def _get_cached(
+        self, url: str, fingerprint: str, method: str, cache_days: int
+    ) -> Optional[str]:
+        """Look up the cached response body for a request, if any."""
+        text = None
+        if method == "GET":
+            # keeping the old caching keys that was GET requests only
+            text = self.cache.get(url, max_age=cache_days)
+
+        if text is None:
+            # if the old cache is empty, try to get the cache by fingerprint
+            text = self.cache.get(fingerprint, max_age=cache_days)
+
+        if text is not None:
+            self.log.debug("HTTP cache hit", url=url, fingerprint=fingerprint)
+            self.stats.cache_hits += 1
+        else:
+            self.stats.cache_misses += 1
+        return text
+
+    def _prepare_revalidation(
+        self, fingerprint: str, headers: _Headers
+    ) -> Tuple[_Headers, Optional[str]]:
+        """If an expired response is in the cache, make the request conditional so
+        that the server can confirm the cached copy is still valid."""
+        validators = self.cache.get_json(validators_key(fingerprint))
+        if validators is None:
+            return headers, None
+        stale = self.cache.get(fingerprint)
+        if stale is None:
+            return headers, None
+        return conditional_headers(headers, validators), stale
+
+    def _cache_response(
+        self, fingerprint: str, response: Response, stale: Optional[str]
+    ) -> Optional[str]:
+        """Store a response in the cache and return its body. If the server has
+        confirmed that an expired copy is still valid, refresh that instead."""
+        if response.status_code == 304 and stale is not None:
+            self.log.debug("HTTP cache revalidated", url=response.url)
+            self.cache.set(fingerprint, stale)
+            return stale
         text = response.text
         if text is None:
             return None
-
-        if cache_days is not None:
-            self.cache.set(fingerprint, text)
+        self.cache.set(fingerprint, text)
+        validators = get_validators(response)
+        if len(validators):
+            self.cache.set_json(validators_key(fingerprint), validators)
+        elif stale is not None:
+            self.cache.delete(validators_key(fingerprint))
         return text
 
+    def fetch_many(
+        self,
+        requests: Iterable[Union[str, Dict[str, Any]]],
+        cache_days: Optional[int] = None,
+        max_workers: Optional[int] = None,
+    ) -> Generator[Optional[str], None, None]:
+        """Execute a sequence of HTTP requests concurrently, using a bounded pool
+        of worker threads which share the contexts' session. The decoded response
+        bodies are yielded in the order in which the requests were given, so that
+        crawler output remains deterministic.
+
+        Cache lookups and writes happen on the calling thread, the worker threads
+        only perform the network requests.
+
+        Args:
+            requests: URLs to fetch, or dictionaries of keyword arguments for
+                `fetch_text` (`url`, `params`, `headers`, `auth`, `method`, `data`).
+            cache_days: Number of days to retain cached responses for. `None` to disable.
+            max_workers: Number of concurrent requests. Defaults to the `max_workers`
+                option in the `http` section of the dataset metadata.
+
+        Returns:
+            A generator of the decoded response bodies.
+        """
+        if max_workers is None:
+            max_workers = self.dataset.http.max_workers
+        # Keep a limited number of requests queued up ahead of the consumer:
+        window = max_workers * 2
+        pending: Deque[Tuple[str, Optional[str], Optional["Future[Response]"]]]
+        pending = deque()
+        executor = ThreadPoolExecutor(
+            max_workers=max_workers,
+            thread_name_prefix=f"fetch-{self.dataset.name}",
+        )
+
+        def _complete() -> Optional[str]:
+            fingerprint, text, future = pending.popleft()
+            if future is None:
+                return text
+            if cache_days is not None:
+                return self._cache_response(fingerprint, future.result(), text)
+            return future.result().text
+
+        try:
+            for request in requests:
+                spec: Dict[str, Any] = {"url": request}
+                if not isinstance(request, str):
+                    spec = request
+                url = build_url(spec["url"], spec.get("params"))
+                auth: _Auth = spec.get("auth")
+                method: str = spec.get("method", "GET")
+                data: _Body = spec.get("data")
+                headers: _Headers = spec.get("headers")
+                fingerprint = request_hash(url, auth=auth, method=method, data=data)
+                stale: Optional[str] = None
+                if cache_days is not None:
+                    text = self._get_cached(url, fingerprint, method, cache_days)
+                    if text is not None:
+                        pending.append((fingerprint, text, None))
+                        continue
+                    if method == "GET":
+                        headers, stale = self._prepare_revalidation(
+                            fingerprint, headers
+                        )
+                # Run in a copy of the logging context, so that log messages
+                # from the worker threads are attributed to the dataset:
+                future = executor.submit(
+                    copy_context().run,
+                    self.fetch_response,
+                    url,
+                    headers=headers,
+                    auth=auth,
+                    method=method,
+                    data=data,
+                )
+                # For pending requests, the text slot holds the stale cached copy:
+                pending.append((fingerprint, stale, future))
+                while len(pending) >= window:
+                    yield _complete()
+            while len(pending):
+                yield _complete()
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
     def fetch_json(
         self,
         url: str,
@@ -404,6 +736,7 @@ class Context:
             None
         """
         self.cache.delete(fingerprint)
+        self.cache.delete(validators_key(fingerprint))
 
     def parse_resource_xml(self, name: PathLike) -> etree._ElementTree:
         """Parse a file in the resource folder into an XML tree.
@@ -468,16 +801,37 @@ class Context:
             default: The default value to use if the lookup doesn't match the value.
         """
         try:
-            lookup_obj = self.get_lookup(lookup)
-            return lookup_obj.get_value(value, default=default)
+            result = self.lookup(lookup, value)
         except LookupException:
             return default
+        if result is None:
+            return default
+        return result.value
 
     def get_lookup(self, lookup: str) -> Lookup:
         return self.dataset.lookups[lookup]
 
     def lookup(self, lookup: str, value: Optional[str]) -> Optional[Result]:
-        return self.get_lookup(lookup).match(value)
+        """Invoke a datapatch lookup defined in the dataset metadata and return the
+        result of the matching option, if any.
+
+        Results are kept for the lifetime of the context, so that crawlers can
+        look up the same values for each row without matching them against the
+        lookup options again. Only the first match of a value is counted in the
+        reference counts of the options (see `debug_lookups`), like in
+        `datapatch.Lookup.match`. Lookup errors (e.g. ambiguous matches) are
+        raised every time.
+
+        Args:
+            lookup: The name of the lookup. The key under the dataset lookups property.
+            value: The data value to look up.
+        """
+        key = (lookup, value)
+        if key in self._lookup_results:
+            return self._lookup_results[key]
+        result = self.get_lookup(lookup).match(value)
+        self._lookup_results[key] = result
+        return result
 
     def debug_lookups(self) -> None:
         """Output a list of unused lookup options."""
@@ -533,36 +887,86 @@ class Context:
             external: Whether the entity is an enrichment candidate or already
                 part of the dataset.
         """
-        if entity.id is None:
-            raise ValueError("Entity has no ID: %r", entity)
-        if len(entity.properties) == 0:
-            self.log.error("Entity has no properties", entity=entity)
+        self.emit_many([entity], target=target, external=external)
+
+    def emit_many(
+        self, entities: Iterable[Entity], target: bool = False, external: bool = False
+    ) -> None:
+        """Send a batch of entities from the crawling/runner process to be stored.
+        This is faster than emitting the entities one by one, because the previous
+        `first_seen` times of their statements are looked up together. The entities
+        are stored in chunks of `EMIT_BATCH`, so the iterable can be a generator.
+
+        Args:
+            entities: The entities to be stored.
+            target: Whether the entities are targets of the dataset.
+            external: Whether the entities are enrichment candidates or already
+                part of the dataset.
+        """
+        iterator = iter(entities)
+        while True:
+            chunk = list(islice(iterator, EMIT_BATCH))
+            if not len(chunk):
+                break
+            self._emit_chunk(chunk, target, external)
+
+    def _emit_chunk(self, entities: List[Entity], target: bool, external: bool) -> None:
+        # Check all entities before any of them is counted or stamped, so that
+        # an invalid entity doesn't leave half of a chunk emitted:
+        entity_ids: List[str] = []
+        for entity in entities:
+            if entity.id is None:
+                raise ValueError("Entity has no ID: %r", entity)
+            entity_ids.append(entity.id)
+        lang = self.lang
+        dataset = self.dataset.name
+        seen = self.data_time_iso
+        statements: List[Statement] = []
+        for entity_id, entity in zip(entity_ids, entities):
+            if not entity.iterprops():
+                self.log.error("Entity has no properties", entity=entity)
+                continue
+            if self.incremental:
+                # Before the first entity is emitted, check if the sources fetched
+                # by the crawler are the same as for the previous version:
+                self.incremental = False
+                if self.sources.unchanged():
+                    raise SourceUnchanged()
+            self.stats.entities += 1
+            if target:
+                self.stats.targets += 1
+            if self.stats.entities % 10000 == 0:
+                self.log.info(
+                    "Emitted %s entities" % self.stats.entities,
+                    targets=self.stats.targets,
+                    statements=self.stats.statements + len(statements),
+                )
+            schema = entity.schema.name
+            for stmt in entity.statements:
+                if stmt.lang is None:
+                    stmt.lang = lang
+                stmt.dataset = dataset
+                stmt.entity_id = entity_id
+                stmt.external = external
+                stmt.target = target
+                stmt.schema = schema
+                stmt.first_seen = seen
+                stmt.last_seen = seen
+                statements.append(stmt)
+        if not len(statements):
             return
-        self.stats.entities += 1
-        if target:
-            self.stats.targets += 1
-        if self.stats.entities % 10000 == 0:
-            self.log.info(
-                "Emitted %s entities" % self.stats.entities,
-                targets=self.stats.targets,
-                statements=self.stats.statements,
-            )
-        for stmt in entity.statements:
-            if stmt.lang is None:
-                stmt.lang = self.lang
-            stmt.dataset = self.dataset.name
-            stmt.entity_id = entity.id
-            stmt.external = external
-            stmt.target = target
-            stmt.schema = entity.schema.name
-            stmt.first_seen = self.data_time_iso
-            stmt.last_seen = self.data_time_iso
-            if not self.dry_run:
-                stmt.first_seen = self.timestamps.get(stmt.id, self.data_time_iso)
-                if stmt.first_seen != self.data_time_iso:
-                    self.stats.changed += 1
-                self.sink.emit(stmt)
-            self.stats.statements += 1
+        if not self.dry_run:
+            ids = [stmt.id for stmt in statements]
+            changed = 0
+            for stmt, first_seen in zip(
+                statements, self.timestamps.get_many(ids, seen)
+            ):
+                if first_seen != seen:
+                    stmt.first_seen = first_seen
+                    changed += 1
+            self.stats.changed += changed
+            self.sink.emit_many(statements)
+        self.stats.statements += len(statements)
 
     def __hash__(self) -> int:
         return hash(self.dataset.name)
@@ -1,13 +1,22 @@
+import shutil
+import multiprocessing
+from datetime import datetime
+from typing import Any, Dict, List
+from concurrent.futures import ProcessPoolExecutor
 from requests.exceptions import RequestException
 from datapatch import LookupException
 
 from zavod import settings
-from zavod.meta import Dataset
-from zavod.context import Context
-from zavod.exc import RunFailedException
-from zavod.archive import dataset_data_path
+from zavod.meta import Dataset, get_catalog
+from zavod.context import Context, PARTITIONS_DIR
+from zavod.exc import RunFailedException, SourceUnchanged
+from zavod.archive import dataset_data_path, get_artifact_object, STATEMENTS_FILE
+from zavod.archive import dataset_state_path
+from zavod.archive.pack import read_pack_statements
 from zavod.runtime.stats import ContextStats
-from zavod.runtime.loader import load_entry_point
+from zavod.runtime.loader import load_entry_point, load_partitions, Partitioned
+from zavod.runtime.cache import get_cache, get_engine, get_metadata
+from zavod.runtime.sources import code_hash
 from zavod.runner.enrich import enrich
 
 # HACK: Importing the enrich module in the test avoids a segfault otherwise happening
@@ -15,16 +24,140 @@ from zavod.runner.enrich import enrich
 assert enrich is not None
 
 
-def crawl_dataset(dataset: Dataset, dry_run: bool = False) -> ContextStats:
+def _reuse_statements(context: Context) -> None:
+    """Copy the statements of the previous version of the dataset to the output,
+    updating their `last_seen` time."""
+    object = get_artifact_object(context.dataset.name, STATEMENTS_FILE)
+    if object is None:
+        raise RuntimeError("Previous statements not found: %s" % context.dataset.name)
+    entity_id = None
+    with object.open_binary() as fh:
+        for stmt in read_pack_statements(fh):
+            if stmt.entity_id != entity_id:
+                entity_id = stmt.entity_id
+                context.stats.entities += 1
+                if stmt.target:
+                    context.stats.targets += 1
+            stmt.last_seen = context.data_time_iso
+            context.sink.emit(stmt)
+            context.stats.statements += 1
+            if stmt.first_seen != context.data_time_iso:
+                context.stats.changed += 1
+
+
+def _crawl_partition(
+    dataset_name: str, key: str, partition: Any, dry_run: bool, data_time: datetime
+) -> Dict[str, Any]:
+    """Crawl a partition of a dataset in a worker process."""
+    # Database connections can not be shared with the parent process:
+    get_cache.cache_clear()
+    get_engine.cache_clear()
+    get_metadata.cache_clear()
+    dataset = get_catalog().require(dataset_name)
+    context = Context(dataset, dry_run=dry_run, partition=key)
+    context.data_time = data_time
+    try:
+        context.begin(clear=False)
+        partitioned = load_partitions(dataset)
+        assert partitioned is not None
+        _, crawl_partition = partitioned
+        crawl_partition(context, partition)
+        return {
+            "stats": context.stats.to_dict(),
+            "sources": context.sources.sources,
+            "untracked": context.sources.untracked,
+        }
+    finally:
+        context.close()
+
+
+def _crawl_partitions(context: Context, partitioned: Partitioned, workers: int) -> None:
+    """Crawl the partitions of a dataset in a pool of worker processes, and merge
+    their outputs."""
+    partitions_func, _ = partitioned
+    partitions = list(partitions_func(context))
+    keys = [str(idx) for idx in range(len(partitions))]
+    context.log.info("Crawling partitions", partitions=len(keys), workers=workers)
+    partitions_path = dataset_state_path(context.dataset.name) / PARTITIONS_DIR
+    shutil.rmtree(partitions_path, ignore_errors=True)
+    if not context.dry_run:
+        # Build the timestamp index once, it is then read by all partitions:
+        index = context.timestamps
+        context.log.info("Timestamp index ready", statements=index.count)
+    if context._cache is not None:
+        context._cache.flush()
+    context.sink.flush()
+
+    results: List[Dict[str, Any]] = []
+    # Partitions must be forked: they look up the dataset in the inherited catalog
+    # and share the run version and time of this process.
+    mp = multiprocessing.get_context("fork")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=mp) as executor:
+        futures = [
+            executor.submit(
+                _crawl_partition,
+                context.dataset.name,
+                key,
+                partition,
+                context.dry_run,
+                context.data_time,
+            )
+            for key, partition in zip(keys, partitions)
+        ]
+        try:
+            for future in futures:
+                results.append(future.result())
+        except BaseException:
+            executor.shutdown(wait=True, cancel_futures=True)
+            raise
+
+    for key, result in zip(keys, results):
+        for stat, value in result["stats"].items():
+            setattr(context.stats, stat, getattr(context.stats, stat) + value)
+        context.sources.sources.update(result["sources"])
+        for source in result["untracked"]:
+            context.sources.record_untracked(source)
+        pack_path = context.partition_path(".pack", key)
+        if pack_path.is_file():
+            context.sink.merge(pack_path)
+        log_path = context.partition_path(".log", key)
+        if log_path.is_file() and not context.dry_run:
+            context.issues.merge(log_path)
+    shutil.rmtree(partitions_path, ignore_errors=True)
+
+
+def crawl_dataset(
+    dataset: Dataset,
+    dry_run: bool = False,
+    incremental: bool = False,
+    resume: bool = False,
+    workers: int = 1,
+) -> ContextStats:
     """Load the dataset entry point, configure a context, and then execute the entry
-    point; finally disband the context."""
-    context = Context(dataset, dry_run=dry_run)
+    point; finally disband the context.
+
+    In incremental mode, the crawler is stopped when it emits its first entity if
+    the source files it has fetched are identical to those used for the previous
+    version of the dataset, and the previous statements are re-used instead.
+
+    With `resume`, a run which was interrupted continues from the last checkpoint
+    recorded by the crawler (see `Context.checkpoint`), instead of starting over.
+
+    With more than one `workers`, a crawler which defines `partitions(context)`
+    and `crawl_partition(context, partition)` functions is run in parallel: each
+    partition is crawled in a separate process, and the statements, issues and
+    statistics of all partitions are merged into the outputs of the dataset.
+    """
+    context = Context(dataset, dry_run=dry_run, incremental=incremental)
     if dataset.disabled:
         context.log.info("Source is disabled", dataset=dataset.name)
         return context.stats
 
     try:
-        context.begin(clear=True)
+        resumed = resume and not dry_run and context.checkpoint_path.is_file()
+        context.begin(clear=not resumed)
+        if resumed:
+            context.resume()
         context.log.info(
             "Running dataset",
             data_path=dataset_data_path(dataset.name),
@@ -32,7 +165,22 @@ def crawl_dataset(dataset: Dataset, dry_run: bool = False) -> ContextStats:
             version=context.version.id,
         )
         entry_point = load_entry_point(dataset)
-        entry_point(context)
+        context.sources.code = code_hash(dataset, entry_point)
+        partitioned = load_partitions(dataset) if workers > 1 else None
+        with context.timings.phase("crawl") as timing:
+            try:
+                if partitioned is not None:
+                    _crawl_partitions(context, partitioned, workers)
+                else:
+                    entry_point(context)
+            except SourceUnchanged:
+                context.log.info("Sources are unchanged, re-using previous statements")
+                _reuse_statements(context)
+            timing.update(context.stats.to_dict())
+            timing["cache_hit_ratio"] = round(context.stats.cache_hit_ratio, 3)
+        if not dry_run:
+            context.sources.save()
+            context.clear_checkpoint()
         if context.stats.entities == 0:
             context.log.warn(
                 "Runner did not emit entities",
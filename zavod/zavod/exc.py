@@ -11,3 +11,11 @@ class RunFailedException(ZavodException):
 class ConfigurationException(ZavodException):
     def __init__(self, message: str) -> None:
         self.message = message
+
+
+class SourceUnchanged(BaseException):
+    """Raised from `Context.emit` in incremental mode to stop the crawler when its
+    source data is identical to that of the previous version of the dataset. This
+    is a `BaseException` so it is not caught by crawlers handling errors."""
+
+    pass
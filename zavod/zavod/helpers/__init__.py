@@ -34,7 +34,8 @@ Any data wrangling code that is repeated in three or more crawlers should
 be considered for inclusion in the helper library.
 """
 
-from zavod.helpers.xml import remove_namespace
+from zavod.helpers.xml import remove_namespace, iterparse_elements, iterparse_map
+from zavod.helpers.archives import iter_archive_members
 from zavod.helpers.names import make_name, apply_name, split_comma_names
 from zavod.helpers.positions import make_position, make_occupancy
 from zavod.helpers.text import clean_note, is_empty, remove_bracketed
@@ -80,6 +81,9 @@ __all__ = [
     "convert_excel_date",
     "make_security",
     "remove_namespace",
+    "iterparse_elements",
+    "iterparse_map",
+    "iter_archive_members",
     "make_name",
     "apply_name",
     "make_position",
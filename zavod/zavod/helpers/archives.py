@@ -0,0 +1,149 @@
+import bz2
+import gzip
+import lzma
+import shutil
+import tarfile
+import subprocess
+from pathlib import Path
+from zipfile import ZipFile, is_zipfile
+from fnmatch import fnmatch
+from typing import IO, Callable, Generator, List, Optional, Tuple, cast
+
+MAGIC_7Z = b"7z\xbc\xaf\x27\x1c"
+ArchiveMember = Tuple[str, IO[bytes]]
+
+
+def _open_file(path: Path) -> IO[bytes]:
+    return open(path, "rb")
+
+
+def _open_gzip(path: Path) -> IO[bytes]:
+    return cast(IO[bytes], gzip.open(path, "rb"))
+
+
+def _open_bz2(path: Path) -> IO[bytes]:
+    return cast(IO[bytes], bz2.open(path, "rb"))
+
+
+def _open_xz(path: Path) -> IO[bytes]:
+    return cast(IO[bytes], lzma.open(path, "rb"))
+
+
+# Magic bytes, reader and file name suffix of single-file compression formats:
+COMPRESSED: List[Tuple[bytes, Callable[[Path], IO[bytes]], str]] = [
+    (b"\x1f\x8b", _open_gzip, ".gz"),
+    (b"BZh", _open_bz2, ".bz2"),
+    (b"\xfd7zXZ\x00", _open_xz, ".xz"),
+]
+
+
+def _matches(name: str, pattern: Optional[str]) -> bool:
+    return pattern is None or fnmatch(name, pattern)
+
+
+def _iter_7z(
+    path: Path, pattern: Optional[str]
+) -> Generator[ArchiveMember, None, None]:
+    binary = shutil.which("7z") or shutil.which("7za") or shutil.which("7zz")
+    if binary is None:
+        raise RuntimeError("Reading 7z archives requires the 7z command: %s" % path)
+    listing = subprocess.run(
+        [binary, "l", "-slt", "-ba", path.as_posix()],
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    names: List[str] = []
+    name: Optional[str] = None
+    for line in listing.stdout.splitlines():
+        key, _, value = line.partition(" = ")
+        if key == "Path":
+            name = value
+        elif key == "Attributes" and name is not None:
+            if not value.startswith("D") and _matches(name, pattern):
+                names.append(name)
+            name = None
+    for name in names:
+        command = [binary, "e", "-so", path.as_posix(), name]
+        proc = subprocess.Popen(command, stdout=subprocess.PIPE)
+        assert proc.stdout is not None
+        try:
+            yield name, proc.stdout
+        finally:
+            proc.stdout.close()
+            proc.wait()
+
+
+def _iter_tar(
+    tar: tarfile.TarFile, pattern: Optional[str]
+) -> Generator[ArchiveMember, None, None]:
+    with tar:
+        for member in tar:
+            if not member.isfile() or not _matches(member.name, pattern):
+                continue
+            member_fh = tar.extractfile(member)
+            if member_fh is not None:
+                with member_fh:
+                    yield member.name, member_fh
+
+
+def iter_archive_members(
+    path: Path, pattern: Optional[str] = None
+) -> Generator[ArchiveMember, None, None]:
+    """Stream the files contained in an archive without extracting them to disk.
+
+    Supports ZIP and tar archives (also compressed with gzip, bzip2 or xz), single
+    files compressed with gzip, bzip2 or xz, and 7z archives. The format is detected
+    from the contents of the file. Reading 7z archives requires the `7z` command,
+    which is part of the `p7zip-full` package on Debian-based systems.
+
+    Each file handle is only valid until the iteration moves on to the next member,
+    so it should be consumed within the loop:
+
+    ```python
+    for name, fh in h.iter_archive_members(path, "*.xml"):
+        for el in h.iterparse_elements(fh, "Record"):
+            ...
+    ```
+
+    Args:
+        path: The path of the archive file.
+        pattern: A glob pattern (e.g. `*.xml`) to select members by name.
+
+    Returns:
+        A generator of tuples with the member name and a binary file handle.
+    """
+    with open(path, "rb") as magic_fh:
+        magic = magic_fh.read(8)
+    if is_zipfile(path):
+        with ZipFile(path, "r") as zip:
+            for info in zip.infolist():
+                if info.is_dir() or not _matches(info.filename, pattern):
+                    continue
+                with zip.open(info, "r") as member_fh:
+                    yield info.filename, member_fh
+        return
+    if magic.startswith(MAGIC_7Z):
+        yield from _iter_7z(path, pattern)
+        return
+    opener: Callable[[Path], IO[bytes]] = _open_file
+    name: Optional[str] = None
+    for prefix, compressed_opener, suffix in COMPRESSED:
+        if magic.startswith(prefix):
+            opener = compressed_opener
+            name = path.stem if path.suffix.lower() == suffix else path.name
+            break
+    with opener(path) as tar_fh:
+        try:
+            # Stream mode reads the archive sequentially, without seeking:
+            tar: Optional[tarfile.TarFile] = tarfile.open(fileobj=tar_fh, mode="r|")
+        except tarfile.ReadError:
+            tar = None
+        if tar is not None:
+            yield from _iter_tar(tar, pattern)
+            return
+    if name is None:
+        raise ValueError("Unsupported archive format: %s" % path)
+    if _matches(name, pattern):
+        with opener(path) as fh:
+            yield name, fh
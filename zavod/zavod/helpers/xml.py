@@ -1,6 +1,14 @@
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from itertools import chain
+from pathlib import Path
+from typing import IO, Callable, Deque, Generator, List, TypeVar, Union, cast
 from lxml import etree
 from zavod.util import ElementOrTree
 
+T = TypeVar("T")
+XMLSource = Union[str, Path, IO[bytes]]
+
 
 def remove_namespace(el: ElementOrTree) -> ElementOrTree:
     """Remove namespace in the passed XML/HTML document in place and
@@ -28,3 +36,101 @@ def remove_namespace(el: ElementOrTree) -> ElementOrTree:
                 elem.attrib[local_key] = value
     etree.cleanup_namespaces(el)
     return el
+
+
+def _free_element(el: etree._Element) -> None:
+    """Release the memory used by an element which has been processed, as well
+    as by the preceding siblings of it and its ancestors."""
+    el.clear()
+    for node in chain((el,), el.iterancestors()):
+        parent = node.getparent()
+        if parent is None:
+            break
+        while node.getprevious() is not None:
+            del parent[0]
+
+
+def iterparse_elements(
+    source: XMLSource, tag: str, remove_namespaces: bool = True
+) -> Generator[etree._Element, None, None]:
+    """Stream the elements with a given tag from a (huge) XML document, without
+    loading the whole document into memory.
+
+    Each element is fully parsed when it is yielded. Once the iteration moves on,
+    the element is cleared and removed from the tree together with everything
+    before it, so it must not be used after the loop body. Namespaces are removed
+    from the elements as they are read.
+
+    Args:
+        source: A file path or a binary file handle of the XML document.
+        tag: The tag name of the elements to yield, without namespace.
+        remove_namespaces: Remove the namespaces from the yielded elements.
+
+    Returns:
+        A generator of the matching elements.
+    """
+    if isinstance(source, Path):
+        source = source.as_posix()
+    for _, el in etree.iterparse(source, events=("end",), tag=f"{{*}}{tag}"):
+        if remove_namespaces:
+            remove_namespace(el)
+        yield el
+        _free_element(el)
+
+
+def _parse_batch(func: Callable[[etree._Element], T], batch: List[bytes]) -> List[T]:
+    results: List[T] = []
+    for data in batch:
+        # Serialized elements carry the namespace declarations of their ancestors:
+        el = remove_namespace(etree.fromstring(data))
+        results.append(func(cast(etree._Element, el)))
+    return results
+
+
+def iterparse_map(
+    source: XMLSource,
+    tag: str,
+    func: Callable[[etree._Element], T],
+    workers: int = 4,
+    batch_size: int = 100,
+) -> Generator[T, None, None]:
+    """Stream the elements with a given tag from a (huge) XML document, and apply
+    `func` to each of them in a pool of worker processes. The results are yielded
+    in document order.
+
+    Elements are sent to the workers as serialized XML in batches, and only a
+    limited number of batches is in flight at any time, so that memory use stays
+    bounded. `func` must be a module-level function which does not use the
+    crawler context, and its results must be picklable (e.g. a dict of values to
+    build an entity from in the main process).
+
+    Args:
+        source: A file path or a binary file handle of the XML document.
+        tag: The tag name of the elements to process, without namespace.
+        func: The function to apply to each element.
+        workers: The number of worker processes. If 1, `func` is applied in
+            the current process.
+        batch_size: The number of elements sent to a worker at once.
+
+    Returns:
+        A generator of the results of `func`.
+    """
+    elements = iterparse_elements(source, tag)
+    if workers <= 1:
+        for el in elements:
+            yield func(el)
+        return
+    pending: Deque["Future[List[T]]"] = deque()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        batch: List[bytes] = []
+        for el in elements:
+            batch.append(etree.tostring(el))
+            if len(batch) >= batch_size:
+                pending.append(executor.submit(_parse_batch, func, batch))
+                batch = []
+            while len(pending) >= workers * 2:
+                yield from pending.popleft().result()
+        if len(batch):
+            pending.append(executor.submit(_parse_batch, func, batch))
+        while len(pending):
+            yield from pending.popleft().result()
@@ -1,10 +1,11 @@
 import os
+from copy import deepcopy
 from banal import ensure_list, ensure_dict, as_bool
 from typing import TYPE_CHECKING, Dict, Any, Optional, List, Set
 from normality import slugify
 from pathlib import Path
 from functools import cached_property
-from datapatch import get_lookups, Lookup
+from datapatch import Lookup
 from nomenklatura.dataset import Dataset as NKDataset
 from nomenklatura.dataset import DataCoverage
 from nomenklatura.util import datetime_iso
@@ -15,6 +16,7 @@ from zavod.meta.assertion import Assertion, parse_assertions
 from zavod.meta.http import HTTP
 from zavod.meta.data import Data
 from zavod.meta.dates import DatesSpec
+from zavod.meta.lookups import compile_lookups
 
 if TYPE_CHECKING:
     from zavod.meta.catalog import ArchiveBackedCatalog
@@ -112,8 +114,10 @@ class Dataset(NKDataset):
 
     @cached_property
     def lookups(self) -> Dict[str, Lookup]:
-        config = self._data.get("lookups", {})
-        return get_lookups(config, debug=settings.DEBUG)
+        # Lookups are parsed destructively, keep the metadata intact:
+        config = deepcopy(self._data.get("lookups", {}))
+        # Compiled once per dataset, forked crawl partitions and runs inherit them:
+        return compile_lookups(config, debug=settings.DEBUG)
 
     @cached_property
     def data(self) -> Optional[Data]:
@@ -1,4 +1,4 @@
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional
 from urllib3.util import Retry
 from banal import ensure_list
 from zavod import settings
@@ -17,3 +17,17 @@ class HTTP(object):
         )
         self.retry_methods: List[str] = retry_methods
         self.user_agent: str = data.get("user_agent", settings.HTTP_USER_AGENT)
+        self.max_workers: int = max(1, int(data.get("max_workers", 4)))
+        """Number of concurrent requests issued by `Context.fetch_many`."""
+        rate_limit = data.get("rate_limit")
+        self.rate_limit: Optional[float] = None
+        """Maximum number of requests per second sent to each host."""
+        if rate_limit is not None:
+            self.rate_limit = float(rate_limit)
+        self.rate_burst: int = int(data.get("rate_burst", 1))
+        """Number of requests that may be sent at once before the rate limit applies."""
+        host_concurrency = data.get("host_concurrency")
+        self.host_concurrency: Optional[int] = None
+        """Maximum number of requests in flight to each host at the same time."""
+        if host_concurrency is not None:
+            self.host_concurrency = int(host_concurrency)
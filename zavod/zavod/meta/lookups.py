@@ -0,0 +1,94 @@
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+from datapatch import Lookup, Result, LookupException
+from datapatch.option import Option
+from datapatch.util import normalize_value, str_list
+
+# The normalisation flags of an option: normalize, lowercase and asciify.
+Flags = Tuple[bool, bool, bool]
+
+
+class OptionIndex(object):
+    """The exact-match options of a lookup which share the same normalisation,
+    keyed by their normalised match values."""
+
+    def __init__(self, flags: Flags) -> None:
+        self.flags = flags
+        self.values: Dict[str, List[Option]] = {}
+        self.none_matches: List[Option] = []
+
+    def add(self, option: Option) -> None:
+        if option.none_matches:
+            self.none_matches.append(option)
+        for match in str_list(option.config.get("match", [])):
+            norm = normalize_value(match, *self.flags)
+            if norm is not None:
+                self.values.setdefault(norm, []).append(option)
+
+    def get(self, value: Optional[str]) -> Optional[List[Option]]:
+        """Get the options matching the value, or `None` if the value needs to
+        be checked against all options."""
+        norm = normalize_value(value, *self.flags)
+        if norm is None:
+            return self.none_matches
+        if "\n" in norm:
+            # Match clauses are anchored per line, so a multi-line value can
+            # match an option on one of its lines:
+            return None
+        return self.values.get(norm, [])
+
+
+class CompiledLookup(Lookup):
+    """A lookup which keeps its `match` options in a hash index, so that matching
+    a value doesn't need to evaluate the regular expression of every option. The
+    options using `contains` or `regex` clauses are still checked one by one.
+    Matching behaves exactly like `datapatch.Lookup`, including the reference
+    counts of the options and the tracking of unmatched values."""
+
+    def __init__(self, name: str, config: Dict[str, Any], debug: bool = False):
+        super().__init__(name, config, debug=debug)
+        self.indexes: Dict[Flags, OptionIndex] = {}
+        self.fallback: List[Option] = []
+        for option in self.options:
+            if "contains" in option.config or "regex" in option.config:
+                self.fallback.append(option)
+                continue
+            flags = (option.normalize, option.lowercase, option.asciify)
+            if flags not in self.indexes:
+                self.indexes[flags] = OptionIndex(flags)
+            self.indexes[flags].add(option)
+
+    def _matching(self, value: Optional[str]) -> List[Option]:
+        matching: List[Option] = []
+        for index in self.indexes.values():
+            options = index.get(value)
+            if options is None:
+                return [o for o in self.options if o.matches(value)]
+            matching.extend(options)
+        for option in self.fallback:
+            if option.matches(value):
+                matching.append(option)
+        return matching
+
+    @lru_cache(maxsize=20000)
+    def match(self, value: Optional[str]) -> Optional[Result]:
+        matching = self._matching(value)
+        matching = sorted(matching, key=lambda o: o.weight, reverse=True)
+        if len(matching) > 1 and matching[0].weight == matching[1].weight:
+            msg = "Ambiguous result: %r -> %r (set weights to fix)" % (value, matching)
+            raise LookupException(msg, lookup=self, value=value)
+        for option in matching:
+            option.ref_count += 1
+            return option.result
+        self.unmatched.add(value)
+        if self.required:
+            raise LookupException("Missing lookup result", lookup=self, value=value)
+        return None
+
+
+def compile_lookups(
+    data: Dict[str, Dict[str, Any]], debug: bool = False
+) -> Dict[str, Lookup]:
+    """Turn the lookups section of the dataset metadata into a dict of compiled
+    lookups (see `datapatch.get_lookups`)."""
+    return {n: CompiledLookup(n, c, debug=debug) for n, c in data.items()}
@@ -1,4 +1,5 @@
 from rigour.mime.types import JSON
+from nomenklatura.versions import Version
 
 from zavod.meta import Dataset
 from zavod.logs import get_logger
@@ -8,20 +9,23 @@ from zavod.archive import INDEX_FILE, CATALOG_FILE
 from zavod.archive import STATEMENTS_FILE, RESOURCES_FILE, STATISTICS_FILE
 from zavod.archive import VERSIONS_FILE, ARTIFACT_FILES
 from zavod.archive import DELTA_EXPORT_FILE, DELTA_INDEX_FILE
+from zavod.archive import TIMESTAMPS_FILE, SOURCES_FILE, TIMINGS_FILE
+from zavod.archive import STORE_SNAPSHOT_FILE, STORE_SNAPSHOT_META
 from zavod.runtime.resources import DatasetResources
 from zavod.runtime.versions import get_latest
+from zavod.runtime.timings import DatasetTimings
 from zavod.exporters import write_dataset_index, write_issues
 
 log = get_logger(__name__)
 
 
-def _publish_artifacts(dataset: Dataset) -> None:
+def _publish_artifact_files(dataset: Dataset) -> Version:
     version = get_latest(dataset.name, backfill=False)
     if version is None:
         raise ValueError(f"No working version found for dataset: {dataset.name}")
     for artifact in ARTIFACT_FILES:
         path = dataset_resource_path(dataset.name, artifact)
-        if path.is_file():
+        if artifact != TIMINGS_FILE and path.is_file():
             publish_artifact(
                 path,
                 dataset.name,
@@ -29,11 +33,29 @@ def _publish_artifacts(dataset: Dataset) -> None:
                 artifact,
                 mime_type=JSON if artifact.endswith(".json") else None,
             )
+    return version
+
+
+def _publish_version(dataset: Dataset, version: Version) -> None:
+    # The timings are published last, so that they can include the publication:
+    path = dataset_resource_path(dataset.name, TIMINGS_FILE)
+    if path.is_file():
+        publish_artifact(path, dataset.name, version, TIMINGS_FILE, mime_type=JSON)
     publish_dataset_version(dataset.name)
 
 
+def _publish_artifacts(dataset: Dataset) -> None:
+    _publish_version(dataset, _publish_artifact_files(dataset))
+
+
 def publish_dataset(dataset: Dataset, latest: bool = True) -> None:
     """Upload a dataset to the archive."""
+    with DatasetTimings(dataset).phase("publish"):
+        version = _publish_dataset(dataset, latest=latest)
+    _publish_version(dataset, version)
+
+
+def _publish_dataset(dataset: Dataset, latest: bool) -> Version:
     resources = DatasetResources(dataset)
     for resource in resources.all():
         if resource.name in ARTIFACT_FILES:
@@ -63,14 +85,13 @@ def publish_dataset(dataset: Dataset, latest: bool = True) -> None:
             continue
         mime_type = JSON if meta.endswith(".json") else None
         publish_resource(path, dataset.name, meta, latest=latest, mime_type=mime_type)
-    _publish_artifacts(dataset)
+    return _publish_artifact_files(dataset)
 
 
 def publish_failure(dataset: Dataset, latest: bool = True) -> None:
     """Upload failure information about a dataset to the archive."""
     # Clear out interim artifacts so they cannot pollute the metadata we're
     # generating.
-    assert not dataset.is_collection
     dataset_resource_path(dataset.name, STATEMENTS_FILE).unlink(missing_ok=True)
     dataset_resource_path(dataset.name, STATISTICS_FILE).unlink(missing_ok=True)
     dataset_resource_path(dataset.name, INDEX_FILE).unlink(missing_ok=True)
@@ -78,6 +99,10 @@ def publish_failure(dataset: Dataset, latest: bool = True) -> None:
     dataset_resource_path(dataset.name, RESOURCES_FILE).unlink(missing_ok=True)
     dataset_resource_path(dataset.name, DELTA_EXPORT_FILE).unlink(missing_ok=True)
     dataset_resource_path(dataset.name, DELTA_INDEX_FILE).unlink(missing_ok=True)
+    dataset_resource_path(dataset.name, TIMESTAMPS_FILE).unlink(missing_ok=True)
+    dataset_resource_path(dataset.name, SOURCES_FILE).unlink(missing_ok=True)
+    dataset_resource_path(dataset.name, STORE_SNAPSHOT_FILE).unlink(missing_ok=True)
+    dataset_resource_path(dataset.name, STORE_SNAPSHOT_META).unlink(missing_ok=True)
     write_issues(dataset)
     write_dataset_index(dataset)
     path = dataset_resource_path(dataset.name, INDEX_FILE)
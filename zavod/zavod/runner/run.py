@@ -0,0 +1,91 @@
+from zavod import settings
+from zavod.logs import get_logger
+from zavod.meta import Dataset
+from zavod.crawl import crawl_dataset
+from zavod.store import get_store
+from zavod.archive import clear_data_path, dataset_resource_path
+from zavod.archive import STORE_SNAPSHOT_FILE, STORE_SNAPSHOT_META
+from zavod.exporters import export_dataset
+from zavod.dedupe import get_dataset_linker
+from zavod.runtime.versions import make_version
+from zavod.runtime.profile import get_profiler
+from zavod.runtime.timings import DatasetTimings
+from zavod.publish import publish_dataset, publish_failure
+from zavod.tools.load_db import load_dataset_to_db
+from zavod.exc import RunFailedException
+from zavod.validators import validate_dataset
+
+log = get_logger(__name__)
+
+
+def run_dataset(
+    dataset: Dataset,
+    latest: bool = False,
+    clear: bool = False,
+    external: bool = True,
+    incremental: bool = False,
+    profile: bool = False,
+) -> bool:
+    """Crawl, validate, export and then publish a dataset. If any step fails, the
+    failure is published instead. With `profile`, the crawl, validation and export
+    are profiled (see `zavod.runtime.profile.Profiler`). With `ZAVOD_STORE_SNAPSHOT`,
+    a snapshot of the store of a collection is published (see `Store.snapshot`).
+
+    Returns:
+        True if the dataset run succeeded, or the dataset is disabled.
+    """
+    if clear:
+        clear_data_path(dataset.name)
+    if dataset.disabled:
+        log.info("Dataset is disabled, skipping: %s" % dataset.name)
+        publish_failure(dataset, latest=latest)
+        return True
+    # Crawl
+    if dataset.entry_point is not None and not dataset.is_collection:
+        try:
+            with get_profiler(dataset, "crawl", profile):
+                crawl_dataset(dataset, dry_run=False, incremental=incremental)
+        except RunFailedException:
+            publish_failure(dataset, latest=latest)
+            return False
+    else:
+        make_version(dataset, settings.RUN_VERSION, overwrite=True)
+
+    linker = get_dataset_linker(dataset)
+    store = get_store(dataset, linker)
+    timings = DatasetTimings(dataset)
+    # Validate
+    try:
+        with timings.phase("sync"):
+            store.sync(clear=clear)
+        view = store.view(dataset, external=False)
+        if not dataset.is_collection:
+            with timings.phase("validate"):
+                with get_profiler(dataset, "validate", profile):
+                    validate_dataset(dataset, view)
+    except Exception:
+        log.exception("Validation failed for %r" % dataset.name)
+        publish_failure(dataset, latest=latest)
+        store.close()
+        return False
+    # Export and Publish
+    try:
+        with timings.phase("export"):
+            with get_profiler(dataset, "export", profile):
+                export_dataset(dataset, view)
+        if dataset.is_collection and settings.STORE_SNAPSHOT:
+            store.snapshot()
+        else:
+            # Do not publish a stale snapshot from a previous run:
+            for name in (STORE_SNAPSHOT_FILE, STORE_SNAPSHOT_META):
+                dataset_resource_path(dataset.name, name).unlink(missing_ok=True)
+        publish_dataset(dataset, latest=latest)
+
+        if not dataset.is_collection and dataset.load_db_uri is not None:
+            log.info("Loading dataset into database...", dataset=dataset.name)
+            load_dataset_to_db(dataset, linker, dataset.load_db_uri, external=external)
+        log.info("Dataset run is complete :)", dataset=dataset.name)
+    except Exception:
+        log.exception("Failed to export and publish %r" % dataset.name)
+        return False
+    return True
@@ -0,0 +1,168 @@
+import sys
+import time
+import multiprocessing
+from multiprocessing.connection import wait
+from multiprocessing.process import BaseProcess
+from typing import Dict, Iterable, List, Optional, Set
+
+from zavod import settings
+from zavod.logs import get_logger
+from zavod.meta import Dataset
+from zavod.publish import publish_failure
+from zavod.runner.run import run_dataset
+from zavod.runtime.cache import get_cache, get_engine, get_metadata
+from zavod.runtime.versions import make_version
+
+log = get_logger(__name__)
+
+OK = "ok"
+FAILED = "failed"
+TIMEOUT = "timeout"
+
+
+def _expand(datasets: Iterable[Dataset]) -> Dict[str, Dataset]:
+    nodes: Dict[str, Dataset] = {}
+    for dataset in datasets:
+        for child in dataset.datasets:
+            nodes[child.name] = child
+    return nodes
+
+
+def build_graph(datasets: Iterable[Dataset]) -> Dict[str, Set[str]]:
+    """Build the dependency graph of a set of datasets to be run, expanding
+    collections into their children.
+
+    A dataset depends on those of its `inputs` which are part of the run, and a
+    collection depends on its children. Inputs which are not part of the run are
+    not added to it: their latest published version is used instead.
+
+    Returns:
+        A mapping of each dataset name to the names of the datasets it depends on.
+    """
+    nodes = _expand(datasets)
+    graph: Dict[str, Set[str]] = {}
+    for name, dataset in nodes.items():
+        deps = {i for i in dataset.inputs if i in nodes}
+        deps.update(c.name for c in dataset.children if c.name in nodes)
+        deps.discard(name)
+        graph[name] = deps
+    sort_graph(graph)
+    return graph
+
+
+def sort_graph(graph: Dict[str, Set[str]]) -> List[str]:
+    """Order the datasets in a dependency graph so that each dataset comes after
+    its dependencies."""
+    order: List[str] = []
+    pending = {name: set(deps) for name, deps in graph.items()}
+    while len(pending):
+        ready = sorted(n for n, deps in pending.items() if not len(deps))
+        if not len(ready):
+            raise ValueError("Dataset dependencies form a cycle: %r" % sorted(pending))
+        for name in ready:
+            pending.pop(name)
+            order.append(name)
+        for deps in pending.values():
+            deps.difference_update(ready)
+    return order
+
+
+def _run_process(
+    dataset: Dataset,
+    latest: bool,
+    clear: bool,
+    external: bool,
+    incremental: bool,
+) -> None:
+    """Run a dataset in a worker process, reporting the outcome as exit code."""
+    # Database connections can not be shared with the parent process:
+    get_cache.cache_clear()
+    get_engine.cache_clear()
+    get_metadata.cache_clear()
+    ok = run_dataset(
+        dataset,
+        latest=latest,
+        clear=clear,
+        external=external,
+        incremental=incremental,
+    )
+    sys.exit(0 if ok else 1)
+
+
+def run_many(
+    datasets: Iterable[Dataset],
+    workers: int = 1,
+    timeout: Optional[float] = None,
+    latest: bool = False,
+    clear: bool = False,
+    external: bool = True,
+    incremental: bool = False,
+) -> Dict[str, str]:
+    """Run a set of datasets and their children (see `run_dataset`), each in a
+    separate process, with up to `workers` processes at a time.
+
+    A dataset is started once the datasets it depends on have finished, whether
+    they succeeded or not, so that collections are built after their leaves. A
+    dataset which runs for longer than `timeout` seconds is terminated and its
+    failure is published.
+
+    Returns:
+        The outcome of each dataset run (`ok`, `failed` or `timeout`), in the
+        order in which they finished.
+    """
+    nodes = _expand(datasets)
+    graph = build_graph(nodes.values())
+    order = sort_graph(graph)
+    log.info("Running datasets", datasets=len(order), workers=workers)
+
+    # Using fork, the workers inherit the loaded catalog from this process. This
+    # requires that no store was opened here: LevelDB's background compaction
+    # thread does not survive the fork.
+    mp = multiprocessing.get_context("fork")
+    results: Dict[str, str] = {}
+    running: Dict[str, BaseProcess] = {}
+    deadlines: Dict[str, float] = {}
+    pending = list(order)
+    while len(pending) or len(running):
+        for name in list(pending):
+            if len(running) >= max(1, workers):
+                break
+            if not graph[name].issubset(results.keys()):
+                continue
+            pending.remove(name)
+            args = (nodes[name], latest, clear, external, incremental)
+            process = mp.Process(target=_run_process, args=args, name=name)
+            process.start()
+            log.info("Started dataset run", dataset=name, pid=process.pid)
+            running[name] = process
+            if timeout is not None:
+                deadlines[name] = time.monotonic() + timeout
+
+        wait_time: Optional[float] = None
+        if len(deadlines):
+            wait_time = max(0.0, min(deadlines.values()) - time.monotonic())
+        wait([p.sentinel for p in running.values()], timeout=wait_time)
+
+        now = time.monotonic()
+        for name, proc in list(running.items()):
+            if proc.exitcode is None:
+                if name not in deadlines or deadlines[name] > now:
+                    continue
+                log.error("Dataset run timed out", dataset=name, timeout=timeout)
+                proc.terminate()
+                proc.join()
+                results[name] = TIMEOUT
+                # The run may have been terminated before it made its version:
+                make_version(nodes[name], settings.RUN_VERSION, overwrite=False)
+                publish_failure(nodes[name], latest=latest)
+            else:
+                proc.join()
+                results[name] = OK if proc.exitcode == 0 else FAILED
+                if results[name] == FAILED:
+                    log.error("Dataset run failed", dataset=name)
+            running.pop(name)
+            deadlines.pop(name, None)
+
+    failed = [n for n, r in results.items() if r != OK]
+    log.info("Dataset runs complete", datasets=len(results), failed=failed)
+    return results
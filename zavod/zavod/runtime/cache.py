@@ -1,14 +1,334 @@
+from hashlib import sha1
 from functools import cache
-from sqlalchemy import MetaData, create_engine
+from datetime import timedelta
+from typing import Any, Dict, Generator, List, Optional, Set, Type
+from sqlalchemy import MetaData, Table, Column, DateTime, Unicode, Integer
+from sqlalchemy import LargeBinary, cast, create_engine, func
 from sqlalchemy.engine import Engine
-from nomenklatura.cache import Cache
+from sqlalchemy.future import select
+from sqlalchemy.sql.expression import ColumnElement, delete, update
+from sqlalchemy.exc import OperationalError, InvalidRequestError
+from sqlalchemy.dialects.postgresql import insert as upsert
+from nomenklatura.cache import Cache, CacheValue, Value, randomize_cache
+from rigour.time import naive_now
+import zstandard
 
 from zavod import settings
 from zavod.logs import get_logger
 from zavod.meta import Dataset
 from zavod.archive import dataset_state_path
+from zavod.exc import ConfigurationException
 
 log = get_logger(__name__)
+BATCH_SIZE = 1000
+
+
+class TrackedCache(Cache):
+    """A plain text cache which records the time each key was last read, so that
+    the least recently used keys can be pruned. Reads are collected in memory and
+    written in batches when the cache is flushed. The access times are kept in a
+    separate table, so that existing `cache` tables can be used as they are."""
+
+    def __init__(
+        self, engine: Engine, metadata: MetaData, dataset: Dataset, create: bool = False
+    ) -> None:
+        self._access = Table(
+            "cache_access",
+            metadata,
+            Column("key", Unicode(), primary_key=True),
+            Column("dataset", Unicode(), nullable=False, index=True),
+            Column("accessed", DateTime, index=True),
+            extend_existing=True,
+        )
+        super().__init__(engine, metadata, dataset, create=create)
+        self._accessed: Set[str] = set()
+
+    def set(self, key: str, value: Value) -> None:
+        super().set(key, value)
+        self._accessed.add(key)
+
+    def get(self, key: str, max_age: Optional[int] = None) -> Optional[Value]:
+        value = super().get(key, max_age=max_age)
+        if value is not None:
+            self._accessed.add(key)
+        return value
+
+    def delete(self, key: str) -> None:
+        super().delete(key)
+        self._accessed.discard(key)
+        try:
+            dq = delete(self._access).where(self._access.c.key == key)
+            self.conn.execute(dq)
+        except InvalidRequestError as ire:
+            log.warn("Cache delete error: %s" % ire)
+            self.reset()
+
+    def clear(self) -> None:
+        super().clear()
+        self._accessed = set()
+        try:
+            dq = delete(self._access)
+            dq = dq.where(self._access.c.dataset == self.dataset.name)
+            self.conn.execute(dq)
+        except InvalidRequestError:
+            self.reset()
+
+    def collect_garbage(self) -> None:
+        """Delete the access times of keys which are no longer in the cache."""
+        keys = select(self._table.c.key)
+        dq = delete(self._access).where(self._access.c.key.not_in(keys))
+        self.conn.execute(dq)
+
+    def flush(self) -> None:
+        if len(self._accessed):
+            accessed = sorted(self._accessed)
+            self._accessed = set()
+            now = naive_now()
+            try:
+                for i in range(0, len(accessed), BATCH_SIZE):
+                    rows = [
+                        {"key": key, "dataset": self.dataset.name, "accessed": now}
+                        for key in accessed[i : i + BATCH_SIZE]
+                    ]
+                    istmt = upsert(self._access).values(rows)
+                    values = dict(accessed=istmt.excluded.accessed)
+                    stmt = istmt.on_conflict_do_update(
+                        index_elements=["key"], set_=values
+                    )
+                    self.conn.execute(stmt)
+            except (OperationalError, InvalidRequestError) as exc:
+                log.info("Error while saving cache access times: %s" % exc)
+        super().flush()
+
+    def __repr__(self) -> str:
+        return f"<TrackedCache({self._table!r}, {self._access!r})>"
+
+
+class CompressedCache(Cache):
+    """A cache which stores values compressed with zstd, and de-duplicated by
+    their content hash. A small index table maps each cache key to the hash of
+    its value, while the compressed values are kept in a separate table. This
+    keeps the cache small when many keys share the same (or empty) response
+    bodies, and makes key lookups cheaper because the index rows are small."""
+
+    COMPRESSION_LEVEL = 3
+
+    def __init__(
+        self, engine: Engine, metadata: MetaData, dataset: Dataset, create: bool = False
+    ) -> None:
+        self.dataset = dataset
+        self._engine = engine
+        self._conn = None
+        self._index = Table(
+            "cache_index",
+            metadata,
+            Column("key", Unicode(), primary_key=True),
+            Column("hash", Unicode(40), nullable=True, index=True),
+            Column("dataset", Unicode(), nullable=False),
+            Column("timestamp", DateTime, index=True),
+            Column("accessed", DateTime, nullable=True, index=True),
+            extend_existing=True,
+        )
+        self._blobs = Table(
+            "cache_blob",
+            metadata,
+            Column("hash", Unicode(40), primary_key=True),
+            Column("data", LargeBinary(), nullable=False),
+            Column("size", Integer(), nullable=False),
+            extend_existing=True,
+        )
+        self._table = self._index
+        if create:
+            metadata.create_all(bind=engine, checkfirst=True)
+        self._preload: Dict[str, CacheValue] = {}
+        self._compressor = zstandard.ZstdCompressor(level=self.COMPRESSION_LEVEL)
+        self._decompressor = zstandard.ZstdDecompressor()
+        self._accessed: Set[str] = set()
+        self.hits = 0
+        self.misses = 0
+
+    def _decompress(self, data: bytes) -> str:
+        return self._decompressor.decompress(data).decode("utf-8")
+
+    def _release(self, hash: Optional[str]) -> None:
+        """Delete the stored value for a hash if no key refers to it anymore."""
+        if hash is None:
+            return
+        q = select(self._index.c.key).where(self._index.c.hash == hash).limit(1)
+        if self.conn.execute(q).fetchone() is None:
+            dq = delete(self._blobs).where(self._blobs.c.hash == hash)
+            self.conn.execute(dq)
+
+    def set(self, key: str, value: Value) -> None:
+        self._preload.pop(key, None)
+        hash: Optional[str] = None
+        try:
+            q = select(self._index.c.hash).where(self._index.c.key == key)
+            prev = self.conn.execute(q).fetchone()
+            if value is not None:
+                raw = value.encode("utf-8")
+                hash = sha1(raw).hexdigest()
+                blob = {
+                    "hash": hash,
+                    "data": self._compressor.compress(raw),
+                    "size": len(raw),
+                }
+                bstmt = upsert(self._blobs).values([blob])
+                bstmt = bstmt.on_conflict_do_nothing(index_elements=["hash"])
+                self.conn.execute(bstmt)
+            now = naive_now()
+            entry = {
+                "timestamp": now,
+                "accessed": now,
+                "key": key,
+                "hash": hash,
+                "dataset": self.dataset.name,
+            }
+            istmt = upsert(self._index).values([entry])
+            values = dict(
+                timestamp=istmt.excluded.timestamp,
+                accessed=istmt.excluded.accessed,
+                hash=istmt.excluded.hash,
+            )
+            stmt = istmt.on_conflict_do_update(index_elements=["key"], set_=values)
+            self.conn.execute(stmt)
+            if prev is not None and prev.hash != hash:
+                self._release(prev.hash)
+        except (OperationalError, InvalidRequestError) as exc:
+            log.info("Error while saving to cache: %s" % exc)
+            self.reset()
+
+    def get(self, key: str, max_age: Optional[int] = None) -> Optional[Value]:
+        if max_age is not None and max_age < 1:
+            self.misses += 1
+            return None
+
+        cache_cutoff = None
+        if max_age is not None:
+            cache_cutoff = naive_now() - randomize_cache(max_age)
+
+        cached = self._preload.get(key)
+        if cached is not None:
+            if cache_cutoff is not None and cached.timestamp < cache_cutoff:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._accessed.add(key)
+            return cached.text
+
+        q = select(self._blobs.c.data)
+        q = q.join(self._index, self._index.c.hash == self._blobs.c.hash)
+        q = q.filter(self._index.c.key == key)
+        if cache_cutoff is not None:
+            q = q.filter(self._index.c.timestamp > cache_cutoff)
+        q = q.limit(1)
+        try:
+            row = self.conn.execute(q).fetchone()
+        except InvalidRequestError as ire:
+            log.warn("Cache fetch error: %s" % ire)
+            self.reset()
+            return None
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._accessed.add(key)
+        return self._decompress(row.data)
+
+    def delete(self, key: str) -> None:
+        self._preload.pop(key, None)
+        try:
+            q = select(self._index.c.hash).where(self._index.c.key == key)
+            prev = self.conn.execute(q).fetchone()
+            if prev is None:
+                return
+            pq = delete(self._index).where(self._index.c.key == key)
+            self.conn.execute(pq)
+            self._accessed.discard(key)
+            self._release(prev.hash)
+        except InvalidRequestError as ire:
+            log.warn("Cache delete error: %s" % ire)
+            self.reset()
+
+    def all(self, like: Optional[str]) -> Generator[CacheValue, None, None]:
+        q = select(
+            self._index.c.key,
+            self._index.c.dataset,
+            self._index.c.timestamp,
+            self._blobs.c.data,
+        )
+        q = q.outerjoin(self._blobs, self._index.c.hash == self._blobs.c.hash)
+        if like is not None:
+            q = q.filter(self._index.c.key.like(like))
+        result = self.conn.execute(q)
+        for row in result.yield_per(10000):
+            text = None if row.data is None else self._decompress(row.data)
+            yield CacheValue(row.key, row.dataset, text, row.timestamp)
+
+    def clear(self) -> None:
+        try:
+            pq = delete(self._index)
+            pq = pq.where(self._index.c.dataset == self.dataset.name)
+            self.conn.execute(pq)
+            self.collect_garbage()
+        except InvalidRequestError:
+            self.reset()
+
+    def collect_garbage(self) -> None:
+        """Delete all stored values which are not referenced by any key."""
+        used = select(self._index.c.hash).where(self._index.c.hash.is_not(None))
+        bq = delete(self._blobs).where(self._blobs.c.hash.not_in(used))
+        self.conn.execute(bq)
+
+    def flush(self) -> None:
+        # Record the time of the last access for all keys read since the
+        # previous flush, so that the least recently used keys can be pruned:
+        if len(self._accessed):
+            accessed = sorted(self._accessed)
+            self._accessed = set()
+            now = naive_now()
+            try:
+                for i in range(0, len(accessed), BATCH_SIZE):
+                    keys = accessed[i : i + BATCH_SIZE]
+                    uq = update(self._index).where(self._index.c.key.in_(keys))
+                    self.conn.execute(uq.values(accessed=now))
+            except (OperationalError, InvalidRequestError) as exc:
+                log.info("Error while saving cache access times: %s" % exc)
+        super().flush()
+
+    def stats(self) -> Dict[str, Any]:
+        """Get the size of the cache and the hit rate of lookups made through
+        this object."""
+        keys_q = select(func.count()).select_from(self._index)
+        blobs_q = select(
+            func.count(),
+            func.coalesce(func.sum(self._blobs.c.size), 0),
+            func.coalesce(func.sum(func.length(self._blobs.c.data)), 0),
+        )
+        keys = self.conn.execute(keys_q).scalar()
+        blobs = self.conn.execute(blobs_q).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "keys": keys,
+            "values": blobs[0] if blobs is not None else 0,
+            "size": blobs[1] if blobs is not None else 0,
+            "compressed_size": blobs[2] if blobs is not None else 0,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups > 0 else None,
+        }
+
+    def __repr__(self) -> str:
+        return f"<CompressedCache({self._index!r}, {self._blobs!r})>"
+
+    def __hash__(self) -> int:
+        return hash((self.dataset.name, self._index.name))
+
+
+backends: Dict[str, Type[Cache]] = {
+    "Cache": TrackedCache,
+    "CompressedCache": CompressedCache,
+}
 
 
 @cache
@@ -26,7 +346,11 @@ def get_metadata(uri: str) -> MetaData:
 
 @cache
 def get_cache(dataset: Dataset) -> Cache:
-    """Get a cache object for the given dataset."""
+    """Get a cache object for the given dataset. The type of cache is selected
+    using the `ZAVOD_CACHE_BACKEND` setting."""
+    if settings.CACHE_BACKEND not in backends:
+        msg = "Invalid cache backend: %s" % settings.CACHE_BACKEND
+        raise ConfigurationException(msg)
     database_uri = settings.CACHE_DATABASE_URI
     if database_uri is None:
         cache_path = dataset_state_path(dataset.name) / "cache.sqlite3"
@@ -34,4 +358,124 @@ def get_cache(dataset: Dataset) -> Cache:
     engine = get_engine(database_uri)
     metadata = get_metadata(database_uri)
     log.info("Using cache: %r" % engine, dataset=dataset.name)
-    return Cache(engine, metadata, dataset, create=True)
+    cache_cls = backends[settings.CACHE_BACKEND]
+    return cache_cls(engine, metadata, dataset, create=True)
+
+
+def _evict_keys(cache: Cache, table: Table, keys: List[str]) -> None:
+    for i in range(0, len(keys), BATCH_SIZE):
+        dq = delete(table).where(table.c.key.in_(keys[i : i + BATCH_SIZE]))
+        cache.conn.execute(dq)
+
+
+def _text_size(cache: Cache, column: ColumnElement[Any]) -> ColumnElement[Any]:
+    """Get the number of bytes of a text column. SQLite counts the characters of
+    a text value, and the bytes of a blob."""
+    if cache._engine.dialect.name == "sqlite":
+        return func.length(cast(column, LargeBinary))
+    return func.octet_length(column)
+
+
+def _cache_size(cache: Cache) -> int:
+    """Get the number of bytes used to store the values in the cache of the
+    dataset. Compressed values shared by several keys are counted once."""
+    if isinstance(cache, CompressedCache):
+        index = cache._index
+        used = select(index.c.hash).where(index.c.dataset == cache.dataset.name)
+        q = select(func.sum(func.length(cache._blobs.c.data)))
+        q = q.where(cache._blobs.c.hash.in_(used))
+    else:
+        table = cache._table
+        q = select(func.sum(_text_size(cache, table.c.text)))
+        q = q.where(table.c.dataset == cache.dataset.name)
+    return int(cache.conn.execute(q).scalar() or 0)
+
+
+def prune_cache(
+    cache: Cache,
+    max_age: Optional[int] = None,
+    max_size: Optional[int] = None,
+) -> int:
+    """Remove entries from the cache of a dataset, and compact the database.
+
+    Entries are evicted if they have not been used in `max_age` days. If the
+    cache is then still larger than `max_size` bytes, the least recently used
+    entries are evicted until it fits. An entry is used when it is stored or
+    read.
+
+    Args:
+        cache: The cache to prune.
+        max_age: Number of days after which unused entries are evicted.
+        max_size: Maximum size of the stored values, in bytes.
+
+    Returns:
+        The number of evicted entries.
+    """
+    cache.flush()
+    used: ColumnElement[Any]
+    if isinstance(cache, CompressedCache):
+        table = cache._index
+        source: Any = table
+        used = func.coalesce(table.c.accessed, table.c.timestamp)
+    elif isinstance(cache, TrackedCache):
+        table = cache._table
+        access = cache._access
+        source = table.outerjoin(access, table.c.key == access.c.key)
+        used = func.coalesce(access.c.accessed, table.c.timestamp)
+    else:
+        table = cache._table
+        source = table
+        used = table.c.timestamp
+    in_dataset = table.c.dataset == cache.dataset.name
+    evicted = 0
+    if max_age is not None:
+        cutoff = naive_now() - timedelta(days=max_age)
+        stale = select(table.c.key).select_from(source).where(in_dataset)
+        dq = delete(table).where(table.c.key.in_(stale.where(used < cutoff)))
+        evicted += cache.conn.execute(dq).rowcount
+        if isinstance(cache, (CompressedCache, TrackedCache)):
+            cache.collect_garbage()
+
+    size: ColumnElement[Any]
+    while max_size is not None:
+        excess = _cache_size(cache) - max_size
+        if excess <= 0:
+            break
+        if isinstance(cache, CompressedCache):
+            size = func.length(cache._blobs.c.data)
+            q = select(table.c.key, table.c.hash.label("ref"), size.label("size"))
+            q = q.outerjoin(cache._blobs, table.c.hash == cache._blobs.c.hash)
+        else:
+            size = _text_size(cache, table.c.text)
+            q = select(table.c.key, table.c.key.label("ref"), size.label("size"))
+            q = q.select_from(source)
+        q = q.where(in_dataset).order_by(used.asc())
+        keys: List[str] = []
+        refs: Set[str] = set()
+        for row in cache.conn.execute(q).yield_per(10000):
+            keys.append(row.key)
+            # Values shared by several keys are only counted once:
+            if row.ref is not None and row.ref not in refs:
+                refs.add(row.ref)
+                excess -= row.size or 0
+            if excess <= 0:
+                break
+        if not len(keys):
+            break
+        _evict_keys(cache, table, keys)
+        evicted += len(keys)
+        if isinstance(cache, (CompressedCache, TrackedCache)):
+            cache.collect_garbage()
+
+    cache.flush()
+    if cache._engine.dialect.name == "sqlite":
+        options = {"isolation_level": "AUTOCOMMIT"}
+        with cache._engine.connect().execution_options(**options) as conn:
+            conn.exec_driver_sql("VACUUM")
+    log.info(
+        "Pruned cache",
+        dataset=cache.dataset.name,
+        evicted=evicted,
+        size=_cache_size(cache),
+    )
+    return evicted
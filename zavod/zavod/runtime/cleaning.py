@@ -1,25 +1,89 @@
 from typing import TYPE_CHECKING
-from typing import Optional, Generator, Tuple
+from typing import Dict, List, Optional, Generator, Tuple
 from rigour.ids import get_identifier_format
 from prefixdate.precision import Precision
 from followthemoney.types import registry
 from followthemoney.property import Property
+from datapatch import Lookup
 
 from zavod.logs import get_logger
-from zavod.runtime.lookups import prop_lookup
+from zavod.meta import Dataset
+from zavod.runtime.lookups import get_type_lookup, prop_lookup
+from zavod.runtime.stats import ContextStats
 
 if TYPE_CHECKING:
     from zavod.entity import Entity
 
 VALIDATE_FORMATS = ("bic", "isin", "lei", "imo", "iban")
+# Phone numbers and entity references are cleaned in the context of the entity
+# (its countries and ID), free-form text is rarely repeated:
+UNCACHED_TYPES = (
+    registry.phone,
+    registry.entity,
+    registry.text,
+    registry.html,
+    registry.json,
+)
+# Maximum number of cleaned values memoised per dataset:
+CACHE_SIZE = 100_000
 log = get_logger(__name__)
 
+CacheKey = Tuple[str, Property, Optional[str], bool, bool, Optional[str]]
+Outcome = List[Tuple[Property, str, Optional[str]]]
 
-def clean_identifier(prop: Property, value: str) -> Optional[str]:
-    normalized: Optional[str] = value
+
+class ValueCache(object):
+    """A bounded memo of the outcome of cleaning property values for a dataset,
+    i.e. the result of the type lookup and the cleaned (or rejected) value for
+    each of the resulting values. Crawlers add the same countries, dates and
+    identifiers over and over again, so this saves repeating the lookup match
+    and the type-specific cleaning for each of them."""
+
+    def __init__(self, lookups: Dict[str, Lookup], size: int = CACHE_SIZE) -> None:
+        # The lookups of the dataset the memo was built from:
+        self.lookups = lookups
+        self.size = size
+        self.outcomes: Dict[CacheKey, Outcome] = {}
+        self.stats = ContextStats()
+
+    def get(self, key: CacheKey) -> Optional[Outcome]:
+        outcome = self.outcomes.get(key)
+        if outcome is None:
+            self.stats.clean_misses += 1
+        else:
+            self.stats.clean_hits += 1
+        return outcome
+
+    def set(self, key: CacheKey, outcome: Outcome) -> None:
+        while len(self.outcomes) >= self.size:
+            # Evict the oldest entries:
+            self.outcomes.pop(next(iter(self.outcomes)))
+        self.outcomes[key] = outcome
+
+
+_caches: Dict[str, ValueCache] = {}
+
+
+def get_value_cache(dataset: Dataset) -> ValueCache:
+    """Get the cleaned value memo for the given dataset. The memo is rebuilt when
+    the lookups of the dataset change, e.g. because its metadata was reloaded."""
+    cache = _caches.get(dataset.name)
+    if cache is None or cache.lookups is not dataset.lookups:
+        cache = _caches[dataset.name] = ValueCache(dataset.lookups)
+    return cache
+
+
+def normalize_identifier(prop: Property, value: str) -> Optional[str]:
+    """Normalise an identifier of a validated format, or return `None` if it is
+    invalid. Identifiers of other formats are returned as-is."""
     if prop.format in VALIDATE_FORMATS:
         format_ = get_identifier_format(prop.format)
-        normalized = format_.normalize(value)
+        return format_.normalize(value)
+    return value
+
+
+def clean_identifier(prop: Property, value: str) -> Optional[str]:
+    normalized = normalize_identifier(prop, value)
     if normalized is None:
         log.warning(
             "Failed to validate identifier",
@@ -31,14 +95,31 @@ def clean_identifier(prop: Property, value: str) -> Optional[str]:
     return normalized
 
 
-def value_clean(
+def _invalid_rewrite(entity: "Entity", prop: Property, value: Optional[str]) -> bool:
+    """Check if a type lookup moves the value to a property which isn't part of
+    the schema of the entity (`prop_lookup` logs a warning for those)."""
+    lookup = get_type_lookup(entity.dataset, prop.type)
+    if lookup is None:
+        return False
+    result = lookup.match(value)
+    if result is None or result.prop is None:
+        return False
+    return entity.schema.get(result.prop) is None
+
+
+def _clean_outcome(
     entity: "Entity",
     prop: Property,
     value: Optional[str],
     cleaned: bool = False,
     fuzzy: bool = False,
     format: Optional[str] = None,
-) -> Generator[Tuple[Property, str], None, None]:
+) -> Tuple[Outcome, bool]:
+    """Clean the value, returning the outcome and whether it may be memoised.
+    Values which log a warning while being cleaned aren't memoised, so that
+    the warning is repeated each time the value is added."""
+    outcome: Outcome = []
+    cacheable = not _invalid_rewrite(entity, prop, value)
     for prop_, item in prop_lookup(entity, prop, value):
         clean: Optional[str] = item
         if not cleaned:
@@ -49,10 +130,44 @@ def value_clean(
                 format=format,
             )
             if prop_.type == registry.identifier and clean is not None:
-                clean = clean_identifier(prop_, clean)
+                normalized = normalize_identifier(prop_, clean)
+                if normalized is None:
+                    cacheable = False
+                    normalized = clean_identifier(prop_, clean)
+                clean = normalized
             if prop_.type == registry.date and clean is not None:
                 # none of the information in OpenSanctions is time-critical
                 clean = clean[: Precision.DAY.value]
+        outcome.append((prop_, item, clean))
+    # A lookup may move the value to a property of an uncached type:
+    if any(p.type in UNCACHED_TYPES for p, _, _ in outcome):
+        cacheable = False
+    return outcome, cacheable
+
+
+def value_clean(
+    entity: "Entity",
+    prop: Property,
+    value: Optional[str],
+    cleaned: bool = False,
+    fuzzy: bool = False,
+    format: Optional[str] = None,
+) -> Generator[Tuple[Property, str], None, None]:
+    if prop.type in UNCACHED_TYPES:
+        outcome, _ = _clean_outcome(entity, prop, value, cleaned, fuzzy, format)
+    else:
+        cache = get_value_cache(entity.dataset)
+        key = (entity.schema.name, prop, value, cleaned, fuzzy, format)
+        cached = cache.get(key)
+        if cached is None:
+            outcome, cacheable = _clean_outcome(
+                entity, prop, value, cleaned, fuzzy, format
+            )
+            if cacheable:
+                cache.set(key, outcome)
+        else:
+            outcome = cached
+    for prop_, item, clean in outcome:
         if clean is not None:
             if len(clean) > prop_.max_length:
                 log.warning(
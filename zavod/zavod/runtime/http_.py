@@ -1,16 +1,30 @@
+import os
+import glob
+import json
+import time
+import shutil
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
 import warnings
-from typing import Any, Optional, Tuple, Mapping, Union, List
+from threading import Lock
+from typing import Any, Dict, Optional, Tuple, Mapping, Union, List
 from functools import partial
 from pathlib import Path
+from urllib.parse import urlparse
 from banal import hash_data
-from requests import Session
-from requests.adapters import HTTPAdapter
-from urllib3.exceptions import InsecureRequestWarning
+from requests import PreparedRequest, Response, Session
+from requests.adapters import HTTPAdapter, DEFAULT_POOLSIZE
+from requests.exceptions import ConnectionError, ChunkedEncodingError
+from urllib3.connectionpool import ConnectionPool
+from urllib3.exceptions import InsecureRequestWarning, InvalidHeader
+from urllib3.response import BaseHTTPResponse
 from urllib3.util import Retry
 
 from zavod import settings
 from zavod.logs import get_logger
 from zavod.meta.http import HTTP
+from zavod.runtime.throttle import HostThrottle
 
 log = get_logger(__name__)
 warnings.filterwarnings("ignore", category=InsecureRequestWarning)
@@ -19,6 +33,95 @@ _Auth = Optional[Tuple[str, str]]
 _Headers = Optional[Mapping[str, str]]
 _Body = Optional[Union[Mapping[str, str], List[Tuple[str, str]]]]
 
+# Response headers used to revalidate cached content, and the request headers
+# used to send them back to the server:
+VALIDATORS = {"ETag": "If-None-Match", "Last-Modified": "If-Modified-Since"}
+# Large files are fetched in parallel byte ranges of at least this size:
+MIN_SEGMENT_SIZE = 16 * 1024 * 1024
+# How often an interrupted download is resumed before giving up:
+RESUME_ATTEMPTS = 3
+CHUNK_SIZE = 8192 * 10
+
+
+class ThrottledRetry(Retry):
+    """A retry policy which reports `Retry-After` headers sent by the server to the
+    throttles of the adapter, so that other requests to the host are held back as
+    well."""
+
+    adapter: Optional["ThrottledAdapter"] = None
+
+    def new(self, **kw: Any) -> "ThrottledRetry":
+        retry = super().new(**kw)
+        retry.adapter = self.adapter
+        return retry
+
+    def increment(
+        self,
+        method: Optional[str] = None,
+        url: Optional[str] = None,
+        response: Optional[BaseHTTPResponse] = None,
+        error: Optional[Exception] = None,
+        _pool: Optional[ConnectionPool] = None,
+        _stacktrace: Optional[Any] = None,
+    ) -> "ThrottledRetry":
+        if response is not None and _pool is not None and self.adapter is not None:
+            delay = self.get_retry_after(response)
+            if delay is not None and _pool.host is not None:
+                self.adapter.get_throttle(_pool.host).backoff(delay)
+        return super().increment(
+            method=method,
+            url=url,
+            response=response,
+            error=error,
+            _pool=_pool,
+            _stacktrace=_stacktrace,
+        )
+
+
+class ThrottledAdapter(HTTPAdapter):
+    """An HTTP adapter which applies the per-host rate limit and concurrency cap
+    configured in the dataset metadata to all requests."""
+
+    def __init__(self, http_conf: HTTP, **kwargs: Any) -> None:
+        self.http_conf = http_conf
+        self._throttles: Dict[str, HostThrottle] = {}
+        self._throttles_lock = Lock()
+        super().__init__(**kwargs)
+        if isinstance(self.max_retries, ThrottledRetry):
+            self.max_retries.adapter = self
+
+    def get_throttle(self, host: str) -> HostThrottle:
+        """Get the rate limiter for the given host name."""
+        with self._throttles_lock:
+            throttle = self._throttles.get(host)
+            if throttle is None:
+                throttle = HostThrottle(
+                    host,
+                    rate=self.http_conf.rate_limit,
+                    burst=self.http_conf.rate_burst,
+                    concurrency=self.http_conf.host_concurrency,
+                )
+                self._throttles[host] = throttle
+            return throttle
+
+    def send(self, request: PreparedRequest, **kwargs: Any) -> Response:  # type: ignore
+        host = urlparse(str(request.url)).hostname or ""
+        throttle = self.get_throttle(host)
+        throttle.acquire()
+        try:
+            response = super().send(request, **kwargs)
+        finally:
+            throttle.release()
+        retry_after = response.headers.get("Retry-After")
+        if retry_after is not None and response.status_code in (429, 503):
+            try:
+                throttle.backoff(self.max_retries.parse_retry_after(retry_after))
+            except InvalidHeader:
+                pass
+        elif response.ok:
+            throttle.recover()
+        return response
+
 
 def make_session(http_conf: HTTP) -> Session:
     session = Session()
@@ -28,14 +131,18 @@ def make_session(http_conf: HTTP) -> Session:
         session.request,
         timeout=settings.HTTP_TIMEOUT,
     )
-    retries = Retry(
+    retries = ThrottledRetry(
         total=http_conf.total_retries,
         backoff_factor=http_conf.backoff_factor,
         status_forcelist=http_conf.retry_statuses,
         allowed_methods=http_conf.retry_methods,
     )
-    session.mount("https://", HTTPAdapter(max_retries=retries))
-    session.mount("http://", HTTPAdapter(max_retries=retries))
+    # Make sure the connection pool can hold one connection per worker
+    # thread used by `Context.fetch_many`:
+    pool_size = max(DEFAULT_POOLSIZE, http_conf.max_workers)
+    adapter = ThrottledAdapter(http_conf, max_retries=retries, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
     return session
 
 
@@ -59,6 +166,267 @@ def request_hash(
     return f"{url}[{hsh}]"
 
 
+def validators_key(fingerprint: str) -> str:
+    """The cache key used to store the revalidation headers of a cached request."""
+    return f"validators:{fingerprint}"
+
+
+def get_validators(response: Response) -> Dict[str, str]:
+    """Get the headers from a response which can be used to check if a cached
+    copy of the content is still valid."""
+    validators: Dict[str, str] = {}
+    for header in VALIDATORS.keys():
+        value = response.headers.get(header)
+        if value is not None:
+            validators[header] = value
+    return validators
+
+
+def conditional_headers(
+    headers: _Headers, validators: Optional[Dict[str, str]]
+) -> _Headers:
+    """Add the `If-None-Match` and `If-Modified-Since` headers to a request,
+    based on the validators stored with a cached response."""
+    if validators is None or not len(validators):
+        return headers
+    conditional = dict(headers or {})
+    for header, request_header in VALIDATORS.items():
+        value = validators.get(header)
+        if value is not None:
+            conditional.setdefault(request_header, value)
+    return conditional
+
+
+class _RangeFailed(Exception):
+    """The server did not respond to a range request with the requested bytes."""
+
+
+def _part_path(out_path: Path, index: int) -> Path:
+    return out_path.with_name(f".{out_path.name}.part{index}")
+
+
+def _state_path(out_path: Path) -> Path:
+    return out_path.with_name(f".{out_path.name}.part.json")
+
+
+def _part_size(path: Path) -> int:
+    return path.stat().st_size if path.exists() else 0
+
+
+def _clear_parts(out_path: Path) -> None:
+    """Remove the temporary files of an incomplete download."""
+    for path in out_path.parent.glob(f".{glob.escape(out_path.name)}.part*"):
+        path.unlink()
+
+
+def _load_state(out_path: Path, url: str) -> Optional[Dict[str, Any]]:
+    """Load the state of an interrupted download of the given URL, if any."""
+    state_path = _state_path(out_path)
+    if not state_path.exists():
+        return None
+    with open(state_path, "r") as fh:
+        state: Dict[str, Any] = json.load(fh)
+    if state.get("url") != url:
+        return None
+    return state
+
+
+def _segments(size: int, connections: int) -> List[Tuple[int, int]]:
+    """Split a file into byte ranges to be fetched in parallel."""
+    count = max(1, min(connections, size // MIN_SEGMENT_SIZE))
+    step = -(-size // count)
+    return [(start, min(size, start + step) - 1) for start in range(0, size, step)]
+
+
+def _make_state(url: str, res: Response, connections: int) -> Dict[str, Any]:
+    """Describe a download based on the first response, including the byte ranges
+    to fetch if the server supports resuming the download."""
+    size: Optional[int] = None
+    length = res.headers.get("Content-Length")
+    encoding = res.headers.get("Content-Encoding", "identity")
+    if length is not None and length.isdigit() and encoding == "identity":
+        size = int(length)
+    segments: Optional[List[Tuple[int, int]]] = None
+    if res.headers.get("Accept-Ranges") == "bytes" and size is not None and size > 0:
+        segments = _segments(size, connections)
+    return {
+        "url": url,
+        "size": size,
+        "segments": segments,
+        "validators": get_validators(res),
+    }
+
+
+def _write_stream(res: Response, path: Path, append: bool = False) -> None:
+    with open(path, "ab" if append else "wb") as fh:
+        for chunk in res.iter_content(chunk_size=CHUNK_SIZE):
+            fh.write(chunk)
+
+
+def _fetch_range(
+    session: Session,
+    url: str,
+    path: Path,
+    start: int,
+    end: int,
+    auth: Optional[Any],
+    headers: Optional[Any],
+    validators: Dict[str, str],
+) -> None:
+    """Fetch the byte range `start`-`end` (inclusive) of a URL into `path`,
+    continuing after any data already written to the file."""
+    offset = start + _part_size(path)
+    if offset > end:
+        return
+    range_headers = dict(headers or {})
+    range_headers["Range"] = f"bytes={offset}-{end}"
+    # Only accept the range if the file has not changed on the server:
+    if_range = validators.get("ETag", validators.get("Last-Modified"))
+    if if_range is not None and not if_range.startswith("W/"):
+        range_headers["If-Range"] = if_range
+    with session.get(url, auth=auth, headers=range_headers, stream=True) as res:
+        res.raise_for_status()
+        content_range = res.headers.get("Content-Range", "")
+        if res.status_code != 206 or not content_range.startswith(f"bytes {offset}-"):
+            raise _RangeFailed(url)
+        _write_stream(res, path, append=True)
+
+
+def _fetch_segments(
+    session: Session,
+    url: str,
+    out_path: Path,
+    state: Dict[str, Any],
+    auth: Optional[Any],
+    headers: Optional[Any],
+) -> None:
+    """Fetch all byte ranges of a download which are not yet complete, resuming
+    them if the connection is interrupted."""
+    segments: List[Tuple[int, int]] = state["segments"]
+    for attempt in range(RESUME_ATTEMPTS + 1):
+        pending = [
+            (idx, start, end)
+            for idx, (start, end) in enumerate(segments)
+            if _part_size(_part_path(out_path, idx)) < end - start + 1
+        ]
+        if not len(pending):
+            return
+        if attempt > 0:
+            log.info("Resuming download", url=url, attempt=attempt)
+        with ThreadPoolExecutor(max_workers=len(pending)) as executor:
+            futures = [
+                executor.submit(
+                    copy_context().run,
+                    _fetch_range,
+                    session,
+                    url,
+                    _part_path(out_path, idx),
+                    start,
+                    end,
+                    auth,
+                    headers,
+                    state["validators"],
+                )
+                for (idx, start, end) in pending
+            ]
+        for future in futures:
+            exc = future.exception()
+            if isinstance(exc, (ConnectionError, ChunkedEncodingError)):
+                log.warning("Download interrupted: %s" % exc, url=url)
+                if attempt == RESUME_ATTEMPTS:
+                    raise exc
+            elif exc is not None:
+                raise exc
+
+
+def verify_checksum(path: Path, checksum: str) -> None:
+    """Check that the contents of a file match a checksum given as `algorithm:hex`,
+    e.g. `sha256:e3b0c4...`. Raises an `IOError` if they do not."""
+    algorithm, _, expected = checksum.partition(":")
+    if not len(expected):
+        raise ValueError("Checksum must be given as algorithm:digest: %r" % checksum)
+    digest = hashlib.new(algorithm)
+    with open(path, "rb") as fh:
+        while True:
+            block = fh.read(CHUNK_SIZE)
+            if not block:
+                break
+            digest.update(block)
+    if digest.hexdigest() != expected.lower():
+        msg = "Checksum mismatch for %s: %s (expected %s)"
+        raise IOError(msg % (path, digest.hexdigest(), expected))
+
+
+def _download(
+    session: Session,
+    url: str,
+    out_path: Path,
+    auth: Optional[Any],
+    headers: Optional[Any],
+    conditional: Optional[Any],
+    method: str,
+    data: _Body,
+    connections: int,
+    resume: bool = True,
+) -> Optional[Dict[str, Any]]:
+    """Download a URL into temporary part files next to `out_path`. Returns the
+    state of the download, or `None` if the server reports that the existing file
+    has not been modified."""
+    state = _load_state(out_path, url) if resume and method == "GET" else None
+    if state is None:
+        _clear_parts(out_path)
+        with session.request(
+            method=method,
+            url=url,
+            auth=auth,
+            headers=conditional,
+            stream=True,
+            data=data,
+        ) as res:
+            res.raise_for_status()
+            if res.status_code == 304 and out_path.exists():
+                return None
+            state = _make_state(url, res, connections if resume else 1)
+            if not resume or method != "GET":
+                state["segments"] = None
+            if state["segments"] is not None:
+                with open(_state_path(out_path), "w") as fh:
+                    json.dump(state, fh)
+            if state["segments"] is None or len(state["segments"]) == 1:
+                try:
+                    _write_stream(res, _part_path(out_path, 0))
+                except (ConnectionError, ChunkedEncodingError) as exc:
+                    if state["segments"] is None:
+                        raise
+                    log.warning("Download interrupted: %s" % exc, url=url)
+    else:
+        log.info("Resuming download", url=url, path=out_path.as_posix())
+
+    if state["segments"] is not None:
+        try:
+            _fetch_segments(session, url, out_path, state, auth, headers)
+        except _RangeFailed:
+            log.warning("Cannot resume download, starting over", url=url)
+            return _download(
+                session,
+                url,
+                out_path,
+                auth,
+                headers,
+                headers,
+                method,
+                data,
+                connections,
+                resume=False,
+            )
+        # Concatenate the parallel ranges into the first part file:
+        with open(_part_path(out_path, 0), "ab") as fh:
+            for idx in range(1, len(state["segments"])):
+                with open(_part_path(out_path, idx), "rb") as part_fh:
+                    shutil.copyfileobj(part_fh, fh)
+    return state
+
+
 def fetch_file(
     session: Session,
     url: str,
@@ -68,23 +436,70 @@ def fetch_file(
     headers: Optional[Any] = None,
     method: str = "GET",
     data: _Body = None,
+    cache_days: Optional[int] = None,
+    checksum: Optional[str] = None,
+    connections: int = 1,
 ) -> Path:
-    """Fetch a (large) file via HTTP to the data path."""
+    """Fetch a (large) file via HTTP to the data path.
+
+    If the file already exists, it is re-used. When `cache_days` is given, files
+    older than that are revalidated with the server using the `ETag` and
+    `Last-Modified` headers of the original response, and only downloaded again
+    if they have changed.
+
+    The file is downloaded to a temporary file and only moved to its destination
+    once it is complete. If the server supports range requests, interrupted
+    downloads are resumed (also across runs), and the file can be fetched in
+    `connections` parallel byte ranges. The size of the file is checked against
+    the `Content-Length` of the response, and its contents against `checksum`
+    (given as `algorithm:hexdigest`) if set."""
     out_path = data_path.joinpath(name)
+    validators_path = out_path.with_name(f".{out_path.name}.validators.json")
+    conditional = headers
     if out_path.exists():
-        return out_path
+        if cache_days is None:
+            return out_path
+        age = time.time() - out_path.stat().st_mtime
+        if age < cache_days * 86400:
+            return out_path
+        if method == "GET" and validators_path.exists():
+            with open(validators_path, "r") as fh:
+                conditional = conditional_headers(headers, json.load(fh))
     log.info("Fetching file", url=url)
     out_path.parent.mkdir(parents=True, exist_ok=True)
-    with session.request(
-        method=method,
-        url=url,
-        auth=auth,
-        headers=headers,
-        stream=True,
-        data=data,
-    ) as res:
-        res.raise_for_status()
-        with open(out_path, "wb") as fh:
-            for chunk in res.iter_content(chunk_size=8192 * 10):
-                fh.write(chunk)
+    state = _download(
+        session,
+        url,
+        out_path,
+        auth,
+        headers,
+        conditional,
+        method,
+        data,
+        connections,
+    )
+    if state is None:
+        log.info("File not modified", url=url, path=out_path.as_posix())
+        os.utime(out_path)
+        return out_path
+
+    part_path = _part_path(out_path, 0)
+    try:
+        size = _part_size(part_path)
+        if state["size"] is not None and size != state["size"]:
+            msg = "Incomplete download of %s: %d bytes (expected %d)"
+            raise IOError(msg % (url, size, state["size"]))
+        if checksum is not None:
+            verify_checksum(part_path, checksum)
+    except Exception:
+        _clear_parts(out_path)
+        raise
+    os.replace(part_path, out_path)
+    _clear_parts(out_path)
+    validators: Dict[str, str] = state["validators"]
+    if len(validators):
+        with open(validators_path, "w") as fh:
+            json.dump(validators, fh)
+    else:
+        validators_path.unlink(missing_ok=True)
     return out_path
@@ -1,3 +1,4 @@
+import shutil
 import orjson
 from pathlib import Path
 from rigour.time import utc_now
@@ -27,15 +28,23 @@ class Issue(TypedDict):
 class DatasetIssues(object):
     """A log of issues that occurred during the running and export of a dataset."""
 
-    def __init__(self, dataset: Dataset) -> None:
+    def __init__(self, dataset: Dataset, path: Optional[Path] = None) -> None:
         self.dataset = dataset
         self.fh: Optional[BinaryIO] = None
-        get_dataset_artifact(self.dataset.name, ISSUES_LOG)
+        self._path = path
+        if path is None:
+            get_dataset_artifact(self.dataset.name, ISSUES_LOG)
+
+    @property
+    def path(self) -> Path:
+        """The path of the issues log file."""
+        if self._path is not None:
+            return self._path
+        return dataset_resource_path(self.dataset.name, ISSUES_LOG)
 
     def write(self, event: Dict[str, Any]) -> None:
         if self.fh is None:
-            path = dataset_resource_path(self.dataset.name, ISSUES_LOG)
-            self.fh = open(path, "ab")
+            self.fh = open(self.path, "ab")
         data = dict(event)
         for key, value in data.items():
             if key == "dataset" and value == self.dataset.name:
@@ -71,11 +80,18 @@ class DatasetIssues(object):
         out = orjson.dumps(record, option=orjson.OPT_APPEND_NEWLINE)
         self.fh.write(out)
 
+    def merge(self, path: Path) -> None:
+        """Append the issues from a partial log file, e.g. written by a partition
+        of the crawl, to the log."""
+        if self.fh is None:
+            self.fh = open(self.path, "ab")
+        with open(path, "rb") as fh:
+            shutil.copyfileobj(fh, self.fh)
+
     def clear(self) -> None:
         """Clear (delete) the issues log file."""
         self.close()
-        log_path = dataset_resource_path(self.dataset.name, ISSUES_LOG)
-        with open(log_path, "w") as fh:
+        with open(self.path, "w") as fh:
             fh.flush()
         file_path = dataset_resource_path(self.dataset.name, ISSUES_FILE)
         file_path.unlink(missing_ok=True)
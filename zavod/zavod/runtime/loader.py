@@ -2,19 +2,17 @@ import re
 import sys
 from pathlib import Path
 from types import ModuleType
-from typing import Callable, Any, Optional, cast
+from typing import Callable, Any, Iterable, Optional, Tuple, cast
 from importlib import import_module, invalidate_caches
 from importlib.util import module_from_spec, spec_from_file_location
 
 from zavod.meta import Dataset
 
 MODULE_RE = re.compile(r"^[\w\.]+:[\w]+")
+Partitioned = Tuple[Callable[[Any], Iterable[Any]], Callable[[Any, Any], None]]
 
 
-def load_entry_point(dataset: Dataset, method: str = "crawl") -> Callable[[Any], None]:
-    """Load the actual runner code behind the dataset. This will work either
-    by specifying a file name relative to the dataset.base_path, or a proper
-    Python module name."""
+def _load_module(dataset: Dataset, method: str) -> Tuple[ModuleType, str]:
     invalidate_caches()
     if dataset.entry_point is None:
         raise RuntimeError("The dataset has no entry point!")
@@ -41,6 +39,14 @@ def load_entry_point(dataset: Dataset, method: str = "crawl") -> Callable[[Any],
                     break
     if module is None:
         raise RuntimeError("Could not load entry point: %s" % dataset.entry_point)
+    return module, method
+
+
+def load_entry_point(dataset: Dataset, method: str = "crawl") -> Callable[[Any], None]:
+    """Load the actual runner code behind the dataset. This will work either
+    by specifying a file name relative to the dataset.base_path, or a proper
+    Python module name."""
+    module, method = _load_module(dataset, method)
     try:
         method_ = getattr(module, method)
         return cast(Callable[[Any], None], method_)
@@ -48,6 +54,19 @@ def load_entry_point(dataset: Dataset, method: str = "crawl") -> Callable[[Any],
         raise RuntimeError("Function does not exist: %r (on %r)" % (method, module))
 
 
+def load_partitions(dataset: Dataset) -> Optional[Partitioned]:
+    """Load the functions of a crawler which can be run in partitions: the
+    `partitions(context)` function returns the partitions of the work, and each
+    of them is crawled using `crawl_partition(context, partition)`. Returns `None`
+    if the entry point module does not define both functions."""
+    module, _ = _load_module(dataset, "crawl")
+    partitions = getattr(module, "partitions", None)
+    crawl_partition = getattr(module, "crawl_partition", None)
+    if not callable(partitions) or not callable(crawl_partition):
+        return None
+    return partitions, crawl_partition
+
+
 def example_function() -> None:
     """For unit tests."""
     pass
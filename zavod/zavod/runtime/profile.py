@@ -0,0 +1,158 @@
+import os
+import sys
+import threading
+from pathlib import Path
+from types import FrameType, TracebackType
+from collections import Counter
+from typing import Dict, List, Optional, Tuple, Type
+
+from zavod.logs import get_logger
+from zavod.meta import Dataset
+from zavod.archive import dataset_data_path
+
+log = get_logger(__name__)
+
+Stack = Tuple[str, ...]
+
+# Seconds between two samples of the stack of the profiled thread:
+INTERVAL = 0.005
+# Number of functions listed in the profile summary:
+TOP_N = 50
+
+
+def _frame_name(frame: FrameType) -> str:
+    code = frame.f_code
+    path = code.co_filename
+    for base in sys.path:
+        if base and path.startswith(base):
+            path = os.path.relpath(path, base)
+            break
+    return f"{code.co_name} ({path}:{code.co_firstlineno})"
+
+
+class Profiler(object):
+    """A sampling profiler which records the call stack of the thread it was
+    started in at a fixed interval, for one phase of a dataset run (e.g. `crawl`).
+
+    Because samples are taken in wall-clock time, time spent waiting for HTTP
+    responses or disk shows up in the profile, next to CPU-bound code like slow
+    lookups or regular expressions. When the profiler is stopped, it writes two
+    files to the data path of the dataset:
+
+    * `profile-<phase>.folded`: the sampled stacks in the collapsed format used
+      by flamegraph tools (e.g. `flamegraph.pl` or speedscope).
+    * `profile-<phase>.txt`: the functions with the most samples, both in the
+      function itself and including its callees.
+    """
+
+    def __init__(self, dataset: Dataset, phase: str, interval: float = INTERVAL):
+        self.dataset = dataset
+        self.phase = phase
+        self.interval = interval
+        self.samples: Counter[Stack] = Counter()
+        self._names: Dict[object, str] = {}
+        self._ident: Optional[int] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def folded_path(self) -> Path:
+        return dataset_data_path(self.dataset.name) / f"profile-{self.phase}.folded"
+
+    @property
+    def summary_path(self) -> Path:
+        return dataset_data_path(self.dataset.name) / f"profile-{self.phase}.txt"
+
+    def start(self) -> None:
+        self._ident = threading.get_ident()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+
+    def _sample(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._ident or 0)
+            stack: List[str] = []
+            while frame is not None:
+                name = self._names.get(frame.f_code)
+                if name is None:
+                    name = self._names[frame.f_code] = _frame_name(frame)
+                stack.append(name)
+                frame = frame.f_back
+            if len(stack):
+                # Collapsed stacks start with the outermost frame:
+                stack.reverse()
+                self.samples[tuple(stack)] += 1
+
+    def stop(self) -> None:
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        self.write()
+
+    def summary(self, top: int = TOP_N) -> List[Tuple[str, int, int]]:
+        """Get the functions with the most samples as tuples of the function
+        name, the samples in the function itself and in the function including
+        its callees."""
+        own: Counter[str] = Counter()
+        total: Counter[str] = Counter()
+        for stack, count in self.samples.items():
+            own[stack[-1]] += count
+            for name in set(stack):
+                total[name] += count
+        names = sorted(total, key=lambda n: (own[n], total[n]), reverse=True)
+        return [(n, own[n], total[n]) for n in names[:top]]
+
+    def write(self) -> None:
+        with open(self.folded_path, "w") as fh:
+            for stack, count in self.samples.most_common():
+                fh.write("%s %d\n" % (";".join(stack), count))
+        samples = sum(self.samples.values())
+        with open(self.summary_path, "w") as fh:
+            fh.write(
+                "Profile of %s (%s): %d samples every %.1fms\n\n"
+                % (self.dataset.name, self.phase, samples, self.interval * 1000)
+            )
+            fh.write("%8s %8s  %s\n" % ("own %", "total %", "function"))
+            for name, own, total in self.summary():
+                own_pct = (own * 100.0) / max(1, samples)
+                total_pct = (total * 100.0) / max(1, samples)
+                fh.write("%8.2f %8.2f  %s\n" % (own_pct, total_pct, name))
+        log.info(
+            "Wrote profile",
+            phase=self.phase,
+            samples=samples,
+            path=self.summary_path.as_posix(),
+        )
+
+    def __enter__(self) -> "Profiler":
+        self.start()
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_val: Optional[BaseException],
+        exc_tb: Optional[TracebackType],
+    ) -> None:
+        self.stop()
+
+
+class NoProfiler(Profiler):
+    """A stand-in for the profiler which does nothing, used when profiling is
+    not enabled."""
+
+    def start(self) -> None:
+        pass
+
+    def write(self) -> None:
+        pass
+
+
+def get_profiler(dataset: Dataset, phase: str, enabled: bool = True) -> Profiler:
+    """Get a profiler context for a phase of a dataset run."""
+    if not enabled:
+        return NoProfiler(dataset, phase)
+    return Profiler(dataset, phase)
@@ -1,39 +1,282 @@
-from typing import Optional, TextIO
-from normality.encoding import DEFAULT_ENCODING
+import os
+import shutil
+from itertools import islice
+from pathlib import Path
+from queue import Queue
+from threading import Thread
+from typing import BinaryIO, List, Optional, Union
 from nomenklatura.statement import Statement
-from nomenklatura.statement.serialize import PackStatementWriter
 
 
+from zavod import settings
 from zavod.meta import Dataset
-from zavod.archive import dataset_resource_path, STATEMENTS_FILE
+from zavod.archive import dataset_resource_path, STATEMENTS_FILE, TIMESTAMPS_FILE
+from zavod.archive.pack import BinaryPackWriter, CSVPackWriter, get_pack_writer
+from zavod.archive.pack import detect_pack_format, read_pack_statements
+from zavod.archive.pack import BINARY_PACK, PACK_MAGIC
+from zavod.runtime.timestamps import TimeStampIndex, TimeStampIndexWriter
+
+# Number of statements handed to the background writer at once:
+BATCH_SIZE = 5000
+# Number of batches which can be queued before `emit` blocks:
+QUEUE_SIZE = 20
+# Size of the file write buffer used by the background writer:
+WRITE_BUFFER = 4 * 1024 * 1024
+
+Batch = Optional[List[Statement]]
+PackWriter = Union[CSVPackWriter, BinaryPackWriter]
 
 
 class DatasetSink(object):
-    """Manage a file handle for writing statements to a dataset archive path."""
+    """Manage a file handle for writing statements to a dataset archive path.
+
+    Statements are written in the pack format selected by `ZAVOD_PACK_FORMAT`.
+    Alongside the statements, the sink writes an index of the `first_seen` time
+    of each non-external statement, which is published with the statements and
+    used by the next run of the crawler.
+
+    In background mode, statements are passed to a writer thread in batches, so
+    that serialising and writing them overlaps with the crawler. Statements must
+    not be modified after they have been emitted. Errors raised by the writer are
+    re-raised in the crawler thread by the next `emit` or `close` call.
+
+    A sink can be resumed to append to the statements written by an interrupted
+    run, up to the offset recorded when the crawler last made a checkpoint.
+    """
 
-    def __init__(self, dataset: Dataset) -> None:
+    def __init__(
+        self,
+        dataset: Dataset,
+        background: Optional[bool] = None,
+        path: Optional[Path] = None,
+    ) -> None:
         self.dataset = dataset
         self.path = dataset_resource_path(dataset.name, STATEMENTS_FILE)
-        self.fh: Optional[TextIO] = None
-        self.writer: Optional[PackStatementWriter] = None
+        self.index_path: Optional[Path] = None
+        if path is None:
+            self.index_path = dataset_resource_path(dataset.name, TIMESTAMPS_FILE)
+        else:
+            # Partial outputs, e.g. of a partition of the crawl, are not indexed:
+            self.path = path
+        self.format = settings.PACK_FORMAT
+        self.fh: Optional[BinaryIO] = None
+        self.writer: Optional[PackWriter] = None
+        self.index: Optional[TimeStampIndexWriter] = None
+        if background is None:
+            background = settings.SINK_BACKGROUND
+        self.background = background
+        self._batch: List[Statement] = []
+        self._queue: Optional["Queue[Batch]"] = None
+        self._thread: Optional[Thread] = None
+        self._error: Optional[BaseException] = None
+        self._append = False
+        self._resumed_index: Optional[TimeStampIndexWriter] = None
+
+    def _open(self, buffering: int = -1) -> PackWriter:
+        if self._append:
+            fh = open(self.path, "ab", buffering=buffering)
+        else:
+            fh = open(self.path, "wb", buffering=buffering)
+        self.fh = fh
+        self.writer = get_pack_writer(fh, self.format, header=fh.tell() == 0)
+        self.index = self._resumed_index
+        self._resumed_index = None
+        if self.index is None and self.index_path is not None:
+            self.index = TimeStampIndexWriter(self.index_path)
+        return self.writer
+
+    def _write(self, writer: PackWriter, stmt: Statement) -> None:
+        writer.write(stmt)
+        if self.index is not None and not stmt.external:
+            self.index.add(stmt)
 
     def emit(self, stmt: Statement) -> None:
         """Write a statement to the dataset output."""
+        if self.background:
+            self._batch.append(stmt)
+            if len(self._batch) >= BATCH_SIZE:
+                self._put(self._batch)
+                self._batch = []
+            return
         if self.fh is None or self.writer is None:
-            self.fh = open(self.path, "w", encoding=DEFAULT_ENCODING)
-            self.writer = PackStatementWriter(self.fh)
-        self.writer.write(stmt)
+            self._open()
+        assert self.writer is not None
+        self._write(self.writer, stmt)
+
+    def emit_many(self, stmts: List[Statement]) -> None:
+        """Write a batch of statements to the dataset output."""
+        if self.background:
+            self._batch.extend(stmts)
+            if len(self._batch) >= BATCH_SIZE:
+                self._put(self._batch)
+                self._batch = []
+            return
+        if self.fh is None or self.writer is None:
+            self._open()
+        assert self.writer is not None
+        for stmt in stmts:
+            self._write(self.writer, stmt)
+
+    def _raise_error(self) -> None:
+        if self._error is not None:
+            error = self._error
+            self._error = None
+            raise error
+
+    def _put(self, batch: Batch) -> None:
+        self._raise_error()
+        if self._queue is None or self._thread is None:
+            self._queue = Queue(maxsize=QUEUE_SIZE)
+            self._thread = Thread(
+                target=self._write_batches,
+                args=(self._queue,),
+                name=f"sink-{self.dataset.name}",
+                daemon=True,
+            )
+            self._thread.start()
+        self._queue.put(batch)
+
+    def _write_batches(self, queue: "Queue[Batch]") -> None:
+        while True:
+            batch = queue.get()
+            if batch is None:
+                queue.task_done()
+                return
+            try:
+                # Keep draining the queue after an error, so `emit` does not block:
+                if self._error is None:
+                    writer = self.writer
+                    if writer is None:
+                        writer = self._open(buffering=WRITE_BUFFER)
+                    for stmt in batch:
+                        self._write(writer, stmt)
+            except BaseException as exc:
+                self._error = exc
+            finally:
+                queue.task_done()
+
+    def flush(self) -> int:
+        """Write all emitted statements to the file.
+
+        Returns:
+            The size of the statements file.
+        """
+        if len(self._batch):
+            batch = self._batch
+            self._batch = []
+            self._put(batch)
+        if self._queue is not None:
+            self._queue.join()
+        self._raise_error()
+        if self.writer is not None:
+            self.writer.flush()
+        if self.fh is not None:
+            self.fh.flush()
+            return self.fh.tell()
+        if self._append:
+            return self.path.stat().st_size
+        return 0
+
+    def resume(
+        self,
+        offset: int,
+        seen: Optional[str] = None,
+        timestamps: Optional[TimeStampIndex] = None,
+    ) -> None:
+        """Continue writing to the existing statements file, discarding any
+        statements after `offset`, which was returned by `flush`. If `seen` is
+        given, the kept statements are written again with it as their `last_seen`
+        time, and their `first_seen` time looked up in `timestamps`, as if they
+        had been emitted by the resumed run."""
+        self.close()
+        if offset > 0 and seen is not None:
+            self._restamp(offset, seen, timestamps)
+            return
+        index = None
+        if self.index_path is not None:
+            index = TimeStampIndexWriter(self.index_path)
+        if offset > 0:
+            with open(self.path, "r+b") as fh:
+                fh.truncate(offset)
+                fh.seek(0)
+                self.format = detect_pack_format(fh)
+                if index is not None:
+                    for stmt in read_pack_statements(fh):
+                        if not stmt.external:
+                            index.add(stmt)
+        self._resumed_index = index
+        self._append = offset > 0
+
+    def _restamp(
+        self, offset: int, seen: str, timestamps: Optional[TimeStampIndex]
+    ) -> None:
+        tmp_path = self.path.with_name(f".{self.path.name}.resume")
+        os.replace(self.path, tmp_path)
+        os.truncate(tmp_path, offset)
+        with open(tmp_path, "rb") as fh:
+            self.format = detect_pack_format(fh)
+            stmts = read_pack_statements(fh)
+            while True:
+                batch = list(islice(stmts, BATCH_SIZE))
+                if not len(batch):
+                    break
+                first_seen = [seen] * len(batch)
+                if timestamps is not None:
+                    first_seen = timestamps.get_many([s.id for s in batch], seen)
+                for stmt, first in zip(batch, first_seen):
+                    stmt.first_seen = first
+                    stmt.last_seen = seen
+                self.emit_many(batch)
+        self.flush()
+        tmp_path.unlink()
+
+    def merge(self, path: Path) -> None:
+        """Append the statements from a partial pack file, which must have been
+        written in the same format, to the output."""
+        self.flush()
+        if self.writer is None:
+            self._open()
+        assert self.fh is not None
+        with open(path, "rb") as fh:
+            format = detect_pack_format(fh)
+            if format != self.format:
+                raise ValueError("Cannot merge %s pack into %s" % (format, self.path))
+            if self.index is not None:
+                for stmt in read_pack_statements(fh):
+                    if not stmt.external:
+                        self.index.add(stmt)
+            fh.seek(len(PACK_MAGIC) if format == BINARY_PACK else 0)
+            shutil.copyfileobj(fh, self.fh)
 
     def close(self) -> None:
+        if len(self._batch):
+            batch = self._batch
+            self._batch = []
+            self._put(batch)
+        if self._queue is not None and self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._queue = None
+            self._thread = None
         if self.writer is not None:
             self.writer.close()
             self.writer = None
+        # A resumed sink that has not been written to still has an index:
+        index = self.index or self._resumed_index
+        self.index = None
+        self._resumed_index = None
+        self._append = False
+        if index is not None and self._error is None:
+            index.close()
         if self.fh is not None:
             self.fh.close()
             self.fh = None
+        self._raise_error()
 
     def clear(self) -> None:
-        """Delete the dataset statements output file."""
+        """Delete the dataset statements output file and timestamp index."""
         self.close()
         if self.path.is_file():
             self.path.unlink()
+        if self.index_path is not None and self.index_path.is_file():
+            self.index_path.unlink()
@@ -0,0 +1,115 @@
+import json
+import inspect
+import hashlib
+import orjson
+from pathlib import Path
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, List, Optional
+
+import zavod
+from zavod.logs import get_logger
+from zavod.meta import Dataset
+from zavod.archive import dataset_resource_path, get_previous_artifact_object
+from zavod.archive import SOURCES_FILE
+
+log = get_logger(__name__)
+
+# Set while a tracked source file is being fetched, so that the HTTP requests it
+# makes are not counted as untracked inputs of the crawler:
+TRACKED: ContextVar[bool] = ContextVar("zavod_source_tracked", default=False)
+
+
+def file_hash(path: Path) -> str:
+    """Compute the SHA-256 digest of a file."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        while True:
+            chunk = fh.read(1024 * 1024)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def code_hash(dataset: Dataset, entry_point: Callable[..., Any]) -> str:
+    """Fingerprint the metadata of a dataset and the code of its crawler."""
+    digest = hashlib.sha256(zavod.__version__.encode("utf-8"))
+    data = orjson.dumps(dataset._data, option=orjson.OPT_SORT_KEYS, default=str)
+    digest.update(data)
+    try:
+        source_file = inspect.getsourcefile(entry_point)
+    except TypeError:
+        source_file = None
+    if source_file is not None:
+        with open(source_file, "rb") as fh:
+            digest.update(fh.read())
+    return digest.hexdigest()
+
+
+class DatasetSources(object):
+    """Record fingerprints of the source files fetched by a crawler, in order to
+    tell whether a dataset run would be identical to the previous one.
+
+    Source files fetched via `context.fetch_resource` are recorded with their URL
+    and a hash of their contents. Any other input, like HTTP requests made outside
+    of `fetch_resource` or the use of the response cache, is recorded as untracked,
+    which marks the run as not reproducible from its sources."""
+
+    def __init__(self, dataset: Dataset) -> None:
+        self.dataset = dataset
+        self.path = dataset_resource_path(dataset.name, SOURCES_FILE)
+        self.code: Optional[str] = None
+        self.sources: Dict[str, Dict[str, Any]] = {}
+        self.untracked: List[str] = []
+
+    def record(self, name: str, url: str, path: Path) -> None:
+        """Record a source file fetched by the crawler."""
+        self.sources[name] = {
+            "name": name,
+            "url": url,
+            "sha256": file_hash(path),
+            "size": path.stat().st_size,
+        }
+
+    def record_untracked(self, source: str) -> None:
+        """Record an input to the crawler which is not fingerprinted."""
+        if not TRACKED.get() and source not in self.untracked:
+            self.untracked.append(source)
+
+    @property
+    def complete(self) -> bool:
+        return self.code is not None and len(self.untracked) == 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "code": self.code,
+            "complete": self.complete,
+            "sources": [self.sources[n] for n in sorted(self.sources)],
+        }
+
+    def save(self) -> None:
+        with open(self.path, "wb") as fh:
+            fh.write(orjson.dumps(self.to_dict(), option=orjson.OPT_INDENT_2))
+
+    def load_previous(self) -> Optional[Dict[str, Any]]:
+        """Load the source fingerprints published with the previous version of
+        the dataset statements."""
+        object = get_previous_artifact_object(self.dataset.name, SOURCES_FILE)
+        if object is None:
+            return None
+        with object.open() as fh:
+            data: Dict[str, Any] = json.load(fh)
+        return data
+
+    def unchanged(self) -> bool:
+        """Check if the sources fetched so far are identical to those of the
+        previous version of the dataset, and no untracked inputs were used."""
+        if not self.complete or not len(self.sources):
+            return False
+        previous = self.load_previous()
+        if previous is None or not previous.get("complete", False):
+            return False
+        return bool(self.to_dict() == previous)
+
+    def clear(self) -> None:
+        self.path.unlink(missing_ok=True)
@@ -1,11 +1,17 @@
+from threading import Lock
+from typing import Any, Dict
+
 # from zavod.entity import Entity
 
 
 class ContextStats(object):
     """A simple object for tracking the number of statements, entities and targets
-    emitted by a dataset context while running the dataset method."""
+    emitted by a dataset context while running the dataset method, as well as the
+    HTTP requests and cache lookups it made, and the property values it cleaned
+    (see `zavod.runtime.cleaning.ValueCache`)."""
 
     def __init__(self) -> None:
+        self._lock = Lock()
         self.reset()
 
     def reset(self) -> None:
@@ -13,3 +19,37 @@ class ContextStats(object):
         self.changed = 0
         self.entities = 0
         self.targets = 0
+        self.http_requests = 0
+        self.http_bytes = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.clean_hits = 0
+        self.clean_misses = 0
+
+    def add_http(self, requests: int = 0, size: int = 0) -> None:
+        """Count HTTP requests and the bytes received. This is thread-safe, since
+        requests are also made by the worker threads of `Context.fetch_many`."""
+        with self._lock:
+            self.http_requests += requests
+            self.http_bytes += size
+
+    @property
+    def cache_hit_ratio(self) -> float:
+        lookups = self.cache_hits + self.cache_misses
+        if lookups == 0:
+            return 0.0
+        return self.cache_hits / lookups
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "statements": self.statements,
+            "changed": self.changed,
+            "entities": self.entities,
+            "targets": self.targets,
+            "http_requests": self.http_requests,
+            "http_bytes": self.http_bytes,
+            "cache_hits": self.cache_hits,
+            "cache_misses": self.cache_misses,
+            "clean_hits": self.clean_hits,
+            "clean_misses": self.clean_misses,
+        }
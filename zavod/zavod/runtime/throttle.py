@@ -0,0 +1,106 @@
+import time
+from threading import BoundedSemaphore, Lock
+from typing import Optional
+
+from zavod.logs import get_logger
+
+log = get_logger(__name__)
+
+
+class HostThrottle(object):
+    """Limit the rate and concurrency of requests sent to a single host.
+
+    The rate limit is implemented as a token bucket which holds up to `burst`
+    tokens and is re-filled at `rate` tokens per second. When the server asks
+    the client to slow down (via a `Retry-After` header), the bucket is drained
+    and paused for the requested time, and the rate is halved. It then recovers
+    gradually with each successful response.
+    """
+
+    # How far the rate may be lowered in response to throttling by the server:
+    MIN_RATE_FACTOR = 1 / 16
+    # How much of the configured rate is restored after each successful response:
+    RECOVER_FACTOR = 0.05
+
+    def __init__(
+        self,
+        host: str,
+        rate: Optional[float] = None,
+        burst: int = 1,
+        concurrency: Optional[int] = None,
+    ) -> None:
+        self.host = host
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = Lock()
+        self.slots: Optional[BoundedSemaphore] = None
+        if concurrency is not None and concurrency > 0:
+            self.slots = BoundedSemaphore(concurrency)
+
+    def _wait_time(self) -> float:
+        """Take a token from the bucket, or return the time to wait for one."""
+        now = time.monotonic()
+        if now < self.paused_until:
+            return self.paused_until - now
+        if self.rate is None:
+            return 0.0
+        elapsed = max(0.0, now - self.updated)
+        self.tokens = min(float(self.burst), self.tokens + elapsed * self.rate)
+        self.updated = now
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return 0.0
+        return (1.0 - self.tokens) / self.rate
+
+    def acquire(self) -> None:
+        """Block until a request to the host may be sent."""
+        if self.slots is not None:
+            self.slots.acquire()
+        try:
+            while True:
+                with self.lock:
+                    wait = self._wait_time()
+                if wait <= 0.0:
+                    return
+                time.sleep(wait)
+        except BaseException:
+            self.release()
+            raise
+
+    def release(self) -> None:
+        """Mark a request to the host as completed."""
+        if self.slots is not None:
+            self.slots.release()
+
+    def backoff(self, delay: float) -> None:
+        """Pause all requests to the host for `delay` seconds and lower the rate,
+        e.g. after the server responded with a `Retry-After` header."""
+        with self.lock:
+            now = time.monotonic()
+            self.paused_until = max(self.paused_until, now + delay)
+            self.tokens = 0.0
+            self.updated = self.paused_until
+            if self.rate is not None and self.max_rate is not None:
+                min_rate = self.max_rate * self.MIN_RATE_FACTOR
+                self.rate = max(min_rate, self.rate / 2)
+        log.info(
+            "Server requested back-off",
+            host=self.host,
+            delay=delay,
+            rate=self.rate,
+        )
+
+    def recover(self) -> None:
+        """Restore part of the configured rate after a successful response."""
+        if self.rate is None or self.max_rate is None or self.rate >= self.max_rate:
+            return
+        with self.lock:
+            step = self.max_rate * self.RECOVER_FACTOR
+            self.rate = min(self.max_rate, self.rate + step)
+
+    def __repr__(self) -> str:
+        return f"<HostThrottle({self.host!r}, {self.rate!r})>"
@@ -1,51 +1,354 @@
-import plyvel  # type: ignore
-from typing import Iterable, Optional
+import os
+import mmap
+import heapq
+import struct
+from array import array
+from hashlib import blake2b
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import BinaryIO, Dict, Generator, Iterable, List, Optional, Sequence
 from nomenklatura.statement import Statement
 
 from zavod.logs import get_logger
 from zavod.meta import Dataset
 from zavod.archive import dataset_state_path, iter_previous_statements
+from zavod.archive import get_previous_artifact_object, TIMESTAMPS_FILE
 
 log = get_logger(__name__)
 
+MAGIC = b"ZVTSIDX\x01"
+# magic, record count, offsets of the dates, records, fanout and bloom filter
+# sections, number of bits and hash functions of the bloom filter:
+HEADER = struct.Struct(">8sQQQQQQB")
+# 64-bit statement ID hash, index of the first_seen date in the dates table:
+RECORD = struct.Struct(">QI")
+KEY = struct.Struct(">Q")
+FANOUT_BITS = 16
+FANOUT_SHIFT = 64 - FANOUT_BITS
+FANOUT = struct.Struct(f">{(1 << FANOUT_BITS) + 1}I")
+BLOOM_BITS_PER_KEY = 10
+BLOOM_HASHES = 7
+# Number of records sorted in memory at once while building the index:
+RUN_SIZE = 1_000_000
+
+
+def hash_id(id: str) -> int:
+    """Hash a statement ID to the 64-bit key used in the index."""
+    digest = blake2b(id.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+
+def _bloom_positions(key: int, bits: int, hashes: int) -> Generator[int, None, None]:
+    h1 = key & 0xFFFFFFFF
+    h2 = (key >> 32) | 1
+    for i in range(hashes):
+        yield (h1 + i * h2) % bits
+
+
+def _write_run(path: Path, values: List[int]) -> None:
+    values.sort()
+    with open(path, "wb") as fh:
+        buf = bytearray()
+        for value in values:
+            buf += RECORD.pack(value >> 32, value & 0xFFFFFFFF)
+            if len(buf) > 1_000_000:
+                fh.write(buf)
+                buf.clear()
+        fh.write(buf)
+
+
+def _read_run(path: Path) -> Generator[int, None, None]:
+    with open(path, "rb") as fh:
+        while True:
+            chunk = fh.read(RECORD.size * 100_000)
+            if not chunk:
+                break
+            for key, date in RECORD.iter_unpack(chunk):
+                yield (key << 32) | date
+
+
+class TimeStampIndexWriter(object):
+    """Build a timestamp index file from a stream of statements.
+
+    Statements are collected into sorted runs, which are spilled to disk and
+    merged into the index when the writer is closed, so the index can be built
+    in a single pass over the statements with bounded memory. The file contains
+    a table of the distinct `first_seen` dates, the records sorted by key, a
+    fanout table which gives the range of records for each 16-bit key prefix,
+    and a bloom filter used to quickly reject statements which are not in the
+    index.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._dates: Dict[str, int] = {}
+        self._values: List[int] = []
+        self._runs: List[Path] = []
+        self._total = 0
+        self._tmp_dir: Optional[TemporaryDirectory[str]] = None
+
+    def add(self, stmt: Statement) -> None:
+        if stmt.first_seen is None or stmt.id is None:
+            return
+        first_seen = stmt.first_seen.strip()
+        if len(first_seen) == 0:
+            return
+        date = self._dates.setdefault(first_seen, len(self._dates))
+        self._values.append((hash_id(stmt.id) << 32) | date)
+        if len(self._values) >= RUN_SIZE:
+            if self._tmp_dir is None:
+                self._tmp_dir = TemporaryDirectory(dir=self.path.parent)
+            run_path = Path(self._tmp_dir.name) / f"run{len(self._runs)}"
+            _write_run(run_path, self._values)
+            self._runs.append(run_path)
+            self._total += len(self._values)
+            self._values = []
+
+    def close(self) -> int:
+        """Merge the collected statements and write the index file.
+
+        Returns:
+            The number of records in the index.
+        """
+        try:
+            return self._write()
+        finally:
+            if self._tmp_dir is not None:
+                self._tmp_dir.cleanup()
+                self._tmp_dir = None
+            self._runs = []
+            self._values = []
+
+    def _write(self) -> int:
+        values = self._values
+        values.sort()
+        total = self._total + len(values)
+        date_table = list(self._dates.keys())
+        dates_data = "\n".join(date_table).encode("utf-8")
+        bloom_bits = max(64, total * BLOOM_BITS_PER_KEY)
+        bloom = bytearray((bloom_bits + 7) // 8)
+        fanout = array("I", [0] * ((1 << FANOUT_BITS) + 1))
+
+        tmp_path = self.path.with_name(f".{self.path.name}.tmp")
+        with open(tmp_path, "wb") as fh:
+            fh.write(b"\x00" * HEADER.size)
+            dates_offset = fh.tell()
+            fh.write(dates_data)
+            records_offset = fh.tell()
+            sources = [_read_run(run) for run in self._runs]
+            merged = heapq.merge(iter(values), *sources)
+            count = _write_records(fh, merged, date_table, fanout, bloom, bloom_bits)
+            fanout_offset = fh.tell()
+            # Make the counts cumulative, so that the records with a given prefix
+            # are found between fanout[prefix] and fanout[prefix + 1]:
+            running = 0
+            for prefix in range(len(fanout)):
+                running, fanout[prefix] = running + fanout[prefix], running
+            fh.write(FANOUT.pack(*fanout))
+            bloom_offset = fh.tell()
+            fh.write(bloom)
+            fh.seek(0)
+            header = HEADER.pack(
+                MAGIC,
+                count,
+                dates_offset,
+                records_offset,
+                fanout_offset,
+                bloom_offset,
+                bloom_bits,
+                BLOOM_HASHES,
+            )
+            fh.write(header)
+        os.replace(tmp_path, self.path)
+        return count
+
+
+def write_index(path: Path, statements: Iterable[Statement]) -> int:
+    """Build a timestamp index file from a stream of statements.
+
+    Returns:
+        The number of records in the index.
+    """
+    writer = TimeStampIndexWriter(path)
+    for stmt in statements:
+        writer.add(stmt)
+    return writer.close()
+
+
+def _write_records(
+    fh: BinaryIO,
+    merged: Iterable[int],
+    date_table: List[str],
+    fanout: "array[int]",
+    bloom: bytearray,
+    bloom_bits: int,
+) -> int:
+    count = 0
+    buf = bytearray()
+    prev_key: Optional[int] = None
+    prev_date = 0
+    for value in merged:
+        key, date = value >> 32, value & 0xFFFFFFFF
+        if key == prev_key:
+            # The same statement appears more than once, keep the earliest date:
+            if date_table[date] < date_table[prev_date]:
+                prev_date = date
+            continue
+        if prev_key is not None:
+            buf += RECORD.pack(prev_key, prev_date)
+            count += 1
+        prev_key, prev_date = key, date
+        fanout[key >> FANOUT_SHIFT] += 1
+        for pos in _bloom_positions(key, bloom_bits, BLOOM_HASHES):
+            bloom[pos >> 3] |= 1 << (pos & 7)
+        if len(buf) > 1_000_000:
+            fh.write(buf)
+            buf.clear()
+    if prev_key is not None:
+        buf += RECORD.pack(prev_key, prev_date)
+        count += 1
+    fh.write(buf)
+    return count
+
 
 class TimeStampIndex(object):
+    """An index of the `first_seen` timestamps of the statements in the previous
+    version of a dataset, used to carry them over to the current run.
+
+    The index is a read-only, memory-mapped file (see `write_index`) which maps
+    64-bit hashes of statement IDs to dates.
+    """
+
     def __init__(self, dataset: Dataset) -> None:
-        path = dataset_state_path(dataset.name) / "timestamps"
-        self.db = plyvel.DB(path.as_posix(), create_if_missing=True)
+        self.path = dataset_state_path(dataset.name) / TIMESTAMPS_FILE
+        self._fh: Optional[BinaryIO] = None
+        self._mmap: Optional[mmap.mmap] = None
+        self.count = 0
+        self._dates: List[str] = []
+        if self.path.exists():
+            self._open()
+
+    def _open(self) -> None:
+        self.close()
+        self._fh = open(self.path, "rb")
+        self._mmap = mmap.mmap(self._fh.fileno(), 0, access=mmap.ACCESS_READ)
+        header = HEADER.unpack_from(self._mmap, 0)
+        if header[0] != MAGIC:
+            raise ValueError("Invalid timestamp index: %s" % self.path)
+        _, self.count, dates_offset, self._records, fanout_offset, bloom_offset = (
+            header[:6]
+        )
+        self._bloom_bits, self._bloom_hashes = header[6], header[7]
+        self._bloom_offset = bloom_offset
+        dates: str = self._mmap[dates_offset : self._records].decode("utf-8")
+        self._dates = dates.split("\n") if len(dates) else []
+        self._fanout = FANOUT.unpack_from(self._mmap, fanout_offset)
 
     def index(self, statements: Iterable[Statement]) -> None:
         log.info("Building timestamp index...")
-        batch = self.db.write_batch()
-        idx = 0
-        for idx, stmt in enumerate(statements):
-            if stmt.first_seen is None or stmt.id is None:
-                continue
-            if len(stmt.first_seen.strip()) == 0:
-                continue
-            batch.put(stmt.id.encode("utf-8"), stmt.first_seen.encode("utf-8"))
-            if idx > 0 and idx % 1_000_000 == 0:
-                batch.write()
-                batch = self.db.write_batch()
-        batch.write()
-        log.info("Index ready.", count=idx)
+        self.close()
+        count = write_index(self.path, statements)
+        self._open()
+        log.info("Index ready.", count=count)
+
+    def backfill(self, dataset: Dataset) -> bool:
+        """Load the timestamp index published alongside the previous statements
+        of the dataset.
+
+        Returns:
+            True if the published index was loaded.
+        """
+        object = get_previous_artifact_object(dataset.name, TIMESTAMPS_FILE)
+        if object is None:
+            return False
+        log.info("Backfilling timestamp index...", object=object.name)
+        self.close()
+        tmp_path = self.path.with_name(f".{self.path.name}.tmp")
+        object.backfill(tmp_path)
+        os.replace(tmp_path, self.path)
+        try:
+            self._open()
+        except (ValueError, struct.error) as exc:
+            log.warning("Cannot load timestamp index: %s" % exc)
+            self.close()
+            return False
+        log.info("Index ready.", count=self.count)
+        return True
 
     @classmethod
     def build(cls, dataset: Dataset) -> "TimeStampIndex":
+        """Load the timestamp index of the previous version of the dataset, or
+        build it from its statements if no index was published."""
         index = cls(dataset)
-        index.index(iter_previous_statements(dataset, external=False))
+        if not index.backfill(dataset):
+            index.index(iter_previous_statements(dataset, external=False))
         return index
 
     def get(self, id: Optional[str], default: str) -> str:
-        if id is None:
+        if id is None or self._mmap is None or self.count == 0:
             return default
-        first_seen: Optional[bytes] = self.db.get(id.encode("utf-8"), fill_cache=False)
-        if first_seen is not None:
-            return first_seen.decode("utf-8")
+        return self._find(self._mmap, hash_id(id), default)
+
+    def get_many(self, ids: Sequence[Optional[str]], default: str) -> List[str]:
+        """Get the `first_seen` dates of a batch of statement IDs, in the order of
+        the IDs given. The keys are looked up in sorted order, so that each search
+        in the records starts where the previous one ended. This narrows the search
+        more than the bloom filter would, so the filter isn't checked here."""
+        mm = self._mmap
+        results = [default] * len(ids)
+        if mm is None or self.count == 0:
+            return results
+        keys = [(hash_id(id), i) for i, id in enumerate(ids) if id is not None]
+        keys.sort()
+        fanout, records, dates = self._fanout, self._records, self._dates
+        unpack_key, size = KEY.unpack_from, RECORD.size
+        last_prefix, start = -1, 0
+        for key, i in keys:
+            prefix = key >> FANOUT_SHIFT
+            if prefix != last_prefix:
+                last_prefix, start = prefix, fanout[prefix]
+            lo, hi = start, fanout[prefix + 1]
+            while lo < hi:
+                mid = (lo + hi) // 2
+                (found,) = unpack_key(mm, records + mid * size)
+                if found < key:
+                    lo = mid + 1
+                elif found > key:
+                    hi = mid
+                else:
+                    date: int = RECORD.unpack_from(mm, records + mid * size)[1]
+                    results[i] = dates[date]
+                    break
+            start = lo
+        return results
+
+    def _find(self, mm: mmap.mmap, key: int, default: str) -> str:
+        bloom_offset = self._bloom_offset
+        for pos in _bloom_positions(key, self._bloom_bits, self._bloom_hashes):
+            if not mm[bloom_offset + (pos >> 3)] & (1 << (pos & 7)):
+                return default
+        prefix = key >> FANOUT_SHIFT
+        lo, hi = self._fanout[prefix], self._fanout[prefix + 1]
+        records = self._records
+        while lo < hi:
+            mid = (lo + hi) // 2
+            (found,) = KEY.unpack_from(mm, records + mid * RECORD.size)
+            if found < key:
+                lo = mid + 1
+            elif found > key:
+                hi = mid
+            else:
+                date: int = RECORD.unpack_from(mm, records + mid * RECORD.size)[1]
+                return self._dates[date]
         return default
 
     def close(self) -> None:
-        self.db.close()
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
 
     def __repr__(self) -> str:
-        return f"<TimeStampIndex({self.db.name!r})>"
+        return f"<TimeStampIndex({self.path.as_posix()!r})>"
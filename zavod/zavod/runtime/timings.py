@@ -0,0 +1,102 @@
+import os
+import sys
+import time
+import orjson
+import resource
+from datetime import datetime, timezone
+from contextlib import contextmanager
+from typing import Any, Dict, Generator
+
+from zavod import settings
+from zavod.logs import get_logger
+from zavod.meta import Dataset
+from zavod.archive import dataset_resource_path, TIMINGS_FILE
+from zavod.runtime.versions import get_latest
+
+log = get_logger(__name__)
+
+
+def peak_rss() -> int:
+    """The peak resident memory of the current process, in bytes."""
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes:
+    return usage if sys.platform == "darwin" else usage * 1024
+
+
+class DatasetTimings(object):
+    """Record the wall-clock and CPU time of the phases of a dataset run (e.g. the
+    crawl, store sync, validation, export and publication) in `timings.json`.
+
+    Phases may run in separate processes (e.g. `zavod crawl`, then `zavod export`),
+    so each phase is merged into the file as it completes. Timings recorded for a
+    previous version of the dataset are discarded.
+    """
+
+    def __init__(self, dataset: Dataset, enabled: bool = True) -> None:
+        self.dataset = dataset
+        self.enabled = enabled
+        self.path = dataset_resource_path(dataset.name, TIMINGS_FILE)
+
+    @property
+    def version(self) -> str:
+        version = get_latest(self.dataset.name, backfill=False)
+        return (version or settings.RUN_VERSION).id
+
+    def load(self) -> Dict[str, Any]:
+        """Load the timings recorded for the current version of the dataset."""
+        version = self.version
+        if self.path.is_file():
+            with open(self.path, "rb") as fh:
+                data: Dict[str, Any] = orjson.loads(fh.read())
+            if data.get("version") == version:
+                return data
+        return {"dataset": self.dataset.name, "version": version, "phases": {}}
+
+    def save(self, phase: str, record: Dict[str, Any]) -> None:
+        """Store the timing of a phase, replacing any previous record."""
+        if not self.enabled:
+            return
+        data = self.load()
+        data["phases"][phase] = record
+        data["peak_rss"] = max(data.get("peak_rss", 0), record["peak_rss"])
+        tmp_path = self.path.with_name(f".{self.path.name}.tmp")
+        with open(tmp_path, "wb") as fh:
+            fh.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
+        os.replace(tmp_path, self.path)
+
+    @contextmanager
+    def phase(self, name: str) -> Generator[Dict[str, Any], None, None]:
+        """Time a phase of the dataset run. The yielded record can be extended with
+        further metrics, e.g. the number of statements processed in the phase.
+
+        ```python
+        with timings.phase("crawl") as record:
+            crawl(context)
+            record["statements"] = context.stats.statements
+        ```
+        """
+        record: Dict[str, Any] = {}
+        started = datetime.now(timezone.utc).replace(microsecond=0)
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield record
+        finally:
+            wall = time.perf_counter() - wall
+            record["started_at"] = started.isoformat()
+            record["wall_time"] = round(wall, 3)
+            record["cpu_time"] = round(time.process_time() - cpu, 3)
+            record["peak_rss"] = peak_rss()
+            if "statements" in record:
+                rate = record["statements"] / max(wall, 0.001)
+                record["statements_per_second"] = round(rate, 1)
+            self.save(name, record)
+            log.info(
+                "Phase completed",
+                phase=name,
+                wall_time=record["wall_time"],
+                cpu_time=record["cpu_time"],
+            )
+
+    def clear(self) -> None:
+        self.path.unlink(missing_ok=True)
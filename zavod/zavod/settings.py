@@ -86,6 +86,30 @@ HTTP_USER_AGENT = env_str("ZAVOD_HTTP_USER_AGENT", HTTP_USER_AGENT)
 CACHE_DATABASE_URI = env.get("ZAVOD_DATABASE_URI")
 CACHE_DATABASE_URI = env.get("OPENSANCTIONS_DATABASE_URI", CACHE_DATABASE_URI)
 
+# Type of cache used to store HTTP responses, either `Cache` (plain text) or
+# `CompressedCache` (zstd-compressed and de-duplicated by content hash)
+CACHE_BACKEND = env_str("ZAVOD_CACHE_BACKEND", "Cache")
+
+# Prune the cache of a dataset after each crawl. Entries which have not been
+# used in `CACHE_MAX_AGE_DAYS` are evicted, and then the least recently used
+# entries until the cache is smaller than `CACHE_MAX_SIZE_MB` (0: no limit).
+CACHE_PRUNE = as_bool(env_str("ZAVOD_CACHE_PRUNE", "false"))
+CACHE_MAX_AGE_DAYS = int(env_str("ZAVOD_CACHE_MAX_AGE_DAYS", "90"))
+CACHE_MAX_SIZE_MB = int(env_str("ZAVOD_CACHE_MAX_SIZE_MB", "0"))
+
+# File format of the statements written to the dataset archive, either `csv`
+# or `msgpack`. Readers detect the format of each file automatically.
+PACK_FORMAT = env_str("ZAVOD_PACK_FORMAT", "csv")
+
+# Write statements to the dataset archive from a background thread
+SINK_BACKGROUND = as_bool(env_str("ZAVOD_SINK_BACKGROUND", "false"))
+
+# Number of processes used to load the statements of a collection into the store
+STORE_WORKERS = int(env_str("ZAVOD_STORE_WORKERS", "1"))
+
+# Publish a snapshot of the store with the artifacts of collections
+STORE_SNAPSHOT = as_bool(env_str("ZAVOD_STORE_SNAPSHOT", "false"))
+
 # Load DB batch size
 DB_BATCH_SIZE = int(env_str("ZAVOD_DB_BATCH_SIZE", "1000"))
 
@@ -1,3 +1,4 @@
+import os
 from pathlib import Path
 from lxml import html, etree
 from time import sleep
@@ -12,7 +13,7 @@ import json
 from zavod import settings
 from zavod.archive import dataset_data_path
 from zavod.context import Context
-from zavod.runtime.http_ import request_hash
+from zavod.runtime.http_ import request_hash, verify_checksum
 
 
 ZYTE_API_URL = "https://api.zyte.com/v1/extract"
@@ -56,6 +57,7 @@ def fetch_resource(
     expected_media_type: Optional[str] = None,
     expected_charset: Optional[str] = None,
     geolocation: Optional[str] = None,
+    checksum: Optional[str] = None,
 ) -> Tuple[bool, str | None, str | None, Path]:
     """
     Fetch a resource using Zyte API and save to filesystem.
@@ -75,6 +77,8 @@ def fetch_resource(
         expected_charset: If set, assert that the charset in the response
             content-type header matches this value. Not enforced
             when the file already exists locally.
+        checksum: If set, verify the contents of the file against this
+            digest, given as `algorithm:hexdigest`.
 
     Returns:
         A tuple of:
@@ -111,8 +115,18 @@ def fetch_resource(
     api_response.raise_for_status()
 
     file_base64 = api_response.json()["httpResponseBody"]
-    with open(out_path, "wb") as fh:
+    # Write to a temporary file so that a failed download is not mistaken
+    # for a cached copy in the next run:
+    part_path = out_path.with_name(f".{out_path.name}.part0")
+    with open(part_path, "wb") as fh:
         fh.write(b64decode(file_base64))
+    if checksum is not None:
+        try:
+            verify_checksum(part_path, checksum)
+        except IOError:
+            part_path.unlink()
+            raise
+    os.replace(part_path, out_path)
     media_type, charset = get_content_type(api_response.json()["httpResponseHeaders"])
 
     if expected_media_type:
@@ -1,28 +1,156 @@
+import heapq
+import orjson
 import shutil
+import tarfile
+import multiprocessing
+import struct
 import plyvel  # type: ignore
-from typing import List, Optional
+from pathlib import Path
+from hashlib import blake2b
+from tempfile import TemporaryDirectory
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Generator, List, Optional, Tuple
 from followthemoney.exc import InvalidData
+from followthemoney.types import registry
 from nomenklatura.statement import Statement
 from nomenklatura.resolver import Linker
-from nomenklatura.store.level import LevelDBStore, LevelDBView
+from nomenklatura.store.level import LevelDBStore, LevelDBView, LevelDBWriter
+from nomenklatura.store.level import b, pack_statement
 from nomenklatura.publish.dates import simplify_dates
 from nomenklatura.publish.edges import simplify_undirected
 
+from zavod import settings
 from zavod.logs import get_logger
 from zavod.entity import Entity
-from zavod.meta import Dataset
-from zavod.archive import dataset_state_path
-from zavod.archive import iter_dataset_statements
+from zavod.meta import Dataset, get_catalog
+from zavod.archive import dataset_state_path, dataset_resource_path
+from zavod.archive import iter_dataset_statements, STATEMENTS_FILE
+from zavod.archive import get_artifact_object
+from zavod.archive.backend import get_archive_backend
+from zavod.archive import STORE_SNAPSHOT_FILE, STORE_SNAPSHOT_META
+from zavod.runtime.versions import get_latest
 
 log = get_logger(__name__)
 View = LevelDBView[Dataset, Entity]
 
+# The state of each leaf dataset loaded into the store, see `Store.leaf_state`:
+LEAF_PREFIX = "leaf:"
+# A fingerprint of the linker used to canonicalise the statements in the store:
+LINKER_KEY = b"linker"
+# An index of the statement keys of each dataset, used to remove its statements:
+KEYS_PREFIX = "l:"
+# Number of keys sorted in memory at once by a worker of the parallel sync:
+RUN_SIZE = 500_000
+# Number of keys written to LevelDB in one batch by the parallel sync:
+BATCH_SIZE = 50_000
+# Key and value lengths of an entry in a sorted run file:
+ENTRY = struct.Struct(">II")
+
+Entry = Tuple[bytes, bytes]
+
 
 def get_store(dataset: Dataset, linker: Linker[Entity]) -> "Store":
     store = Store(dataset, linker)
     return store
 
 
+def statement_entries(linker: Linker[Entity], stmt: Statement) -> List[Entry]:
+    """Get the keys and values written to the store for a statement. These are the
+    same as those of `nomenklatura.store.level.LevelDBWriter`, plus an index of the
+    keys of each dataset, so that its statements can be removed from the store
+    without scanning it."""
+    canonical_id = linker.get_canonical(stmt.entity_id)
+    stmt.canonical_id = canonical_id
+    kind = "x" if stmt.external else "s"
+    stmt_key = f"{kind}:{canonical_id}:{stmt.id}"
+    entity_key = f"e:{canonical_id}:{stmt.dataset}"
+    keys_prefix = f"{KEYS_PREFIX}{stmt.dataset}:"
+    entries = [
+        (b(entity_key), b(stmt.schema)),
+        (b(stmt_key), pack_statement(stmt)),
+        (b(keys_prefix + stmt_key), b""),
+        (b(keys_prefix + entity_key), b""),
+    ]
+    if stmt.prop_type == registry.entity.name:
+        value_id = linker.get_canonical(stmt.value)
+        entries.append((b(f"i:{value_id}:{canonical_id}"), b(canonical_id)))
+    return entries
+
+
+class StoreWriter(LevelDBWriter[Dataset, Entity]):
+    """A store writer which also records the keys written for each statement under
+    the name of its dataset (see `statement_entries`)."""
+
+    def add_statement(self, stmt: Statement) -> None:
+        if stmt.entity_id is None:
+            return
+        if self.batch_size >= self.BATCH_STATEMENTS:
+            self.flush()
+        if self.batch is None:
+            self.batch = self.store.db.write_batch()
+        if stmt.last_seen is not None:
+            self.last_seens[stmt.dataset] = stmt.last_seen
+        for key, value in statement_entries(self.store.linker, stmt):
+            self.batch.put(key, value)
+        self.batch_size += 1
+
+
+def _write_run(path: Path, entries: Dict[bytes, bytes]) -> None:
+    with open(path, "wb") as fh:
+        buf = bytearray()
+        for key in sorted(entries):
+            value = entries[key]
+            buf += ENTRY.pack(len(key), len(value))
+            buf += key
+            buf += value
+            if len(buf) > 1_000_000:
+                fh.write(buf)
+                buf.clear()
+        fh.write(buf)
+
+
+def _read_run(path: Path) -> Generator[Entry, None, None]:
+    with open(path, "rb") as fh:
+        while True:
+            header = fh.read(ENTRY.size)
+            if len(header) < ENTRY.size:
+                break
+            key_len, value_len = ENTRY.unpack(header)
+            yield fh.read(key_len), fh.read(value_len)
+
+
+# The linker of the store being synced, inherited by the forked workers:
+_sync_linker: Optional[Linker[Entity]] = None
+
+
+def _sort_leaf(leaf_name: str, run_path: Path) -> Tuple[List[Path], int]:
+    """Read the statements of a leaf dataset in a worker process, and write their
+    store entries to files of sorted runs."""
+    assert _sync_linker is not None
+    leaf = get_catalog().require(leaf_name)
+    runs: List[Path] = []
+    entries: Dict[bytes, bytes] = {}
+    last_seens: Dict[str, str] = {}
+    count = 0
+    for stmt in iter_dataset_statements(leaf, external=True):
+        if stmt.entity_id is None:
+            continue
+        if stmt.last_seen is not None:
+            last_seens[stmt.dataset] = stmt.last_seen
+        for key, value in statement_entries(_sync_linker, stmt):
+            entries[key] = value
+        count += 1
+        if len(entries) >= RUN_SIZE:
+            runs.append(run_path.with_suffix(f".{len(runs)}"))
+            _write_run(runs[-1], entries)
+            entries = {}
+    for dataset, last_seen in last_seens.items():
+        entries[b(f"ls:{dataset}")] = b(last_seen)
+    runs.append(run_path.with_suffix(f".{len(runs)}"))
+    _write_run(runs[-1], entries)
+    return runs, count
+
+
 class Store(LevelDBStore[Dataset, Entity]):
     def __init__(
         self,
@@ -54,33 +182,262 @@ class Store(LevelDBStore[Dataset, Entity]):
             entity = simplify_undirected(entity)
         return entity
 
-    def sync(self, clear: bool = False) -> None:
-        if clear:
+    def writer(self) -> StoreWriter:
+        return StoreWriter(self)
+
+    def leaf_state(self, leaf: Dataset) -> Optional[str]:
+        """Identify the statements of a leaf dataset which would be loaded into the
+        store by the ID of the latest version of the dataset. The local version
+        history is used if the dataset was run locally. Version IDs are the same
+        on every machine, so that the leaf states recorded in a store snapshot
+        can be checked without the statements of the leaves. Returns `None` if
+        the version of the statements cannot be determined."""
+        path = dataset_resource_path(leaf.name, STATEMENTS_FILE)
+        version = get_latest(leaf.name, backfill=not path.exists())
+        return version.id if version is not None else None
+
+    def linker_state(self) -> str:
+        """Fingerprint the entity merges of the linker, independent of order."""
+        checksum, count = 0, 0
+        for canonical in self.linker.canonicals():
+            for referent in self.linker.get_referents(canonical.id):
+                data = f"{canonical.id}:{referent}".encode("utf-8")
+                digest = blake2b(data, digest_size=8).digest()
+                checksum = (checksum + int.from_bytes(digest, "big")) % (1 << 64)
+                count += 1
+        return f"{count}:{checksum:016x}"
+
+    def _stored_leaves(self) -> Dict[str, str]:
+        leaves: Dict[str, str] = {}
+        prefix = b(LEAF_PREFIX)
+        with self.db.iterator(prefix=prefix) as it:
+            for key, value in it:
+                name = key[len(prefix) :].decode("utf-8")
+                leaves[name] = value.decode("utf-8")
+        return leaves
+
+    def _remove_leaf(self, name: str) -> Tuple[Optional[bytes], Optional[bytes]]:
+        """Delete the statements of a dataset from the store. Returns the range of
+        the deleted statement keys. Entries in the inverted index of entity
+        references are kept, they may be shared with other datasets and are
+        checked when read."""
+        self.db.delete(b(f"{LEAF_PREFIX}{name}"))
+        low: Optional[bytes] = None
+        high: Optional[bytes] = None
+        prefix = b(f"{KEYS_PREFIX}{name}:")
+        with self.db.write_batch() as batch:
+            with self.db.iterator(prefix=prefix, include_value=False) as it:
+                for key in it:
+                    stmt_key = key[len(prefix) :]
+                    batch.delete(stmt_key)
+                    batch.delete(key)
+                    low = stmt_key if low is None else min(low, stmt_key)
+                    high = stmt_key if high is None else max(high, stmt_key)
+            batch.delete(b(f"ls:{name}"))
+        self.db.compact_range(start=prefix, stop=prefix[:-1] + b";")
+        return low, high
+
+    def _load_parallel(self, leaves: List[Dataset], workers: int) -> int:
+        """Load the statements of the given leaf datasets using a pool of worker
+        processes. Each worker reads the statements of a leaf and writes their
+        store entries to sorted run files, which are then merged and written to
+        LevelDB in key order. Sorted writes produce table files which do not
+        overlap, so they are cheap to compact."""
+        global _sync_linker
+        _sync_linker = self.linker
+        runs: List[Path] = []
+        count = 0
+        path = dataset_state_path(self.dataset.name)
+        with TemporaryDirectory(dir=path, prefix="sync") as tmp_dir:
+            # Workers are forked, and inherit the linker and the catalog. They
+            # must not use the store: LevelDB does not survive a fork.
+            mp = multiprocessing.get_context("fork")
+            with ProcessPoolExecutor(max_workers=workers, mp_context=mp) as executor:
+                futures = [
+                    executor.submit(_sort_leaf, leaf.name, Path(tmp_dir) / leaf.name)
+                    for leaf in leaves
+                ]
+                try:
+                    for leaf, future in zip(leaves, futures):
+                        leaf_runs, leaf_count = future.result()
+                        log.info(
+                            "Sorted dataset statements",
+                            dataset=leaf.name,
+                            statements=leaf_count,
+                        )
+                        runs.extend(leaf_runs)
+                        count += leaf_count
+                except BaseException:
+                    executor.shutdown(wait=True, cancel_futures=True)
+                    raise
+                finally:
+                    _sync_linker = None
+            log.info("Merging sorted statements...", runs=len(runs))
+            batch = self.db.write_batch()
+            batch_size = 0
+            for key, value in heapq.merge(*[_read_run(run) for run in runs]):
+                batch.put(key, value)
+                batch_size += 1
+                if batch_size >= BATCH_SIZE:
+                    batch.write()
+                    batch = self.db.write_batch()
+                    batch_size = 0
+            batch.write()
+        return count
+
+    def sync(self, clear: bool = False, workers: Optional[int] = None) -> None:
+        """Load the statements of the leaf datasets of the scope into the store.
+        The state of each leaf is recorded (see `leaf_state`), so that subsequent
+        syncs only re-load the statements of leaves which have changed since. If
+        the linker has changed, the store is rebuilt.
+
+        Args:
+            clear: Delete all data from the store and load all leaves again.
+            workers: Number of processes used to read the statements of the leaves,
+                defaults to `ZAVOD_STORE_WORKERS`. See `_load_parallel`.
+        """
+        linker_state = self.linker_state()
+        stored = self._stored_leaves()
+        full = clear or self.db.get(LINKER_KEY) != b(linker_state)
+        if full:
+            if not clear and len(stored):
+                log.info("Linker has changed, rebuilding store...")
             self.clear()
-        ds_key = f"dataset:{self.dataset.name}".encode("utf-8")
-        if self.db.get(ds_key):
+            stored = {}
+            if not clear and self.restore_snapshot(linker_state):
+                stored = self._stored_leaves()
+                full = False
+        states = {leaf.name: self.leaf_state(leaf) for leaf in self.dataset.leaves}
+        changed = [
+            leaf
+            for leaf in self.dataset.leaves
+            if states[leaf.name] is None or stored.get(leaf.name) != states[leaf.name]
+        ]
+        removed = [n for n in stored if n not in states]
+        if not len(changed) and not len(removed):
             return
-        log.info("Building local LevelDB aggregator...", scope=self.dataset.name)
-        idx = 0
-        with self.writer() as writer:
-            stmts = iter_dataset_statements(self.dataset, external=True)
-            for idx, stmt in enumerate(stmts):
-                if idx > 0 and idx % 50_000 == 0:
-                    log.info(
-                        "Indexing aggregator...",
-                        statements=idx,
-                        scope=self.dataset.name,
-                        dataset=stmt.dataset,
-                    )
-                writer.add_statement(stmt)
-        self.db.put(ds_key, b"1")
-        self.db.compact_range()
+        low: Optional[bytes] = None
+        high: Optional[bytes] = None
+        if not full:
+            for name in removed + [leaf.name for leaf in changed]:
+                log.info("Removing dataset from store...", dataset=name)
+                low_, high_ = self._remove_leaf(name)
+                if low_ is not None and high_ is not None:
+                    low = low_ if low is None else min(low, low_)
+                    high = high_ if high is None else max(high, high_)
+        log.info(
+            "Building local LevelDB aggregator...",
+            scope=self.dataset.name,
+            datasets=len(changed),
+        )
+        if workers is None:
+            workers = settings.STORE_WORKERS
+        if workers > 1:
+            idx = self._load_parallel(changed, workers)
+        else:
+            idx = 0
+            for leaf in changed:
+                with self.writer() as writer:
+                    stmts = iter_dataset_statements(leaf, external=True)
+                    for stmt in stmts:
+                        if idx > 0 and idx % 50_000 == 0:
+                            log.info(
+                                "Indexing aggregator...",
+                                statements=idx,
+                                scope=self.dataset.name,
+                                dataset=stmt.dataset,
+                            )
+                        writer.add_statement(stmt)
+                        idx += 1
+        for leaf in changed:
+            state = states[leaf.name]
+            if state is not None:
+                self.db.put(b(f"{LEAF_PREFIX}{leaf.name}"), b(state))
+        self.db.put(LINKER_KEY, b(linker_state))
+        if full:
+            self.db.compact_range()
+        elif low is not None and high is not None:
+            # Compact the span of the deleted statements only:
+            self.db.compact_range(start=low, stop=high + b"\x00")
         log.info(
             "Local LevelDB aggregator is ready.",
             scope=self.dataset.name,
             statements=idx,
         )
 
+    def snapshot(self) -> None:
+        """Write a compressed snapshot of the store to the dataset resources, so it
+        is published along with the other artifacts of the dataset. The snapshot
+        is accompanied by a description of the linker and the leaf datasets it
+        was built from, see `restore_snapshot`."""
+        linker_state = self.db.get(LINKER_KEY)
+        if linker_state is None:
+            raise ValueError("Store has not been synced: %s" % self.dataset.name)
+        meta = {
+            "dataset": self.dataset.name,
+            "linker": linker_state.decode("utf-8"),
+            "leaves": self._stored_leaves(),
+        }
+        path = dataset_resource_path(self.dataset.name, STORE_SNAPSHOT_FILE)
+        tmp_path = path.with_name(f".{path.name}.tmp")
+        log.info("Writing store snapshot...", path=path.as_posix())
+        # LevelDB files are only consistent while the database is closed:
+        self.db.close()
+        try:
+            with tarfile.open(tmp_path, "w:gz", compresslevel=6) as tar:
+                for file_path in sorted(self.path.iterdir()):
+                    if file_path.is_file() and file_path.name != "LOCK":
+                        tar.add(file_path, arcname=file_path.name)
+        finally:
+            self.db = plyvel.DB(self.path.as_posix(), create_if_missing=True)
+        tmp_path.replace(path)
+        meta_path = dataset_resource_path(self.dataset.name, STORE_SNAPSHOT_META)
+        with open(meta_path, "wb") as fh:
+            fh.write(orjson.dumps(meta))
+
+    def restore_snapshot(self, linker_state: str) -> bool:
+        """Replace the contents of the store with the latest published snapshot of
+        the dataset, if it was built with the same linker. Only collections
+        publish snapshots.
+
+        Returns:
+            True if a snapshot was restored.
+        """
+        if not self.dataset.is_collection:
+            return False
+        meta_object = get_artifact_object(self.dataset.name, STORE_SNAPSHOT_META)
+        if meta_object is None:
+            return False
+        with meta_object.open_binary() as fh:
+            meta = orjson.loads(fh.read())
+        if meta.get("linker") != linker_state:
+            log.info("Store snapshot was built with another linker, skipping.")
+            return False
+        prefix, _ = meta_object.name.rsplit("/", 1)
+        tar_object = get_archive_backend().get_object(f"{prefix}/{STORE_SNAPSHOT_FILE}")
+        if not tar_object.exists():
+            return False
+        log.info("Restoring store snapshot...", object=tar_object.name)
+        path = dataset_state_path(self.dataset.name)
+        with TemporaryDirectory(dir=path, prefix="snapshot") as tmp_dir:
+            tar_path = Path(tmp_dir) / STORE_SNAPSHOT_FILE
+            tar_object.backfill(tar_path)
+            self.db.close()
+            shutil.rmtree(self.path, ignore_errors=True)
+            self.path.mkdir(parents=True)
+            with tarfile.open(tar_path, "r:gz") as tar:
+                for member in tar.getmembers():
+                    # The snapshot is a flat directory of LevelDB files:
+                    if not member.isfile() or Path(member.name).name != member.name:
+                        raise ValueError("Invalid store snapshot: %s" % member.name)
+                    tar.extract(member, self.path)
+        self.db = plyvel.DB(self.path.as_posix(), create_if_missing=True)
+        if self.db.get(LINKER_KEY) != b(linker_state):
+            log.warning("Store snapshot is inconsistent, rebuilding store...")
+            self.clear()
+            return False
+        return True
+
     def clear(self) -> None:
         """Delete the working directory data for the latest version of the dataset
         from this store."""
@@ -0,0 +1,51 @@
+import bz2
+import gzip
+import lzma
+import tarfile
+import pytest
+from io import BytesIO
+from pathlib import Path
+from zipfile import ZipFile
+
+from zavod.helpers.archives import iter_archive_members
+
+DOC = b"<doc><record>A</record></doc>"
+
+
+def _read(path: Path, pattern=None):
+    return {name: fh.read() for name, fh in iter_archive_members(path, pattern)}
+
+
+def test_zip_members(tmp_path: Path):
+    path = tmp_path / "data.zip"
+    with ZipFile(path, "w") as zip:
+        zip.writestr("a.xml", DOC)
+        zip.writestr("sub/b.xml", DOC)
+        zip.writestr("readme.txt", b"hello")
+    assert _read(path) == {"a.xml": DOC, "sub/b.xml": DOC, "readme.txt": b"hello"}
+    assert _read(path, "*.xml") == {"a.xml": DOC, "sub/b.xml": DOC}
+
+
+def test_tar_members(tmp_path: Path):
+    for mode, suffix in (("w", ".tar"), ("w:gz", ".tar.gz"), ("w:xz", ".tar.xz")):
+        path = tmp_path / f"data{suffix}"
+        with tarfile.open(path, mode) as tar:
+            for name in ("a.xml", "b.txt"):
+                info = tarfile.TarInfo(name)
+                info.size = len(DOC)
+                tar.addfile(info, BytesIO(DOC))
+        assert _read(path, "*.xml") == {"a.xml": DOC}, path
+
+
+def test_compressed_file(tmp_path: Path):
+    for module, suffix in ((gzip, ".gz"), (bz2, ".bz2"), (lzma, ".xz")):
+        path = tmp_path / f"data.xml{suffix}"
+        with module.open(path, "wb") as fh:
+            fh.write(DOC)
+        assert _read(path) == {"data.xml": DOC}, path
+        assert _read(path, "*.csv") == {}
+
+    path = tmp_path / "data.xml"
+    path.write_bytes(DOC)
+    with pytest.raises(ValueError):
+        _read(path)
@@ -1,5 +1,7 @@
+from pathlib import Path
+from typing import Tuple
 from lxml import etree
-from zavod.helpers.xml import remove_namespace
+from zavod.helpers.xml import remove_namespace, iterparse_elements, iterparse_map
 from zavod.tests.conftest import XML_DOC
 
 
@@ -9,3 +11,42 @@ def test_xml_remove_namespace():
     assert doc.find(".//name") is None
     new_doc = remove_namespace(doc)
     assert new_doc.findtext(".//name") == "Peter Smith"
+
+
+def _record(el: etree._Element) -> Tuple[str, str]:
+    return el.findtext("name"), el.get("id")
+
+
+def _write_records(path: Path, count: int) -> None:
+    with open(path, "w") as fh:
+        fh.write('<list xmlns="urn:test"><header><title>Test</title></header>')
+        for i in range(count):
+            fh.write(f'<record id="{i}"><name>Person {i}</name></record>')
+        fh.write("</list>")
+
+
+def test_iterparse_elements(tmp_path: Path):
+    path = tmp_path / "records.xml"
+    _write_records(path, 500)
+    names = []
+    for el in iterparse_elements(path, "record"):
+        assert el.tag == "record"
+        # Processed elements are removed from the tree:
+        assert len(list(el.itersiblings(preceding=True))) <= 1
+        names.append(el.findtext("name"))
+    assert len(names) == 500
+    assert names[-1] == "Person 499"
+
+    with open(path, "rb") as fh:
+        titles = [el.text for el in iterparse_elements(fh, "title")]
+        assert titles == ["Test"]
+
+
+def test_iterparse_map(tmp_path: Path):
+    path = tmp_path / "records.xml"
+    _write_records(path, 250)
+    results = list(iterparse_map(path, "record", _record, workers=2, batch_size=7))
+    assert len(results) == 250
+    assert results[0] == ("Person 0", "0")
+    assert results[-1] == ("Person 249", "249")
+    assert list(iterparse_map(path, "record", _record, workers=1)) == results
@@ -0,0 +1,57 @@
+import time
+import pytest
+
+from zavod import settings
+from zavod.context import Context
+from zavod.meta import Dataset
+from zavod.runner.schedule import build_graph, sort_graph, run_many
+from zavod.runner import schedule
+from zavod.runner.schedule import TIMEOUT
+
+
+def crawl_slowly(context: Context) -> None:
+    time.sleep(30)
+
+
+def run_slowly(dataset: Dataset, **kwargs) -> bool:
+    time.sleep(30)
+    return True
+
+
+def test_build_graph(testdataset2: Dataset, collection: Dataset, analyzer: Dataset):
+    graph = build_graph([collection, analyzer])
+    assert graph["testdataset1"] == set()
+    assert graph["testdataset2"] == set()
+    assert graph["analyzer"] == {"testdataset1"}
+    assert graph[collection.name] == {"testdataset1", "testdataset2"}
+    order = sort_graph(graph)
+    assert order.index(collection.name) > order.index("testdataset2")
+    assert order.index("analyzer") > order.index("testdataset1")
+
+    # Inputs which are not part of the run are not waited for:
+    graph = build_graph([analyzer])
+    assert graph == {"analyzer": set()}
+
+    with pytest.raises(ValueError):
+        sort_graph({"a": {"b"}, "b": {"a"}})
+
+
+def test_run_many_timeout(testdataset1: Dataset):
+    testdataset1.entry_point = "zavod.tests.runner.test_schedule:crawl_slowly"
+    start = time.time()
+    results = run_many([testdataset1], timeout=1.0, latest=True)
+    assert results == {testdataset1.name: TIMEOUT}
+    assert time.time() - start < 20
+    latest_path = settings.ARCHIVE_PATH / "datasets" / "latest" / testdataset1.name
+    assert latest_path.joinpath("index.json").exists()
+    assert not latest_path.joinpath("statements.pack").exists()
+
+
+def test_run_many_timeout_collection(collection: Dataset, monkeypatch):
+    # The worker processes are forked, so they run the patched function:
+    monkeypatch.setattr(schedule, "run_dataset", run_slowly)
+    results = run_many([collection], workers=3, timeout=1.0, latest=True)
+    assert set(results.values()) == {TIMEOUT}
+    assert collection.name in results
+    latest_path = settings.ARCHIVE_PATH / "datasets" / "latest" / collection.name
+    assert latest_path.joinpath("index.json").exists()
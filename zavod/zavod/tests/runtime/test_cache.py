@@ -0,0 +1,156 @@
+import os
+import pytest
+from datetime import timedelta
+from rigour.time import naive_now
+from sqlalchemy import MetaData, create_engine, select, update
+
+from zavod import settings
+from zavod.meta import Dataset
+from zavod.exc import ConfigurationException
+from zavod.runtime.cache import CompressedCache, TrackedCache
+from zavod.runtime.cache import get_cache, prune_cache
+
+
+def test_compressed_cache(testdataset1: Dataset):
+    engine = create_engine("sqlite:///:memory:")
+    cache = CompressedCache(engine, MetaData(), testdataset1, create=True)
+    body = "<html>%s</html>" % ("hello world " * 1000)
+    cache.set("https://test.com/a", body)
+    cache.set("https://test.com/b", body)
+    cache.set_json("data", {"a": 1})
+    assert cache.get("https://test.com/a") == body
+    assert cache.get("https://test.com/a", max_age=10) == body
+    assert cache.get("https://test.com/a", max_age=0) is None
+    assert cache.get("https://test.com/c") is None
+    assert cache.get_json("data") == {"a": 1}
+    assert cache.has("https://test.com/b")
+
+    stats = cache.stats()
+    assert stats["keys"] == 3
+    assert stats["values"] == 2, stats
+    assert stats["compressed_size"] < stats["size"] / 10
+    assert stats["hits"] == 4
+    assert stats["misses"] == 2
+
+    keys = [v.key for v in cache.all(like="https://%")]
+    assert sorted(keys) == ["https://test.com/a", "https://test.com/b"]
+    assert all(v.text == body for v in cache.all(like="https://%"))
+
+    cache.delete("https://test.com/a")
+    assert cache.get("https://test.com/b") == body
+    assert cache.stats()["values"] == 2
+    cache.set("https://test.com/b", "changed")
+    assert cache.get("https://test.com/b") == "changed"
+    assert cache.stats()["values"] == 2
+
+    cache.clear()
+    assert cache.stats()["keys"] == 0
+    assert cache.stats()["values"] == 0
+    cache.close()
+
+
+def test_cache_backend_setting(testdataset1: Dataset):
+    get_cache.cache_clear()
+    settings.CACHE_BACKEND = "CompressedCache"
+    try:
+        cache = get_cache(testdataset1)
+        assert isinstance(cache, CompressedCache)
+        cache.close()
+        get_cache.cache_clear()
+        settings.CACHE_BACKEND = "Cache"
+        cache = get_cache(testdataset1)
+        assert isinstance(cache, TrackedCache)
+        cache.close()
+        get_cache.cache_clear()
+        settings.CACHE_BACKEND = "Redis"
+        with pytest.raises(ConfigurationException):
+            get_cache(testdataset1)
+    finally:
+        settings.CACHE_BACKEND = "Cache"
+        get_cache.cache_clear()
+
+
+def test_prune_cache(testdataset1: Dataset):
+    engine = create_engine("sqlite:///:memory:")
+    metadata = MetaData()
+    plain = TrackedCache(engine, metadata, testdataset1, create=True)
+    compressed = CompressedCache(engine, metadata, testdataset1, create=True)
+    old = naive_now() - timedelta(days=100)
+    for cache in (plain, compressed):
+        for i in range(10):
+            cache.set(f"key{i}", f"value-{i}-" + "x" * 1000)
+        cache.flush()
+        table = cache._table
+        stale = table.c.key.in_(["key0", "key1"])
+        cache.conn.execute(update(table).where(stale).values(timestamp=old))
+        if isinstance(cache, CompressedCache):
+            cache.conn.execute(update(table).where(stale).values(accessed=old))
+        else:
+            # Reads and writes of the plain cache are recorded on flush:
+            access = plain._access
+            stale = access.c.key.in_(["key0", "key1"])
+            cache.conn.execute(update(access).where(stale).values(accessed=old))
+        cache.flush()
+        assert prune_cache(cache, max_age=90) == 2
+        assert cache.get("key0") is None
+        assert cache.get("key2") is not None
+
+    compressed.conn.execute(update(compressed._index).values(accessed=old))
+    compressed.get("key3")
+    compressed.flush()
+    # key2 was read after the previous prune, key3 just now:
+    assert prune_cache(compressed, max_age=90) == 6
+    assert compressed.get("key3") is not None
+    assert compressed.stats()["values"] == 2
+
+    for i in range(10):
+        plain.set(f"key{i}", f"value-{i}-" + "x" * 1000)
+        plain.flush()
+    # Reading a key keeps it in the cache, even though it was stored first:
+    access = plain._access
+    for i in range(10):
+        when = old + timedelta(minutes=i)
+        stmt = update(access).where(access.c.key == f"key{i}").values(accessed=when)
+        plain.conn.execute(stmt)
+    plain.get("key0")
+    plain.flush()
+    assert prune_cache(plain, max_size=5000) == 6
+    assert plain.get("key0") is not None
+    assert plain.get("key6") is None
+    assert plain.get("key7") is not None
+    assert len(plain.conn.execute(select(access.c.key)).fetchall()) == 4
+    plain.close()
+    compressed.close()
+
+
+def test_prune_cache_size_in_bytes(testdataset1: Dataset):
+    engine = create_engine("sqlite:///:memory:")
+    cache = TrackedCache(engine, MetaData(), testdataset1, create=True)
+    for i in range(4):
+        # Each character takes two bytes in UTF-8:
+        cache.set(f"key{i}", "ä" * 1000)
+        cache.flush()
+    assert prune_cache(cache, max_size=4000) == 2
+    assert cache.get("key1") is None
+    assert cache.get("key2") is not None
+    cache.close()
+
+
+def test_prune_cache_shared_engine(testdataset1: Dataset, testdataset2: Dataset):
+    engine = create_engine("sqlite:///:memory:")
+    metadata = MetaData()
+    for cls in (TrackedCache, CompressedCache):
+        small = cls(engine, metadata, testdataset1, create=True)
+        large = cls(engine, metadata, testdataset2, create=True)
+        for i in range(10):
+            small.set(f"{cls.__name__}:small{i}", f"small-{i}-" + "x" * 100)
+        for i in range(50):
+            large.set(f"{cls.__name__}:large{i}", os.urandom(200).hex())
+        small.flush()
+        large.flush()
+        # The values of the other dataset do not count against the limit:
+        assert prune_cache(small, max_size=5000) == 0
+        assert prune_cache(large, max_size=5000) > 0
+        assert small.get(f"{cls.__name__}:small0") is not None
+        small.close()
+        large.close()
@@ -0,0 +1,66 @@
+from structlog.testing import capture_logs
+
+from zavod.context import Context
+from zavod.meta import Dataset
+from zavod.meta.lookups import compile_lookups
+from zavod.runtime.cleaning import get_value_cache
+
+
+def test_value_cache(testdataset1: Dataset):
+    context = Context(testdataset1)
+    cache = get_value_cache(testdataset1)
+    assert cache is get_value_cache(testdataset1)
+    entity = context.make("Person")
+    entity.id = "john"
+    entity.add("nationality", "Germany")
+    entity.add("birthDate", "1980-04-16T10:00:00")
+    entity.add("nationality", "Germany")
+    assert context.stats.clean_misses == 2
+    assert context.stats.clean_hits == 1
+    assert entity.get("nationality") == ["de"]
+    assert entity.get("birthDate") == ["1980-04-16"]
+
+    # Rejected values are remembered, too:
+    other = context.make("Person")
+    other.id = "jane"
+    other.add("birthDate", "banana")
+    other.add("birthDate", "banana")
+    assert not other.has("birthDate")
+    assert context.stats.clean_hits == 2
+    assert context.stats.to_dict()["clean_hits"] == 2
+
+    # Phone numbers are cleaned using the countries of the entity:
+    entity.add("phone", "+49 30 1234567")
+    other.add("phone", "030 1234567")
+    assert context.stats.clean_misses == 3
+
+    cache.size = 2
+    cache.set(("Person", entity.schema.get("name"), "x", False, False, None), [])
+    assert len(cache.outcomes) == 2
+
+    # The memo is rebuilt when the dataset lookups change:
+    testdataset1.lookups = {}
+    assert get_value_cache(testdataset1) is not cache
+    context.close()
+
+
+def test_value_cache_warnings(testdataset1: Dataset):
+    context = Context(testdataset1)
+    entity = context.make("Company")
+    entity.id = "acme"
+    with capture_logs() as cap_logs:
+        entity.add("leiCode", "invalid")
+        entity.add("leiCode", "invalid")
+    warnings = [c for c in cap_logs if c["event"] == "Failed to validate identifier"]
+    assert len(warnings) == 2
+    assert entity.get("leiCode") == ["invalid"]
+
+    config = {"match": "Acme", "prop": "birthDate", "value": "Acme Inc."}
+    testdataset1.lookups = compile_lookups({"type.name": {"options": [config]}})
+    with capture_logs() as cap_logs:
+        entity.add("name", "Acme")
+        entity.add("name", "Acme")
+    event = "Invalid type lookup property re-write"
+    assert len([c for c in cap_logs if c["event"] == event]) == 2
+    assert entity.get("name") == ["Acme Inc."]
+    context.close()
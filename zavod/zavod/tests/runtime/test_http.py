@@ -0,0 +1,123 @@
+import pytest
+import requests_mock
+from hashlib import sha1
+from pathlib import Path
+from requests.exceptions import HTTPError
+
+from zavod.meta import Dataset
+from zavod.runtime import http_
+from zavod.runtime.http_ import fetch_file, make_session
+
+URL = "https://test.com/large.bin"
+BODY = bytes(range(256)) * 400
+
+
+class Server(object):
+    def __init__(self, truncate: bool = False, ranges: bool = True) -> None:
+        self.truncate = truncate
+        self.ranges = ranges
+        self.fail_ranges = False
+
+    def __call__(self, request, context) -> bytes:
+        context.headers["ETag"] = '"v1"'
+        if self.ranges:
+            context.headers["Accept-Ranges"] = "bytes"
+        range_ = request.headers.get("Range")
+        if range_ is None or not self.ranges:
+            context.headers["Content-Length"] = str(len(BODY))
+            if self.truncate:
+                self.truncate = False
+                return BODY[:1000]
+            return BODY
+        if self.fail_ranges:
+            context.status_code = 500
+            return b""
+        start, end = [int(p) for p in range_.split("=")[1].split("-")]
+        context.status_code = 206
+        context.headers["Content-Range"] = f"bytes {start}-{end}/{len(BODY)}"
+        context.headers["Content-Length"] = str(end - start + 1)
+        return BODY[start : end + 1]
+
+
+def _parts(path: Path):
+    return list(path.parent.glob(".large.bin.part*"))
+
+
+def test_fetch_file_resume(testdataset1: Dataset, tmp_path: Path):
+    session = make_session(testdataset1.http)
+    with requests_mock.Mocker() as m:
+        m.get(URL, content=Server(truncate=True))
+        path = fetch_file(session, URL, "large.bin", data_path=tmp_path)
+        assert path.read_bytes() == BODY
+        assert m.call_count == 2
+        assert m.request_history[1].headers["Range"] == f"bytes=1000-{len(BODY) - 1}"
+        assert m.request_history[1].headers["If-Range"] == '"v1"'
+        assert not len(_parts(path))
+        assert path.with_name(".large.bin.validators.json").exists()
+
+
+def test_fetch_file_resume_later(testdataset1: Dataset, tmp_path: Path):
+    session = make_session(testdataset1.http)
+    server = Server(truncate=True)
+    server.fail_ranges = True
+    with requests_mock.Mocker() as m:
+        m.get(URL, content=server)
+        with pytest.raises(HTTPError):
+            fetch_file(session, URL, "large.bin", data_path=tmp_path)
+        path = tmp_path / "large.bin"
+        assert not path.exists()
+        assert len(_parts(path))
+
+        server.fail_ranges = False
+        fetch_file(session, URL, "large.bin", data_path=tmp_path)
+        assert path.read_bytes() == BODY
+        assert m.request_history[-1].headers["Range"].startswith("bytes=1000-")
+        assert not len(_parts(path))
+
+
+def test_fetch_file_no_ranges(testdataset1: Dataset, tmp_path: Path):
+    session = make_session(testdataset1.http)
+    with requests_mock.Mocker() as m:
+        m.get(URL, content=Server(truncate=True, ranges=False))
+        with pytest.raises(IOError):
+            fetch_file(session, URL, "large.bin", data_path=tmp_path)
+        path = tmp_path / "large.bin"
+        assert not path.exists()
+        assert not len(_parts(path))
+        fetch_file(session, URL, "large.bin", data_path=tmp_path)
+        assert path.read_bytes() == BODY
+
+
+def test_fetch_file_parallel(
+    testdataset1: Dataset, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+):
+    monkeypatch.setattr(http_, "MIN_SEGMENT_SIZE", 10000)
+    session = make_session(testdataset1.http)
+    checksum = f"sha1:{sha1(BODY).hexdigest()}"
+    with requests_mock.Mocker() as m:
+        m.get(URL, content=Server())
+        path = fetch_file(
+            session,
+            URL,
+            "large.bin",
+            data_path=tmp_path,
+            checksum=checksum,
+            connections=4,
+        )
+        assert path.read_bytes() == BODY
+        ranges = [r.headers.get("Range") for r in m.request_history[1:]]
+        assert len(ranges) == 4
+        assert "bytes=0-25599" in ranges
+        assert not len(_parts(path))
+
+        with pytest.raises(IOError):
+            fetch_file(
+                session,
+                URL,
+                "other.bin",
+                data_path=tmp_path,
+                checksum="sha1:abc",
+                connections=4,
+            )
+        assert not path.with_name("other.bin").exists()
+        assert not len(list(tmp_path.glob(".other.bin.part*")))
@@ -0,0 +1,37 @@
+import time
+
+from zavod.meta import Dataset
+from zavod.runtime.profile import get_profiler, NoProfiler
+
+
+def busy_function() -> None:
+    end = time.time() + 0.2
+    while time.time() < end:
+        sum(range(1000))
+
+
+def test_profiler(testdataset1: Dataset):
+    with get_profiler(testdataset1, "crawl") as profiler:
+        busy_function()
+    assert len(profiler.samples) > 0
+    name, own, total = profiler.summary(top=1)[0]
+    assert total >= own > 0
+
+    assert profiler.folded_path.name == "profile-crawl.folded"
+    with open(profiler.folded_path, "r") as fh:
+        lines = fh.readlines()
+    assert len(lines) > 0
+    stack, count = lines[0].rsplit(" ", 1)
+    assert int(count) > 0
+    assert any("busy_function (" in line for line in lines)
+    with open(profiler.summary_path, "r") as fh:
+        summary = fh.read()
+    assert "busy_function (" in summary
+    assert "test_profile.py" in summary
+
+    profiler = get_profiler(testdataset1, "export", enabled=False)
+    assert isinstance(profiler, NoProfiler)
+    with profiler:
+        busy_function()
+    assert len(profiler.samples) == 0
+    assert not profiler.summary_path.exists()
@@ -1,9 +1,11 @@
+import pytest
 from nomenklatura.statement import Statement, read_statements
 from nomenklatura.statement.serialize import PACK
 
 from zavod import settings
 from zavod.meta import Dataset
 from zavod.context import Context
+from zavod.runtime.sink import DatasetSink, BATCH_SIZE
 
 
 def test_dataset_sink(testdataset1: Dataset):
@@ -26,3 +28,30 @@ def test_dataset_sink(testdataset1: Dataset):
         assert "name" in props, props
     context.sink.clear()
     assert not context.sink.path.is_file()
+
+
+def test_background_sink(testdataset1: Dataset):
+    sink = DatasetSink(testdataset1, background=True)
+    count = BATCH_SIZE * 2 + 10
+    for i in range(count):
+        stmt = Statement(
+            entity_id=f"e{i}",
+            prop="name",
+            schema="Person",
+            value=f"Person {i}",
+            dataset=testdataset1.name,
+        )
+        sink.emit(stmt)
+    sink.close()
+    with open(sink.path, "rb") as fh:
+        stmts = list(read_statements(fh, PACK, Statement))
+    assert len(stmts) == count
+    assert stmts[-1].value == f"Person {count - 1}"
+    sink.clear()
+
+    # Writer errors are raised in the emitting thread:
+    sink.path.mkdir()
+    sink.emit(stmts[0])
+    with pytest.raises(IsADirectoryError):
+        sink.close()
+    sink.path.rmdir()
@@ -0,0 +1,87 @@
+import json
+import requests_mock
+from shutil import copyfile
+
+from zavod import settings
+from zavod.context import Context
+from zavod.meta import Dataset
+from zavod.crawl import crawl_dataset
+from zavod.archive import dataset_resource_path, iter_local_statements
+from zavod.archive import SOURCES_FILE, STATEMENTS_FILE, TIMESTAMPS_FILE
+
+URL = "https://test.com/source.txt"
+EMITTED = []
+
+
+def crawl_source(context: Context) -> None:
+    path = context.fetch_resource("source.txt", URL)
+    with open(path, "r") as fh:
+        for line in fh:
+            entity = context.make("Person")
+            entity.id = context.make_slug(line.strip())
+            entity.add("name", line.strip())
+            context.emit(entity, target=True)
+            EMITTED.append(entity.id)
+
+
+def _publish(dataset: Dataset) -> None:
+    archive_path = settings.ARCHIVE_PATH / "datasets/latest" / dataset.name
+    archive_path.mkdir(parents=True, exist_ok=True)
+    for name in (STATEMENTS_FILE, TIMESTAMPS_FILE, SOURCES_FILE):
+        copyfile(dataset_resource_path(dataset.name, name), archive_path / name)
+
+
+def test_incremental_crawl(testdataset1: Dataset):
+    testdataset1.entry_point = "zavod.tests.runtime.test_sources:crawl_source"
+    with requests_mock.Mocker() as m:
+        m.get(URL, text="Jane Doe\nJohn Doe\n")
+        stats = crawl_dataset(testdataset1, incremental=True)
+    assert stats.entities == 2
+    assert len(EMITTED) == 2
+    with open(dataset_resource_path(testdataset1.name, SOURCES_FILE), "r") as fh:
+        sources = json.load(fh)
+    assert sources["complete"] is True
+    assert sources["sources"][0]["url"] == URL
+    _publish(testdataset1)
+
+    # Unchanged source data, the previous statements are re-used:
+    EMITTED.clear()
+    dataset_resource_path(testdataset1.name, "source.txt").unlink()
+    with requests_mock.Mocker() as m:
+        m.get(URL, text="Jane Doe\nJohn Doe\n")
+        reused = crawl_dataset(testdataset1, incremental=True)
+    assert len(EMITTED) == 0
+    assert reused.entities == 2
+    assert reused.targets == 2
+    assert reused.statements == stats.statements
+    stmts = list(iter_local_statements(testdataset1))
+    assert len(stmts) == stats.statements
+    assert all(s.last_seen == settings.RUN_TIME_ISO for s in stmts)
+
+    # Without the incremental flag, the crawler is run:
+    crawl_dataset(testdataset1)
+    assert len(EMITTED) == 2
+
+    # Changed source data:
+    EMITTED.clear()
+    dataset_resource_path(testdataset1.name, "source.txt").unlink()
+    with requests_mock.Mocker() as m:
+        m.get(URL, text="Jane Doe\nJohn Doe\nJim Doe\n")
+        stats = crawl_dataset(testdataset1, incremental=True)
+    assert len(EMITTED) == 3
+    assert stats.entities == 3
+
+
+def test_untracked_sources(testdataset1: Dataset):
+    context = Context(testdataset1)
+    with requests_mock.Mocker() as m:
+        m.get(URL, text="Jane Doe\n")
+        m.get("https://test.com/other", text="Other")
+        context.fetch_resource("source.txt", URL)
+        context.sources.code = "test"
+        assert context.sources.complete
+        context.fetch_text("https://test.com/other")
+    assert not context.sources.complete
+    assert context.sources.untracked == ["https://test.com/other"]
+    assert not context.sources.unchanged()
+    context.close()
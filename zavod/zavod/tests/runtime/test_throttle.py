@@ -0,0 +1,80 @@
+import time
+from typing import cast
+from urllib3 import HTTPResponse
+from urllib3.connectionpool import HTTPConnectionPool
+
+from zavod.meta import Dataset
+from zavod.meta.http import HTTP
+from zavod.runtime.http_ import make_session, ThrottledAdapter, ThrottledRetry
+from zavod.runtime.throttle import HostThrottle
+
+
+def test_token_bucket():
+    throttle = HostThrottle("test.com", rate=50.0, burst=2)
+    start = time.monotonic()
+    for _ in range(7):
+        throttle.acquire()
+        throttle.release()
+    # Two requests are covered by the burst, the other five are rate limited:
+    elapsed = time.monotonic() - start
+    assert elapsed >= 0.09, elapsed
+    assert elapsed < 1.0, elapsed
+
+
+def test_unlimited_and_concurrency():
+    throttle = HostThrottle("test.com", concurrency=1)
+    assert throttle.slots is not None
+    throttle.acquire()
+    assert not throttle.slots.acquire(blocking=False)
+    throttle.release()
+    assert throttle.slots.acquire(blocking=False)
+    throttle.slots.release()
+
+    start = time.monotonic()
+    for _ in range(100):
+        throttle.acquire()
+        throttle.release()
+    assert time.monotonic() - start < 0.5
+
+
+def test_backoff_and_recover():
+    throttle = HostThrottle("test.com", rate=10.0, burst=5)
+    throttle.backoff(0.1)
+    assert throttle.rate == 5.0
+    start = time.monotonic()
+    throttle.acquire()
+    assert time.monotonic() - start >= 0.09
+    for _ in range(100):
+        throttle.recover()
+    assert throttle.rate == 10.0
+
+    for _ in range(10):
+        throttle.backoff(0.0)
+    assert throttle.rate == 10.0 / 16
+
+
+def test_session_config(testdataset1: Dataset):
+    http = HTTP({"rate_limit": 4, "rate_burst": 2, "host_concurrency": 3})
+    assert testdataset1.http.rate_limit is None
+    assert testdataset1.http.host_concurrency is None
+    session = make_session(http)
+    adapter = cast(ThrottledAdapter, session.get_adapter("https://test.com"))
+    assert isinstance(adapter, ThrottledAdapter)
+    throttle = adapter.get_throttle("test.com")
+    assert throttle.rate == 4.0
+    assert throttle.burst == 2
+    assert adapter.get_throttle("test.com") is throttle
+    assert adapter.get_throttle("other.com") is not throttle
+
+    retry = adapter.max_retries
+    assert isinstance(retry, ThrottledRetry)
+    assert retry.adapter is adapter
+    retry = retry.new(total=5)
+    assert retry.adapter is adapter
+
+    pool = HTTPConnectionPool("test.com")
+    response = HTTPResponse(status=429, headers={"Retry-After": "0"})
+    retry = retry.increment(method="GET", url="/", response=response, _pool=pool)
+    assert isinstance(retry, ThrottledRetry)
+    assert throttle.rate == 2.0
+    session.close()
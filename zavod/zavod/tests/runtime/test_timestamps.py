@@ -1,11 +1,13 @@
 from datetime import timedelta
 from shutil import copyfile
 from rigour.time import utc_now
+from nomenklatura.statement import Statement
 
 from zavod import settings
 from zavod.meta import Dataset
 from zavod.crawl import crawl_dataset
-from zavod.archive import iter_dataset_statements
+from zavod.archive import iter_dataset_statements, TIMESTAMPS_FILE
+from zavod.runtime import timestamps
 from zavod.runtime.timestamps import TimeStampIndex
 
 
@@ -52,3 +54,69 @@ def test_backfill(testdataset1: Dataset):
     for stmt in stmts:
         assert index.get(stmt.id, second_time) != ""
         assert index.get(stmt.id, second_time) == prev_time
+
+
+def test_index_file(testdataset1: Dataset, monkeypatch):
+    monkeypatch.setattr(timestamps, "RUN_SIZE", 7)
+    stmts = []
+    for i in range(50):
+        stmt = Statement(
+            entity_id=f"e{i}",
+            prop="name",
+            schema="Person",
+            value=f"Name {i}",
+            dataset=testdataset1.name,
+            first_seen=f"2023-01-{(i % 5) + 1:02d}T00:00:00",
+        )
+        stmts.append(stmt)
+    # Duplicate statements keep the earliest timestamp:
+    dupe = stmts[3].clone()
+    dupe.first_seen = "2022-12-31T00:00:00"
+    stmts.append(dupe)
+
+    index = TimeStampIndex(dataset=testdataset1)
+    index.index(stmts)
+    assert index.count == 50
+    assert index.path.name == TIMESTAMPS_FILE
+    for stmt in stmts[:50]:
+        expected = stmt.first_seen if stmt.id != dupe.id else dupe.first_seen
+        assert index.get(stmt.id, "x") == expected
+    assert index.get("missing", "x") == "x"
+    assert index.get(None, "x") == "x"
+    ids = [stmts[5].id, None, "missing", stmts[3].id]
+    assert index.get_many(ids, "x") == [stmts[5].first_seen, "x", "x", dupe.first_seen]
+    # Batches are looked up in sorted order, but returned in the order given:
+    ids = [f"missing-{i}" for i in range(20)] + [s.id for s in stmts]
+    ids = list(reversed(ids)) + ids
+    assert index.get_many(ids, "x") == [index.get(id, "x") for id in ids]
+    index.close()
+
+    # The index file is re-opened by a new instance:
+    index = TimeStampIndex(dataset=testdataset1)
+    assert index.get(stmts[10].id, "x") == stmts[10].first_seen
+    index.index([])
+    assert index.count == 0
+    assert index.get(stmts[10].id, "x") == "x"
+    assert index.get_many([stmts[10].id], "x") == ["x"]
+    index.close()
+
+
+def test_backfill_index(testdataset1: Dataset):
+    prev_time = settings.RUN_TIME_ISO
+    crawl_dataset(testdataset1)
+    data_path = settings.DATA_PATH / "datasets" / testdataset1.name
+    assert data_path.joinpath(TIMESTAMPS_FILE).is_file()
+
+    archive_path = settings.ARCHIVE_PATH / "datasets/latest" / testdataset1.name
+    archive_path.mkdir(parents=True, exist_ok=True)
+    copyfile(data_path / TIMESTAMPS_FILE, archive_path / TIMESTAMPS_FILE)
+    # The published index is used instead of reading the statements:
+    with open(archive_path / "statements.pack", "w") as fh:
+        fh.write("invalid")
+
+    stmts = list(iter_dataset_statements(testdataset1, external=False))
+    index = TimeStampIndex.build(dataset=testdataset1)
+    assert index.count == len(stmts)
+    for stmt in stmts:
+        assert index.get(stmt.id, "x") == prev_time
+    index.close()
@@ -0,0 +1,60 @@
+import orjson
+import pytest
+
+from zavod import settings
+from zavod.meta import Dataset
+from zavod.crawl import crawl_dataset
+from zavod.archive import dataset_resource_path, TIMINGS_FILE
+from zavod.runtime.timings import DatasetTimings
+from zavod.runtime.versions import make_version
+
+
+def _load(dataset: Dataset):
+    with open(dataset_resource_path(dataset.name, TIMINGS_FILE), "rb") as fh:
+        return orjson.loads(fh.read())
+
+
+def test_timings(testdataset1: Dataset):
+    make_version(testdataset1, settings.RUN_VERSION, overwrite=True)
+    timings = DatasetTimings(testdataset1)
+    with timings.phase("export") as record:
+        record["statements"] = 1000
+    with pytest.raises(ValueError):
+        with DatasetTimings(testdataset1).phase("publish"):
+            raise ValueError()
+
+    data = _load(testdataset1)
+    assert data["version"] == settings.RUN_VERSION.id
+    assert data["peak_rss"] > 0
+    export = data["phases"]["export"]
+    assert export["wall_time"] >= 0
+    assert export["cpu_time"] >= 0
+    assert export["statements"] == 1000
+    assert "statements_per_second" in export
+    assert "started_at" in export
+    assert "publish" in data["phases"]
+
+    # Timings of another version are discarded:
+    data["version"] = "20010101000000-xxx"
+    with open(timings.path, "wb") as fh:
+        fh.write(orjson.dumps(data))
+    with timings.phase("sync"):
+        pass
+    assert list(_load(testdataset1)["phases"]) == ["sync"]
+
+    disabled = DatasetTimings(testdataset1, enabled=False)
+    with disabled.phase("crawl"):
+        pass
+    assert "crawl" not in _load(testdataset1)["phases"]
+
+
+def test_crawl_timings(testdataset1: Dataset):
+    stats = crawl_dataset(testdataset1)
+    data = _load(testdataset1)
+    assert "index" in data["phases"]
+    crawl = data["phases"]["crawl"]
+    assert crawl["statements"] == stats.statements
+    assert crawl["entities"] == stats.entities
+    assert crawl["http_requests"] == 0
+    assert crawl["cache_hit_ratio"] == 0.0
+    assert crawl["wall_time"] >= data["phases"]["index"]["wall_time"]
@@ -1,3 +1,4 @@
+from hashlib import sha256
 import pytest
 import requests_mock
 from base64 import b64encode
@@ -184,6 +185,13 @@ def test_fetch_resource(testdataset1: Dataset):
         # Except when the file exists locally
         fetch_resource(context, "source2.csv", url, expected_media_type="text/plain")
         fetch_resource(context, "source3.csv", url, expected_charset="UTF-8")
+
+        digest = sha256("name,surname\nSally,Sue".encode()).hexdigest()
+        with pytest.raises(IOError):
+            fetch_resource(context, "source4.csv", url, checksum="sha256:abc")
+        assert not path.with_name("source4.csv").exists()
+        fetch_resource(context, "source4.csv", url, checksum=f"sha256:{digest}")
+        assert path.with_name("source4.csv").exists()
     context.close()
 
 
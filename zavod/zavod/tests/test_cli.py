@@ -1,4 +1,8 @@
+import os
+import json
+import sys
 import shutil
+import subprocess
 from click.testing import CliRunner
 
 from zavod import settings
@@ -6,7 +10,8 @@ from zavod.meta import Dataset
 from zavod.dedupe import get_resolver
 from zavod.cli import cli
 from zavod.archive import dataset_state_path
-from zavod.tests.conftest import DATASET_1_YML, DATASET_3_YML
+from zavod.tests.conftest import DATASET_1_YML, DATASET_2_YML, DATASET_3_YML
+from zavod.tests.conftest import COLLECTION_YML
 
 
 def test_crawl_dataset():
@@ -25,6 +30,16 @@ def test_crawl_dataset():
     assert not path.exists()
 
 
+def test_crawl_profile():
+    runner = CliRunner()
+    result = runner.invoke(cli, ["crawl", "--profile", DATASET_1_YML.as_posix()])
+    assert result.exit_code == 0, result.output
+    path = settings.DATA_PATH / "datasets" / "testdataset1"
+    assert path.joinpath("profile-crawl.folded").exists()
+    with open(path / "profile-crawl.txt", "r") as fh:
+        assert "crawl_dataset (" in fh.read()
+
+
 def test_export_dataset():
     runner = CliRunner()
     result = runner.invoke(cli, ["export", "/dev/null"])
@@ -87,6 +102,10 @@ def test_run_dataset(testdataset1: Dataset):
     # Validation issues in a published run are published
     with open(artifacts_path / "issues.json", "r") as f:
         assert "is a target but has no topics" in f.read()
+    with open(artifacts_path / "timings.json", "r") as f:
+        phases = json.load(f)["phases"]
+    for phase in ("crawl", "sync", "validate", "export", "publish"):
+        assert phases[phase]["wall_time"] >= 0, phase
     shutil.rmtree(latest_path)
 
     result = runner.invoke(cli, ["publish", "/dev/null"])
@@ -138,3 +157,37 @@ def test_xref_dataset(testdataset1: Dataset):
     get_resolver.cache_clear()
     resolver = get_resolver()
     assert len(resolver.edges) == 0
+
+
+def test_cache_prune():
+    runner = CliRunner()
+    result = runner.invoke(cli, ["cache-prune", "/dev/null"])
+    assert result.exit_code != 0, result.output
+    result = runner.invoke(cli, ["cache-prune", DATASET_1_YML.as_posix(), "-s", "1"])
+    assert result.exit_code == 0, result.output
+
+
+def test_run_many(testdataset1: Dataset):
+    # LevelDB does not survive a fork once it has been used in a process, so the
+    # command is run in a fresh interpreter:
+    env = dict(os.environ)
+    env["ZAVOD_DATA_PATH"] = settings.DATA_PATH.as_posix()
+    env["ZAVOD_ARCHIVE_PATH"] = settings.ARCHIVE_PATH.as_posix()
+    env["ZAVOD_RESOLVER_PATH"] = settings.RESOLVER_PATH
+    env["ZAVOD_DATABASE_URI"] = "sqlite:///%s/cache.db" % settings.DATA_PATH
+    cmd = [sys.executable, "-m", "zavod.cli", "run-many", "--latest", "-w", "2"]
+    paths = [DATASET_1_YML, DATASET_2_YML, COLLECTION_YML]
+    proc = subprocess.run(
+        cmd + [p.as_posix() for p in paths], env=env, capture_output=True, text=True
+    )
+    assert proc.returncode == 0, proc.stderr
+    lines = proc.stdout.strip().split("\n")
+    assert lines[-1] == "collection: ok", proc.stdout
+    assert "testdataset1: ok" in lines, proc.stdout
+    assert "testdataset2: ok" in lines, proc.stdout
+    latest_path = settings.ARCHIVE_PATH / "datasets" / "latest"
+    assert latest_path.joinpath("collection", "index.json").exists()
+    assert latest_path.joinpath("testdataset2", "index.json").exists()
+
+    result = subprocess.run(cmd + ["/dev/null"], env=env, capture_output=True)
+    assert result.returncode != 0
@@ -1,25 +1,35 @@
-from typing import cast
-from datetime import datetime
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, cast
+from datetime import datetime, timedelta
 
 import pytest
 import requests_mock
 from requests.adapters import HTTPAdapter
+from requests.exceptions import HTTPError
 import orjson
 from lxml import etree
+from nomenklatura.statement import Statement
 
 from zavod import settings
+from zavod import context as context_module
 from zavod.context import Context
+from zavod.logs import configure_logging, get_logger
 from zavod.meta import Dataset
 from zavod.entity import Entity
 from zavod.crawl import crawl_dataset
 from zavod.archive import iter_dataset_statements
-from zavod.runtime.http_ import request_hash
+from zavod.runtime.http_ import request_hash, validators_key
 from zavod.runtime.cache import get_cache, get_engine, get_metadata
 from zavod.runtime.sink import DatasetSink
+from zavod.runtime.stats import ContextStats
 from zavod.exc import RunFailedException
 from zavod.runtime.loader import load_entry_point
 from zavod.tests.conftest import XML_DOC
 
+log = get_logger(__name__)
+
 
 def test_context_helpers(testdataset1: Dataset):
     context = Context(testdataset1)
@@ -55,6 +65,13 @@ def test_context_helpers(testdataset1: Dataset):
     assert result.value == "Fruit"
     assert context.lookup_value("plants", "potato") == "Vegetable"
     assert context.lookup_value("plants", "stone") is None
+    assert context.lookup_value("plants", "stone", default="Rock") == "Rock"
+    assert context.lookup("plants", "banana") is result
+    plants = context.get_lookup("plants")
+    assert "stone" in plants.unmatched
+    for option in plants.options:
+        if option.result.value == "Fruit":
+            assert option.ref_count == 1
 
     context.inspect(None)
     context.inspect("foo")
@@ -83,6 +100,121 @@ def test_context_dry_run(testdataset1: Dataset):
     assert list(context.issues.all()) == []
 
 
+def _make_people(context: Context, count: int) -> List[Entity]:
+    entities = []
+    for i in range(count):
+        entity = context.make("Person")
+        entity.id = f"person-{i}"
+        entity.add("name", f"Person {i}")
+        entity.add("birthDate", "1980-01-01")
+        entities.append(entity)
+    return entities
+
+
+def test_context_emit_many(testdataset1: Dataset, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(context_module, "EMIT_BATCH", 300)
+    context = Context(testdataset1)
+    context.begin(clear=True)
+    entities = _make_people(context, 1000)
+    entities.append(context.make("Person"))
+    entities[-1].id = "no-props"
+    previous = [s for e in entities[:500] for s in e.statements]
+    for stmt in previous:
+        stmt.first_seen = "2020-01-01T00:00:00"
+    context.timestamps.index(previous)
+    batches: List[int] = []
+    sink_emit_many = context.sink.emit_many
+
+    def _emit_many(stmts: List[Statement]) -> None:
+        batches.append(len(stmts))
+        sink_emit_many(stmts)
+
+    context.sink.emit_many = _emit_many  # type: ignore
+    lookups: List[int] = []
+    get_many = context.timestamps.get_many
+
+    def _get_many(ids: List[Optional[str]], default: str) -> List[str]:
+        lookups.append(len(ids))
+        return get_many(ids, default)
+
+    def _get(id: Optional[str], default: str) -> str:
+        raise AssertionError("Statements are looked up one by one")
+
+    context.timestamps.get_many = _get_many  # type: ignore
+    context.timestamps.get = _get  # type: ignore
+    context.emit_many((e for e in entities), target=True)
+    assert batches == [900, 900, 900, 300]
+    assert lookups == batches
+    assert context.stats.entities == 1000
+    assert context.stats.targets == 1000
+    assert context.stats.statements == 3000
+    assert context.stats.changed == 1500
+    context.close()
+
+    stmts = list(iter_dataset_statements(testdataset1))
+    assert len(stmts) == 3000
+    seen = {s.entity_id: s.first_seen for s in stmts}
+    assert seen["person-1"] == "2020-01-01T00:00:00"
+    assert seen["person-999"] == settings.RUN_TIME_ISO
+    for stmt in stmts:
+        assert stmt.target is True
+        assert stmt.dataset == testdataset1.name
+        assert stmt.last_seen == settings.RUN_TIME_ISO
+
+    # An entity without an ID fails its chunk before any entity is counted:
+    valid = _make_people(context, 1)[0]
+    with pytest.raises(ValueError):
+        context.emit_many([valid, context.make("Person")])
+    assert context.stats.entities == 1000
+    assert all(s.last_seen is None for s in valid.statements)
+
+
+@pytest.mark.skipif(
+    "ZAVOD_TEST_BENCHMARK" not in os.environ,
+    reason="Timing test, set ZAVOD_TEST_BENCHMARK to run it",
+)
+def test_context_emit_benchmark(testdataset1: Dataset):
+    # Compare the time spent stamping statements and looking up their previous
+    # first_seen time in a batch against doing so one statement at a time:
+    context = Context(testdataset1)
+    context.begin(clear=True)
+    entities = _make_people(context, 2000)
+    previous = [s for e in entities for s in e.statements]
+    for stmt in previous:
+        stmt.first_seen = "2020-01-01T00:00:00"
+    context.timestamps.index(previous)
+    context.sink.emit_many = lambda stmts: None  # type: ignore
+
+    def _reference() -> None:
+        for entity in entities:
+            for stmt in entity.statements:
+                if stmt.lang is None:
+                    stmt.lang = context.lang
+                stmt.dataset = context.dataset.name
+                stmt.entity_id = entity.id
+                stmt.external = False
+                stmt.target = False
+                stmt.schema = entity.schema.name
+                stmt.first_seen = context.data_time_iso
+                stmt.last_seen = context.data_time_iso
+                first_seen = context.timestamps.get(stmt.id, context.data_time_iso)
+                stmt.first_seen = first_seen
+
+    reference = batch = float("inf")
+    for _ in range(3):
+        start = time.perf_counter()
+        _reference()
+        reference = min(reference, time.perf_counter() - start)
+        start = time.perf_counter()
+        context.emit_many(entities)
+        batch = min(batch, time.perf_counter() - start)
+    log.info(
+        "Emit benchmark", batch=batch, reference=reference, ratio=batch / reference
+    )
+    assert batch <= reference * 0.9
+    context.close()
+
+
 def test_context_get_fetchers(testdataset1: Dataset):
     context = Context(testdataset1)
 
@@ -96,6 +228,11 @@ def test_context_get_fetchers(testdataset1: Dataset):
         assert text == "Hello, World!"
 
         assert m.call_count == 1
+    assert context.stats.http_requests == 1
+    assert context.stats.http_bytes == len("Hello, World!")
+    assert context.stats.cache_hits == 1
+    assert context.stats.cache_misses == 1
+    assert context.stats.cache_hit_ratio == 0.5
 
     # Extra check that cache is there
     fingerprint = request_hash("https://test.com/bla", method="GET")
@@ -281,3 +418,205 @@ def test_crawl_dataset_wrapper(testdataset1: Dataset):
     testdataset1.data.format = "FAIL"
     with pytest.raises(RunFailedException):
         crawl_dataset(testdataset1)
+
+
+def test_context_fetch_many(testdataset1: Dataset):
+    context = Context(testdataset1)
+    urls = [f"https://test.com/page/{i}" for i in range(20)]
+
+    with requests_mock.Mocker() as m:
+        for i, url in enumerate(urls):
+            m.get(url, text=f"Page {i}")
+        texts = list(context.fetch_many(urls, cache_days=14, max_workers=3))
+        assert texts == [f"Page {i}" for i in range(20)]
+        assert m.call_count == 20
+        assert context.stats.http_requests == 20
+        assert context.stats.http_bytes == sum(len(t) for t in texts)
+
+        # Cached responses are served without hitting the network:
+        texts = list(context.fetch_many(urls[:5], cache_days=14))
+        assert texts == [f"Page {i}" for i in range(5)]
+        assert m.call_count == 20
+
+    with requests_mock.Mocker() as m:
+        m.post("/bla", text="Posted")
+        m.get("/bla?q=foo", text="Queried")
+        requests = [
+            {"url": "https://test.com/bla", "method": "POST", "data": {"a": "b"}},
+            {"url": "https://test.com/bla", "params": {"q": "foo"}},
+        ]
+        texts = list(context.fetch_many(requests))
+        assert texts == ["Posted", "Queried"]
+        posts = [r for r in m.request_history if r.method == "POST"]
+        assert posts[0].body == "a=b"
+
+    with requests_mock.Mocker() as m:
+        m.get("/fail", status_code=500)
+        with pytest.raises(HTTPError):
+            list(context.fetch_many(["https://test.com/fail"]))
+
+    assert testdataset1.http.max_workers == 4
+    context.close()
+
+    # HTTP traffic is counted from many threads at once:
+    stats = ContextStats()
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        for _ in range(8):
+            executor.submit(lambda: [stats.add_http(1, 10) for _ in range(10000)])
+    assert stats.http_requests == 80000
+    assert stats.http_bytes == 800000
+    get_cache.cache_clear()
+    get_engine.cache_clear()
+    get_metadata.cache_clear()
+
+
+def test_context_revalidation(testdataset1: Dataset):
+    context = Context(testdataset1)
+    url = "https://test.com/list.xml"
+    responses = [
+        {"text": "<list/>", "headers": {"ETag": '"v1"'}},
+        {"status_code": 304, "text": ""},
+        {"text": "<list>new</list>", "headers": {"Last-Modified": "Mon, 01 Jan 2024"}},
+    ]
+    with requests_mock.Mocker() as m:
+        m.get(url, responses)
+        assert context.fetch_text(url, cache_days=14) == "<list/>"
+        assert "If-None-Match" not in m.request_history[0].headers
+
+        # Zero days means the cached copy is always expired:
+        assert context.fetch_text(url, cache_days=0) == "<list/>"
+        assert m.request_history[1].headers["If-None-Match"] == '"v1"'
+        assert context.fetch_text(url, cache_days=14) == "<list/>"
+        assert m.call_count == 2
+
+        assert context.fetch_text(url, cache_days=0) == "<list>new</list>"
+        assert m.request_history[2].headers["If-None-Match"] == '"v1"'
+        fingerprint = request_hash(url)
+        validators = context.cache.get_json(validators_key(fingerprint))
+        assert validators == {"Last-Modified": "Mon, 01 Jan 2024"}
+
+    context.clear_url(fingerprint)
+    assert context.cache.get_json(validators_key(fingerprint)) is None
+
+    with requests_mock.Mocker() as m:
+        m.get(url, responses)
+        path = context.fetch_resource("list.xml", url, cache_days=1)
+        assert path.read_text() == "<list/>"
+        # Fresh files are not revalidated:
+        context.fetch_resource("list.xml", url, cache_days=1)
+        assert m.call_count == 1
+
+        os.utime(path, (0, 0))
+        path = context.fetch_resource("list.xml", url, cache_days=1)
+        assert m.request_history[1].headers["If-None-Match"] == '"v1"'
+        assert path.read_text() == "<list/>"
+        assert path.stat().st_mtime > 0
+
+        os.utime(path, (0, 0))
+        path = context.fetch_resource("list.xml", url, cache_days=1)
+        assert path.read_text() == "<list>new</list>"
+
+    context.close()
+    get_cache.cache_clear()
+    get_engine.cache_clear()
+    get_metadata.cache_clear()
+
+
+FAIL_AT_PAGE = []
+
+
+def crawl_pages(context: Context):
+    page = context.resume_state("page", 0)
+    while page < 5:
+        if page in FAIL_AT_PAGE:
+            FAIL_AT_PAGE.clear()
+            raise RuntimeError("Crawler crashed")
+        for i in range(3):
+            entity = context.make("Person")
+            entity.id = context.make_slug("page", page, i)
+            entity.add("name", f"Person {page} {i}")
+            context.emit(entity)
+        page += 1
+        if page < 3:
+            context.checkpoint("page", page)
+        else:
+            # Emitted after the last checkpoint, discarded on resume:
+            entity = context.make("Person")
+            entity.id = context.make_slug("extra", page)
+            entity.add("name", f"Extra {page}")
+            context.emit(entity)
+
+
+@pytest.mark.parametrize("background", [False, True])
+@pytest.mark.parametrize("format", ["csv", "msgpack"])
+def test_crawl_resume(
+    testdataset1: Dataset, background: bool, format: str, monkeypatch
+):
+    settings.SINK_BACKGROUND = background
+    settings.PACK_FORMAT = format
+    testdataset1.entry_point = "zavod.tests.test_context:crawl_pages"
+    try:
+        FAIL_AT_PAGE.append(4)
+        with pytest.raises(RunFailedException):
+            crawl_dataset(testdataset1)
+        context = Context(testdataset1)
+        assert context.checkpoint_path.is_file()
+
+        # The statements kept from the interrupted run get the new data time:
+        resumed_at = settings.RUN_TIME + timedelta(hours=1)
+        monkeypatch.setattr(settings, "RUN_TIME", resumed_at)
+        seen = resumed_at.isoformat(sep="T", timespec="seconds")
+        stats = crawl_dataset(testdataset1, resume=True)
+        assert stats.entities == 3 * 5 + 3
+        assert not context.checkpoint_path.is_file()
+        stmts = list(iter_dataset_statements(testdataset1))
+        assert {s.last_seen for s in stmts} == {seen}
+        assert {s.first_seen for s in stmts} == {seen}
+        ids = [s.entity_id for s in stmts]
+        entity_ids = list(dict.fromkeys(ids))
+        assert len(entity_ids) == stats.entities
+        assert len(ids) == stats.statements
+
+        # Without a checkpoint, the crawler starts over:
+        stats = crawl_dataset(testdataset1, resume=True)
+        assert stats.entities == 3 * 5 + 3
+    finally:
+        settings.SINK_BACKGROUND = False
+        settings.PACK_FORMAT = "csv"
+
+
+def partitions(context: Context):
+    return [{"page": page} for page in range(4)]
+
+
+def crawl_partition(context: Context, partition):
+    page = partition["page"]
+    for i in range(3):
+        entity = context.make("Person")
+        entity.id = context.make_slug("page", page, i)
+        entity.add("name", f"Person {page} {i}")
+        context.emit(entity, target=i == 0)
+    context.log.warning("Crawled page", page=page)
+
+
+def crawl_partitions(context: Context):
+    for partition in partitions(context):
+        crawl_partition(context, partition)
+
+
+def test_crawl_partitions(testdataset1: Dataset):
+    configure_logging()
+    testdataset1.entry_point = "zavod.tests.test_context:crawl_partitions"
+    sequential = crawl_dataset(testdataset1)
+    stats = crawl_dataset(testdataset1, workers=2)
+    assert stats.statements == sequential.statements
+    assert stats.entities == 12
+    assert stats.targets == 4
+    ids = [s.entity_id for s in iter_dataset_statements(testdataset1)]
+    expected = [f"osv-page-{p}-{i}" for p in range(4) for i in range(3)]
+    assert list(dict.fromkeys(ids)) == expected
+    assert len(ids) == stats.statements
+    context = Context(testdataset1)
+    warnings = [i for i in context.issues.all() if i["level"] == "warning"]
+    assert len(warnings) == 4
+    assert not context.partition_path(".pack", "0").exists()
@@ -0,0 +1,56 @@
+import pytest
+from copy import deepcopy
+from datapatch import Lookup, LookupException
+
+from zavod.meta.lookups import CompiledLookup
+
+CONFIG = {
+    "lowercase": True,
+    "options": [
+        {"match": ["Moorica", "United States"], "value": "us"},
+        {"match": "Germany ", "value": "de"},
+        {"match": "Banana", "normalize": True, "value": "xx"},
+        {"contains": "kingdom", "value": "gb"},
+        {"regex": "^[0-9]{4}$", "value": "year"},
+        {"match": "1990", "weight": 1, "value": "nineties"},
+        {"match": [None, ""], "value": "empty"},
+        {"match": "Wonderland", "value": "wl"},
+        {"contains": "Wonder", "value": "wonder"},
+    ],
+}
+VALUES = [
+    "moorica",
+    "UNITED STATES",
+    " germany",
+    "B-A-N-A-N-A!",
+    "banana",
+    "United Kingdom",
+    "2001",
+    "1990",
+    None,
+    "",
+    "france",
+    "foo\nmoorica",
+    "moorica\nfoo",
+]
+
+
+def test_compiled_lookup():
+    lookup = Lookup("test", deepcopy(CONFIG))
+    compiled = CompiledLookup("test", deepcopy(CONFIG))
+    assert len(compiled.fallback) == 3
+    for value in VALUES:
+        expected = lookup.match(value)
+        result = compiled.match(value)
+        if expected is None:
+            assert result is None, value
+        else:
+            assert result is not None, value
+            assert result.value == expected.value, value
+    assert compiled.unmatched == lookup.unmatched
+    assert compiled.referenced_options() == lookup.referenced_options()
+
+    with pytest.raises(LookupException):
+        compiled.match("wonderland")
+    with pytest.raises(LookupException):
+        CompiledLookup("test", {"required": True, "options": []}).match("x")
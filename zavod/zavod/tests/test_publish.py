@@ -6,6 +6,7 @@ from zavod.meta import Dataset
 from zavod.archive import get_dataset_artifact, clear_data_path
 from zavod.archive import iter_dataset_statements, iter_previous_statements
 from zavod.archive import STATISTICS_FILE, INDEX_FILE, STATEMENTS_FILE
+from zavod.archive import TIMESTAMPS_FILE
 from zavod.archive import DATASETS, ARTIFACTS, VERSIONS_FILE
 from zavod.crawl import crawl_dataset
 from zavod.store import get_store
@@ -48,6 +49,7 @@ def test_publish_dataset(testdataset1: Dataset):
     assert artifact_path.exists()
     assert artifact_path.joinpath(STATEMENTS_FILE).exists()
     assert artifact_path.joinpath(STATEMENTS_FILE).exists()
+    assert artifact_path.joinpath(TIMESTAMPS_FILE).exists()
     assert artifact_path.joinpath(STATISTICS_FILE).exists()
 
     assert release_path.joinpath(INDEX_FILE).exists()
@@ -1,4 +1,16 @@
+from typing import List
+from nomenklatura.resolver import Identifier, Linker
+from nomenklatura.versions import Version
+
 from zavod import settings
+from zavod.entity import Entity
+from zavod.archive import dataset_resource_path, publish_artifact
+from zavod.archive import publish_dataset_version, clear_data_path
+from zavod.archive import STATEMENTS_FILE, VERSIONS_FILE
+from zavod.archive import STORE_SNAPSHOT_FILE, STORE_SNAPSHOT_META
+from zavod.runtime.versions import make_version
+from zavod import store as store_module
+from zavod.archive import iter_dataset_statements
 from zavod.meta import Dataset
 from zavod.crawl import crawl_dataset
 from zavod.dedupe import get_resolver
@@ -34,3 +46,184 @@ def test_store_access(testdataset1: Dataset):
     store.clear()
     empty = store.view(testdataset1, external=False)
     assert len(list(empty.entities())) == 0
+
+
+def test_store_incremental_sync(
+    testdataset1: Dataset, testdataset2: Dataset, collection: Dataset, monkeypatch
+):
+    resolver = get_resolver()
+    crawl_dataset(testdataset1)
+    crawl_dataset(testdataset2)
+    synced: List[str] = []
+
+    def iter_statements(dataset: Dataset, external: bool = True):
+        synced.append(dataset.name)
+        return iter_dataset_statements(dataset, external=external)
+
+    monkeypatch.setattr(store_module, "iter_dataset_statements", iter_statements)
+    store = get_store(collection, resolver)
+    store.sync()
+    assert sorted(synced) == [testdataset1.name, testdataset2.name]
+    view = store.default_view(external=True)
+    count = len(list(view.entities()))
+    assert view.get_entity("osv-john-doe") is not None
+
+    # Nothing has changed:
+    synced.clear()
+    store.sync()
+    assert synced == []
+
+    # Only the leaf which was re-run is loaded again:
+    monkeypatch.setattr(settings, "RUN_VERSION", Version.new("rerun"))
+    crawl_dataset(testdataset1)
+    store.sync()
+    assert synced == [testdataset1.name]
+    view = store.default_view(external=True)
+    assert len(list(view.entities())) == count
+    assert view.get_entity("osv-john-doe") is not None
+
+    # Datasets no longer in the scope are removed:
+    store.db.put(b"leaf:other", b"1")
+    store.db.put(b"l:other:e:osv-john-doe:other", b"")
+    store.db.put(b"e:osv-john-doe:other", b"Person")
+    store.sync()
+    assert synced == [testdataset1.name]
+    assert store.db.get(b"leaf:other") is None
+    assert store.db.get(b"e:osv-john-doe:other") is None
+    assert store.db.get(b"leaf:" + testdataset1.name.encode("utf-8")) is not None
+
+    store._remove_leaf(testdataset1.name)
+    view = store.default_view(external=True)
+    assert view.get_entity("osv-john-doe") is None
+    assert len(list(view.entities())) < count
+
+    # A full rebuild:
+    synced.clear()
+    store.sync(clear=True)
+    assert sorted(synced) == [testdataset1.name, testdataset2.name]
+    view = store.default_view(external=True)
+    assert len(list(view.entities())) == count
+    store.close()
+
+
+def test_store_parallel_sync(
+    testdataset1: Dataset, testdataset2: Dataset, collection: Dataset, monkeypatch
+):
+    resolver = get_resolver()
+    crawl_dataset(testdataset1)
+    crawl_dataset(testdataset2)
+    store = get_store(collection, resolver)
+    store.sync(clear=True, workers=1)
+    with store.db.iterator() as it:
+        serial = dict(it)
+    count = len(list(store.default_view(external=True).entities()))
+
+    # Spill the sorted entries to more than one run per dataset:
+    monkeypatch.setattr(store_module, "RUN_SIZE", 50)
+    store.sync(clear=True, workers=2)
+    with store.db.iterator() as it:
+        parallel = dict(it)
+    assert parallel == serial
+    assert len(list(store.default_view(external=True).entities())) == count
+
+    # Incremental syncs of changed datasets use the workers, too:
+    crawl_dataset(testdataset2)
+    store.sync(workers=2)
+    with store.db.iterator() as it:
+        data = dict(it)
+    assert data.keys() == serial.keys()
+    store.close()
+
+
+def test_store_snapshot(
+    testdataset1: Dataset, testdataset2: Dataset, collection: Dataset, monkeypatch
+):
+    resolver = get_resolver()
+    crawl_dataset(testdataset1)
+    crawl_dataset(testdataset2)
+    store = get_store(collection, resolver)
+    store.sync(clear=True)
+    count = len(list(store.default_view(external=True).entities()))
+    store.snapshot()
+    make_version(collection, settings.RUN_VERSION, overwrite=True)
+    for name in (STORE_SNAPSHOT_FILE, STORE_SNAPSHOT_META):
+        path = dataset_resource_path(collection.name, name)
+        publish_artifact(path, collection.name, settings.RUN_VERSION, name)
+    publish_dataset_version(collection.name)
+    store.clear()
+    store.close()
+
+    synced: List[str] = []
+
+    def iter_statements(dataset: Dataset, external: bool = True):
+        synced.append(dataset.name)
+        return iter_dataset_statements(dataset, external=external)
+
+    monkeypatch.setattr(store_module, "iter_dataset_statements", iter_statements)
+    store = get_store(collection, resolver)
+    store.sync()
+    assert synced == []
+    view = store.default_view(external=True)
+    assert len(list(view.entities())) == count
+    assert view.get_entity("osv-john-doe") is not None
+
+    # Leaves which changed since the snapshot are re-loaded:
+    store.clear()
+    monkeypatch.setattr(settings, "RUN_VERSION", Version.new("rerun"))
+    crawl_dataset(testdataset2)
+    store.sync()
+    assert synced == [testdataset2.name]
+    store.close()
+
+    # A snapshot built with another linker is not used:
+    synced.clear()
+    cluster = {Identifier.get("osv-john-doe"), Identifier.get("NK-merged")}
+    linker = Linker[Entity]({node: cluster for node in cluster})
+    store = get_store(collection, linker)
+    store.clear()
+    store.sync()
+    assert sorted(synced) == [testdataset1.name, testdataset2.name]
+    store.close()
+
+
+def test_store_snapshot_published_leaves(
+    testdataset1: Dataset, testdataset2: Dataset, collection: Dataset, monkeypatch
+):
+    # The snapshot is built where the leaves were run, and used where only their
+    # published versions are available:
+    resolver = get_resolver()
+    crawl_dataset(testdataset1)
+    crawl_dataset(testdataset2)
+    store = get_store(collection, resolver)
+    store.sync(clear=True)
+    count = len(list(store.default_view(external=True).entities()))
+    store.snapshot()
+    make_version(collection, settings.RUN_VERSION, overwrite=True)
+    for name in (STORE_SNAPSHOT_FILE, STORE_SNAPSHOT_META):
+        path = dataset_resource_path(collection.name, name)
+        publish_artifact(path, collection.name, settings.RUN_VERSION, name)
+    publish_dataset_version(collection.name)
+    store.clear()
+    store.close()
+    for leaf in (testdataset1, testdataset2):
+        for name in (STATEMENTS_FILE, VERSIONS_FILE):
+            path = dataset_resource_path(leaf.name, name)
+            publish_artifact(path, leaf.name, settings.RUN_VERSION, name)
+        publish_dataset_version(leaf.name)
+        clear_data_path(leaf.name)
+        assert not dataset_resource_path(leaf.name, STATEMENTS_FILE).exists()
+
+    synced: List[str] = []
+
+    def iter_statements(dataset: Dataset, external: bool = True):
+        synced.append(dataset.name)
+        return iter_dataset_statements(dataset, external=external)
+
+    monkeypatch.setattr(store_module, "iter_dataset_statements", iter_statements)
+    store = get_store(collection, resolver)
+    store.sync()
+    assert synced == []
+    view = store.default_view(external=True)
+    assert len(list(view.entities())) == count
+    assert view.get_entity("osv-john-doe") is not None
+    store.close()
@@ -0,0 +1,63 @@
+from zavod.meta import Dataset
+from zavod.crawl import crawl_dataset
+from zavod.archive import iter_dataset_statements, dataset_resource_path
+from zavod.archive import STATEMENTS_FILE
+from zavod.archive.pack import PACK_MAGIC, BINARY_PACK, CSV_PACK
+from zavod.archive.pack import BinaryPackWriter, read_pack_statements
+from zavod.tools.convert_pack import convert_pack, benchmark_pack
+
+
+def test_convert_pack(testdataset1: Dataset):
+    crawl_dataset(testdataset1)
+    stmts = list(iter_dataset_statements(testdataset1))
+    assert len(stmts) > 0
+    path = dataset_resource_path(testdataset1.name, STATEMENTS_FILE)
+    csv_size = path.stat().st_size
+
+    convert_pack(testdataset1, BINARY_PACK)
+    with open(path, "rb") as fh:
+        assert fh.read(len(PACK_MAGIC)) == PACK_MAGIC
+    assert path.stat().st_size < csv_size
+    converted = list(iter_dataset_statements(testdataset1))
+    assert len(converted) == len(stmts)
+    for orig, conv in zip(stmts, converted):
+        assert orig.to_dict() == conv.to_dict()
+    internal = list(iter_dataset_statements(testdataset1, external=False))
+    assert len(internal) == len([s for s in stmts if not s.external])
+
+    results = benchmark_pack(testdataset1)
+    assert results[CSV_PACK]["statements"] == len(stmts)
+    assert results[BINARY_PACK]["statements"] == len(stmts)
+
+    convert_pack(testdataset1, CSV_PACK)
+    assert path.stat().st_size == csv_size
+    assert len(list(iter_dataset_statements(testdataset1))) == len(stmts)
+
+
+def test_binary_pack_append(testdataset1: Dataset):
+    crawl_dataset(testdataset1)
+    stmts = list(iter_dataset_statements(testdataset1))
+    path = dataset_resource_path(testdataset1.name, "test.pack")
+    with open(path, "wb") as fh:
+        writer = BinaryPackWriter(fh)
+        for stmt in stmts[:5]:
+            writer.write(stmt)
+        writer.close()
+    size = path.stat().st_size
+    with open(path, "ab") as fh:
+        writer = BinaryPackWriter(fh, header=False)
+        for stmt in stmts[5:]:
+            writer.write(stmt)
+        writer.close()
+    with open(path, "rb") as fh:
+        assert len(list(read_pack_statements(fh))) == len(stmts)
+
+    # A partially written batch at the end of the file is skipped:
+    with open(path, "r+b") as fh:
+        fh.truncate(path.stat().st_size - 10)
+    with open(path, "rb") as fh:
+        assert len(list(read_pack_statements(fh))) == 5
+    with open(path, "r+b") as fh:
+        fh.truncate(size)
+    with open(path, "rb") as fh:
+        assert len(list(read_pack_statements(fh))) == 5
@@ -0,0 +1,97 @@
+import os
+import time
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Any, Dict
+
+from zavod.logs import get_logger
+from zavod.meta import Dataset
+from zavod.archive import dataset_resource_path, STATEMENTS_FILE
+from zavod.archive.pack import PACK_FORMATS, get_pack_writer, read_pack_statements
+
+log = get_logger(__name__)
+
+
+def convert_pack_file(in_path: Path, out_path: Path, format: str) -> int:
+    """Copy the statements in a pack file to another pack file in the given format.
+
+    Args:
+        in_path: The pack file to read, in any supported format.
+        out_path: The pack file to write.
+        format: The format of the output file, `csv` or `msgpack`.
+
+    Returns:
+        The number of statements written.
+    """
+    count = 0
+    with open(in_path, "rb") as in_fh:
+        out_fh = open(out_path, "wb")
+        writer = get_pack_writer(out_fh, format)
+        for stmt in read_pack_statements(in_fh):
+            writer.write(stmt)
+            count += 1
+        writer.close()
+    return count
+
+
+def convert_pack(dataset: Dataset, format: str) -> None:
+    """Convert the local statements pack of a dataset to the given format,
+    replacing the existing file.
+
+    Args:
+        dataset: The dataset whose statements should be converted.
+        format: The format of the output file, `csv` or `msgpack`.
+    """
+    path = dataset_resource_path(dataset.name, STATEMENTS_FILE)
+    if not path.exists():
+        raise FileNotFoundError(f"Statements not found: {dataset.name}")
+    tmp_path = path.with_name(f".{path.name}.{format}")
+    count = convert_pack_file(path, tmp_path, format)
+    os.replace(tmp_path, path)
+    log.info(
+        "Converted statements pack",
+        dataset=dataset.name,
+        format=format,
+        statements=count,
+        size=path.stat().st_size,
+    )
+
+
+def benchmark_pack(dataset: Dataset) -> Dict[str, Dict[str, Any]]:
+    """Compare the file size and read throughput of the statements pack of a
+    dataset in each of the supported formats.
+
+    Args:
+        dataset: The dataset whose statements pack should be used.
+
+    Returns:
+        A dictionary with the size, read time and statements per second, keyed
+        by format.
+    """
+    path = dataset_resource_path(dataset.name, STATEMENTS_FILE)
+    if not path.exists():
+        raise FileNotFoundError(f"Statements not found: {dataset.name}")
+    results: Dict[str, Dict[str, Any]] = {}
+    with TemporaryDirectory() as tmp_dir:
+        for format in PACK_FORMATS:
+            format_path = Path(tmp_dir) / f"statements.{format}"
+            convert_pack_file(path, format_path, format)
+            start = time.perf_counter()
+            count = 0
+            with open(format_path, "rb") as fh:
+                for _ in read_pack_statements(fh):
+                    count += 1
+            elapsed = time.perf_counter() - start
+            results[format] = {
+                "size": format_path.stat().st_size,
+                "statements": count,
+                "seconds": elapsed,
+                "per_second": count / elapsed if elapsed > 0 else None,
+            }
+            log.info(
+                "Read statements pack",
+                dataset=dataset.name,
+                format=format,
+                **results[format],
+            )
+    return results